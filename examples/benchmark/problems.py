@@ -0,0 +1,153 @@
+from __future__ import print_function
+
+import os
+import random
+from collections import namedtuple
+
+import numpy as np
+
+from pddlstream.language.stream import StreamInfo
+from pddlstream.utils import read
+
+# Parametric problem generators for the benchmark suite
+# Each generator maps a size (and the already seeded random state) to a Benchmark
+
+FOCUSED = 'focused'
+INCREMENTAL = 'incremental'
+EXHAUSTIVE = 'exhaustive'
+PDDL = 'pddl' # Pure PDDL problems solved by solve_from_pddl
+
+STREAM_ALGORITHMS = [FOCUSED, INCREMENTAL, EXHAUSTIVE]
+
+Benchmark = namedtuple('Benchmark', ['problem', 'stream_info', 'algorithms'])
+
+def read_example(example, filename):
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return read(os.path.join(directory, example, filename))
+
+##################################################
+
+def get_continuous_tamp(size):
+    from examples.continuous_tamp.primitives import get_tight_problem
+    from examples.continuous_tamp.run import pddlstream_from_tamp
+    tamp_problem = get_tight_problem(n_blocks=size, n_goals=min(2, size))
+    stream_info = {
+        't-region': StreamInfo(eager=True, p_success=0),
+        't-cfree': StreamInfo(eager=False, negate=True),
+    }
+    return Benchmark(pddlstream_from_tamp(tamp_problem), stream_info, [FOCUSED])
+
+
+def get_discrete_tamp(size):
+    from examples.discrete_tamp.run import pddlstream_from_tamp, get_shift_all_problem
+    tamp_problem = get_shift_all_problem(n_blocks=size, n_poses=size + 7)
+    stream_info = {
+        'test-cfree': StreamInfo(negate=True),
+    }
+    return Benchmark(pddlstream_from_tamp(tamp_problem), stream_info, STREAM_ALGORITHMS)
+
+
+def get_motion(size, max_distance=0.5):
+    from examples.motion.run import create_problem
+    from examples.motion.viewer import create_box
+    # Goal regions of decreasing size spread along the diagonal
+    regions = {'env': create_box((.5, .5), (1, 1))}
+    for i in range(size):
+        center = (i + 1.) / (size + 1)
+        regions['r{}'.format(i)] = create_box((center, center), (.5 / size, .5 / size))
+    obstacles = [create_box((.5, .5), (.2, .2))]
+    problem, _ = create_problem('r{}'.format(size - 1), obstacles, regions, max_distance=max_distance)
+    return Benchmark(problem, {}, [FOCUSED, INCREMENTAL])
+
+
+def get_blocksworld(size):
+    # A tower of size blocks that is reversed
+    domain_pddl = read_example('blocksworld', 'domain.pddl')
+    blocks = ['b{}'.format(i) for i in range(size)]
+    init = [('arm-empty',), ('on-table', blocks[0]), ('clear', blocks[-1])] + \
+           [('on', b2, b1) for b1, b2 in zip(blocks, blocks[1:])]
+    goal = ('and', ('on-table', blocks[-1])) + tuple(('on', b1, b2) for b1, b2 in zip(blocks, blocks[1:]))
+    problem = (domain_pddl, {}, None, {}, init, goal)
+    return Benchmark(problem, {}, STREAM_ALGORITHMS)
+
+##################################################
+
+def get_rovers_pddl(n_rovers, n_waypoints, n_objectives, n_goals):
+    waypoints = ['waypoint{}'.format(i) for i in range(n_waypoints)]
+    rovers = ['rover{}'.format(i) for i in range(n_rovers)]
+    objectives = ['objective{}'.format(i) for i in range(n_objectives)]
+    modes = ['colour', 'high_res', 'low_res']
+    # A random spanning tree plus extra edges keeps the waypoints connected
+    edges = set()
+    for i in range(1, n_waypoints):
+        j = random.randint(0, i - 1)
+        edges.update({(i, j), (j, i)})
+    for _ in range(n_waypoints):
+        i, j = random.sample(range(n_waypoints), 2)
+        edges.update({(i, j), (j, i)})
+    soil = random.sample(waypoints, max(1, n_waypoints // 2))
+    rock = random.sample(waypoints, max(1, n_waypoints // 2))
+
+    init = ['(at_lander general {})'.format(waypoints[0]), '(channel_free general)']
+    init.extend('(visible {} {})'.format(waypoints[i], waypoints[j]) for i, j in sorted(edges))
+    init.extend('(at_soil_sample {})'.format(w) for w in soil)
+    init.extend('(at_rock_sample {})'.format(w) for w in rock)
+    for r in rovers:
+        init.extend([
+            '(at {} {})'.format(r, random.choice(waypoints)),
+            '(available {})'.format(r),
+            '(store_of {}store {})'.format(r, r),
+            '(empty {}store)'.format(r),
+            '(equipped_for_soil_analysis {})'.format(r),
+            '(equipped_for_rock_analysis {})'.format(r),
+            '(equipped_for_imaging {})'.format(r),
+            '(on_board camera{} {})'.format(r, r),
+            '(calibration_target camera{} {})'.format(r, random.choice(objectives)),
+        ])
+        init.extend('(supports camera{} {})'.format(r, m) for m in modes)
+        init.extend('(can_traverse {} {} {})'.format(r, waypoints[i], waypoints[j]) for i, j in sorted(edges))
+    for o in objectives:
+        init.extend('(visible_from {} {})'.format(o, w) for w in random.sample(waypoints, max(1, n_waypoints // 2)))
+
+    goals = ['(communicated_soil_data {})'.format(w) for w in soil] + \
+            ['(communicated_rock_data {})'.format(w) for w in rock] + \
+            ['(communicated_image_data {} {})'.format(o, random.choice(modes)) for o in objectives]
+    goals = random.sample(goals, min(n_goals, len(goals)))
+
+    objects = ['general - Lander', '{} - Mode'.format(' '.join(modes)),
+               '{} - Rover'.format(' '.join(rovers)),
+               '{} - Store'.format(' '.join('{}store'.format(r) for r in rovers)),
+               '{} - Waypoint'.format(' '.join(waypoints)),
+               '{} - Camera'.format(' '.join('camera{}'.format(r) for r in rovers)),
+               '{} - Objective'.format(' '.join(objectives))]
+    return '(define (problem rovers{}) (:domain Rover)\n(:objects\n\t{}\n)\n(:init\n\t{}\n)\n' \
+           '(:goal (and\n\t{}\n))\n)\n'.format(n_rovers, '\n\t'.join(objects),
+                                            '\n\t'.join(init), '\n\t'.join(goals))
+
+
+def get_rovers(size):
+    domain_pddl = read_example(os.path.join('ipc', 'rovers'), 'domain.pddl')
+    problem_pddl = get_rovers_pddl(n_rovers=size, n_waypoints=4*size, n_objectives=2*size, n_goals=3*size)
+    return Benchmark((domain_pddl, problem_pddl), {}, [PDDL])
+
+##################################################
+
+BENCHMARKS = {
+    'blocksworld': get_blocksworld,
+    'continuous_tamp': get_continuous_tamp,
+    'discrete_tamp': get_discrete_tamp,
+    'motion': get_motion,
+    'rovers': get_rovers,
+}
+
+DEFAULT_SIZES = {
+    'blocksworld': [2, 4, 6],
+    'continuous_tamp': [1, 2, 3],
+    'discrete_tamp': [1, 2, 3],
+    'motion': [1, 2, 4],
+    'rovers': [1, 2, 3],
+}
+
+def set_seed(seed):
+    random.seed(seed)
+    np.random.seed(seed)
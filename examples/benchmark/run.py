@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None # Windows
+
+from examples.benchmark.problems import BENCHMARKS, DEFAULT_SIZES, FOCUSED, INCREMENTAL, EXHAUSTIVE, PDDL, \
+    set_seed
+from pddlstream.algorithms.downward import original_argv
+from pddlstream.algorithms.focused import solve_focused
+from pddlstream.algorithms.incremental import solve_incremental, solve_exhaustive
+from pddlstream.algorithms.search import solve_from_pddl
+from pddlstream.profiling import reset_trace, get_trace, EXTERNAL
+from pddlstream.utils import INF, Verbose, ensure_dir, elapsed_time, read
+
+# Runs each (benchmark, size, algorithm, seed) in a fresh process to isolate its peak memory and global state
+# python -m examples.benchmark.run -o results.json -b baseline.json
+
+RESULTS_PATH = 'benchmarks/results.json'
+METRICS = ['time', 'peak_rss', 'iterations', 'stream_calls', 'search_calls']
+
+def get_peak_rss(who):
+    # Megabytes
+    if resource is None:
+        return None
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / float(2**20 if sys.platform == 'darwin' else 2**10)
+
+
+def solve_benchmark(benchmark, algorithm, max_time):
+    if algorithm == PDDL:
+        domain_pddl, problem_pddl = benchmark.problem
+        plan, cost = solve_from_pddl(domain_pddl, problem_pddl, max_planner_time=max_time)
+        return plan, cost
+    if algorithm == FOCUSED:
+        solution = solve_focused(benchmark.problem, stream_info=benchmark.stream_info,
+                                 max_time=max_time, verbose=False)
+    elif algorithm == INCREMENTAL:
+        solution = solve_incremental(benchmark.problem, max_time=max_time, verbose=False)
+    elif algorithm == EXHAUSTIVE:
+        solution = solve_exhaustive(benchmark.problem, max_time=max_time, verbose=False)
+    else:
+        raise ValueError(algorithm)
+    plan, cost, _ = solution
+    return plan, cost
+
+
+def run_benchmark(name, size, algorithm, seed, max_time, verbose):
+    # Executed within a child process
+    record = {'benchmark': name, 'size': size, 'algorithm': algorithm, 'seed': seed}
+    set_seed(seed)
+    benchmark = BENCHMARKS[name](size)
+    reset_trace()
+    start_time = time.time()
+    with Verbose(verbose):
+        plan, cost = solve_benchmark(benchmark, algorithm, max_time)
+    trace = get_trace()
+    record.update({
+        'solved': plan is not None,
+        'cost': cost if cost < INF else None,
+        'length': None if plan is None else len(plan),
+        'time': elapsed_time(start_time),
+        'peak_rss': get_peak_rss(resource.RUSAGE_SELF) if resource else None,
+        'children_peak_rss': get_peak_rss(resource.RUSAGE_CHILDREN) if resource else None,
+        'iterations': len([span for span in trace if span.name == 'iteration']),
+        'stream_calls': len([span for span in trace if span.category == EXTERNAL]),
+        'search_calls': len([span for span in trace if span.name == 'search']),
+    })
+    return record
+
+
+def child_process(queue, *args):
+    try:
+        queue.put(run_benchmark(*args))
+    except Exception as e:
+        queue.put({'error': '{}: {}'.format(e.__class__.__name__, e)})
+
+
+def run_isolated(name, size, algorithm, seed, max_time, timeout, verbose):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=child_process,
+                                      args=(queue, name, size, algorithm, seed, max_time, verbose))
+    start_time = time.time()
+    process.start()
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        return {'benchmark': name, 'size': size, 'algorithm': algorithm, 'seed': seed,
+                'solved': False, 'time': elapsed_time(start_time), 'error': 'Timeout'}
+    record = {'benchmark': name, 'size': size, 'algorithm': algorithm, 'seed': seed}
+    if queue.empty():
+        record.update({'solved': False, 'error': 'Exit code {}'.format(process.exitcode)})
+    else:
+        record.update(queue.get())
+    return record
+
+##################################################
+
+def get_key(record):
+    return record['benchmark'], record['algorithm'], record['size'], record['seed']
+
+
+def find_regressions(results, baseline, metrics=METRICS, threshold=0.25, min_time=0.1):
+    """
+    Compares results against a baseline
+    :param threshold: the allowed fractional increase of each metric
+    :param min_time: times below this (in seconds) are too noisy to compare
+    :return: a list of strings describing each regression
+    """
+    baseline_from_key = {get_key(record): record for record in baseline}
+    regressions = []
+    for record in results:
+        key = get_key(record)
+        if key not in baseline_from_key:
+            continue
+        previous = baseline_from_key[key]
+        if previous.get('solved') and not record.get('solved'):
+            regressions.append('{}: no longer solved ({})'.format(key, record.get('error')))
+            continue
+        for metric in metrics:
+            old, new = previous.get(metric), record.get(metric)
+            if (old is None) or (new is None) or (metric == 'time' and new < min_time):
+                continue
+            if (1 + threshold)*old < new:
+                regressions.append('{}: {} increased from {:.3f} to {:.3f} ({:+.0%})'.format(
+                    key, metric, old, new, (new - old) / max(old, 1e-6)))
+    return regressions
+
+
+def write_results(filename, results):
+    if os.path.dirname(filename):
+        ensure_dir(filename)
+    data = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'results': results,
+    }
+    with open(filename, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def read_results(filename):
+    return json.loads(read(filename))['results']
+
+##################################################
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the PDDLStream algorithms on scalable examples')
+    parser.add_argument('-p', '--problems', nargs='+', default=sorted(BENCHMARKS), choices=sorted(BENCHMARKS))
+    parser.add_argument('-a', '--algorithms', nargs='+', default=None,
+                        choices=[FOCUSED, INCREMENTAL, EXHAUSTIVE, PDDL],
+                        help='defaults to every algorithm that supports each problem')
+    parser.add_argument('-n', '--sizes', nargs='+', type=int, default=None)
+    parser.add_argument('-s', '--seeds', nargs='+', type=int, default=[0])
+    parser.add_argument('-t', '--max_time', type=float, default=60, help='the max_time passed to the algorithm')
+    parser.add_argument('-o', '--output', default=RESULTS_PATH)
+    parser.add_argument('-b', '--baseline', default=None, help='a previous output to compare against')
+    parser.add_argument('-r', '--threshold', type=float, default=0.25,
+                        help='the allowed fractional increase before a regression is reported')
+    parser.add_argument('-m', '--metrics', nargs='+', default=METRICS, choices=METRICS)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(original_argv[1:]) # FastDownward overwrites sys.argv
+
+    results = []
+    for name in args.problems:
+        for size in (args.sizes or DEFAULT_SIZES[name]):
+            set_seed(0)
+            supported = BENCHMARKS[name](size).algorithms
+            for algorithm in (args.algorithms or supported):
+                if algorithm not in supported:
+                    continue
+                for seed in args.seeds:
+                    record = run_isolated(name, size, algorithm, seed, args.max_time,
+                                          timeout=2*args.max_time + 60, verbose=args.verbose)
+                    print('{benchmark} | size={size} | {algorithm} | seed={seed} | solved={solved} | '
+                          'time={time:.3f}'.format(**dict({'solved': False, 'time': float('nan')}, **record)),
+                          '| error={}'.format(record['error']) if 'error' in record else '')
+                    results.append(record)
+    write_results(args.output, results)
+    print('Saved', args.output)
+
+    if args.baseline is None:
+        return
+    regressions = find_regressions(results, read_results(args.baseline),
+                                   metrics=args.metrics, threshold=args.threshold)
+    for regression in regressions:
+        print('Regression:', regression)
+    if regressions:
+        sys.exit(1)
+    print('No regressions relative to', args.baseline)
+
+if __name__ == '__main__':
+    main()
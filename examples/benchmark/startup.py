@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import subprocess
+import sys
+import time
+
+# Checks that importing pddlstream stays cheap for short-lived CLI and worker processes
+# python -m examples.benchmark.startup -m pddlstream.algorithms.focused -t 0.5
+# The default modules are also checked by tests/test_startup.py
+
+DEFAULT_MODULES = ['pddlstream.algorithms.focused', 'pddlstream.algorithms.incremental']
+STARTUP_BUDGET = 0.5 # Seconds (median over the repetitions)
+TRANSLATOR_MODULES = ['pddl', 'pddl_parser', 'normalize', 'instantiate', 'translate']
+
+def time_import(module):
+    # A fresh interpreter so that nothing is already imported
+    start_time = time.time()
+    subprocess.check_call([sys.executable, '-c', 'import {}'.format(module)])
+    return time.time() - start_time
+
+def get_baseline():
+    return time_import('os')
+
+def get_imported_translator(module):
+    # The translator must be imported lazily
+    output = subprocess.check_output([sys.executable, '-c',
+        'import sys, {}; print(" ".join(m for m in {} if m in sys.modules))'.format(module, TRANSLATOR_MODULES)])
+    return output.decode('utf-8').split()
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+##################################################
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the time to import pddlstream modules')
+    parser.add_argument('-m', '--modules', nargs='+', default=DEFAULT_MODULES)
+    parser.add_argument('-n', '--repetitions', type=int, default=5)
+    parser.add_argument('-t', '--budget', type=float, default=STARTUP_BUDGET,
+                        help='the allowed import time in excess of the bare interpreter startup')
+    args = parser.parse_args()
+
+    baseline = median([get_baseline() for _ in range(args.repetitions)])
+    print('Interpreter: {:.3f}'.format(baseline))
+    failures = []
+    for module in args.modules:
+        runtime = median([time_import(module) for _ in range(args.repetitions)]) - baseline
+        translator = get_imported_translator(module)
+        print('{} | import: {:.3f} | translator: {}'.format(module, runtime, translator))
+        if args.budget < runtime:
+            failures.append('{} took {:.3f} > {:.3f} seconds'.format(module, runtime, args.budget))
+        if translator:
+            failures.append('{} imported the translator: {}'.format(module, translator))
+    for failure in failures:
+        print('Failure:', failure)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
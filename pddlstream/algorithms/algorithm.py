@@ -1,19 +1,23 @@
 import time
-from collections import OrderedDict, deque, namedtuple
+from collections import deque, namedtuple
+from functools import wraps
 
-from pddlstream.algorithms.downward import parse_domain, get_problem, task_from_domain_problem, \
-    parse_lisp, sas_from_pddl
+from pddlstream.algorithms.downward import get_problem, sas_from_instantiated
+from pddlstream.algorithms.parse_cache import load_domain, load_lisp
 from pddlstream.algorithms.search import abstrips_solve_from_task
+from pddlstream.algorithms.translator import instantiate_domain_problem
 from pddlstream.language.constants import get_prefix, get_args
+from pddlstream.language.evaluations import EvaluationStore
 from pddlstream.language.conversion import obj_from_value_expression, obj_from_pddl_plan, \
     evaluation_from_fact, substitute_expression
 from pddlstream.language.exogenous import compile_to_exogenous, replace_literals
 from pddlstream.language.external import External, DEBUG, get_plan_effort
 from pddlstream.language.function import parse_function, parse_predicate, Function, Predicate
-from pddlstream.language.object import Object
+from pddlstream.language.object import Object, SolveScope, reset_objects, in_outermost_solve
 from pddlstream.language.rule import parse_rule
 from pddlstream.language.stream import parse_stream, Stream
-from pddlstream.utils import elapsed_time, INF, get_mapping, find_unique, get_length, str_from_plan
+from pddlstream.profiling import add_span, reset_trace
+from pddlstream.utils import elapsed_time, INF, get_mapping, find_unique, get_length, str_from_plan, Verbose
 from pddlstream.language.optimizer import parse_optimizer, VariableStream, ConstraintStream
 
 # TODO: way of programmatically specifying streams/actions
@@ -40,17 +44,36 @@ def parse_constants(domain, constant_map):
     del domain.constants[:] # So not set twice
     return obj_from_constant
 
+def solve_scope(solve):
+    # Decorates the solve functions so that parse_problem can tell whether they are nested
+    @wraps(solve)
+    def wrapper(*args, **kwargs):
+        with SolveScope():
+            return solve(*args, **kwargs)
+    return wrapper
+
 def parse_problem(problem, stream_info={}):
+    """
+    Parses a PDDLStream problem into evaluations, a goal expression, a domain, and externals
+    Only the outermost solve (outside of an ObjectScope) resets the objects and trace from previous solves,
+    so a solve nested within another (e.g. called from a stream) keeps the enclosing solve's objects
+    A solve that starts while another thread is solving shares that solve's objects instead of resetting them
+    """
     # TODO: just return the problem if already written programmatically
     domain_pddl, constant_map, stream_pddl, stream_map, init, goal = problem
-    domain = parse_domain(domain_pddl)
+    if in_outermost_solve():
+        reset_objects() # Objects from previous solves are released
+        reset_trace()
+    start_time = time.time()
+    domain = load_domain(domain_pddl)
     if len(domain.types) != 1:
         raise NotImplementedError('Types are not currently supported')
     parse_constants(domain, constant_map)
     streams = parse_stream_pddl(stream_pddl, stream_map, stream_info)
-    evaluations = OrderedDict((evaluation_from_fact(obj_from_value_expression(f)), INITIAL_EVALUATION) for f in init)
+    evaluations = EvaluationStore((evaluation_from_fact(obj_from_value_expression(f)), INITIAL_EVALUATION) for f in init)
     goal_expression = obj_from_value_expression(goal)
     compile_to_exogenous(evaluations, domain, streams)
+    add_span('parse', start_time)
     return evaluations, goal_expression, domain, streams
 
 ##################################################
@@ -65,41 +88,50 @@ def solve_finite(evaluations, goal_expression, domain, unit_costs=None, debug=Fa
     if unit_costs is None:
         unit_costs = not has_costs(domain)
     problem = get_problem(evaluations, goal_expression, domain, unit_costs)
-    task = task_from_domain_problem(domain, problem)
-    sas_task = sas_from_pddl(task, debug=debug)
+    with Verbose(debug):
+        # The evaluations only grow across solve_incremental iterations
+        sas_task = sas_from_instantiated(instantiate_domain_problem(domain, problem))
     plan_pddl, cost = abstrips_solve_from_task(sas_task, debug=debug, **kwargs)
     return obj_from_pddl_plan(plan_pddl), cost
 
 ##################################################
 
-Solution = namedtuple('Solution', ['plan', 'cost'])
+Solution = namedtuple('Solution', ['plan', 'cost', 'time'])
 
 class SolutionStore(object):
-    def __init__(self, max_time, max_cost, verbose):
+    def __init__(self, max_time, max_cost, verbose, anytime=False, solution_fn=None, stop_event=None):
         # TODO: store evaluations here as well as map from head to value?
         self.start_time = time.time()
         self.max_time = max_time
         #self.cost_fn = get_length if unit_costs else None
         self.max_cost = max_cost
         self.verbose = verbose
+        self.anytime = anytime # Continues improving after a plan below max_cost is found
+        self.solution_fn = solution_fn # Called with each Solution that improves on the best cost
+        self.stop_event = stop_event # Terminates the solve once set (e.g. by another thread)
         self.best_plan = None
         self.best_cost = INF
         #self.best_cost = self.cost_fn(self.best_plan)
         self.solutions = []
     def add_plan(self, plan, cost):
         # TODO: double-check that this is a solution
-        self.solutions.append(Solution(plan, cost))
+        solution = Solution(plan, cost, self.elapsed_time())
+        self.solutions.append(solution)
         if cost < self.best_cost:
             self.best_plan = plan
             self.best_cost = cost
+            if self.solution_fn is not None:
+                self.solution_fn(solution)
     def is_solved(self):
         return self.best_cost < self.max_cost
     def elapsed_time(self):
         return elapsed_time(self.start_time)
     def is_timeout(self):
         return self.max_time <= self.elapsed_time()
+    def is_stopped(self):
+        return (self.stop_event is not None) and self.stop_event.is_set()
     def is_terminated(self):
-        return self.is_solved() or self.is_timeout()
+        return (self.is_solved() and not self.anytime) or self.is_timeout() or self.is_stopped()
 
 def add_facts(evaluations, fact, result=None):
     new_evaluations = []
@@ -161,7 +193,7 @@ def apply_rules_to_streams(rules, streams):
                             processed_rules.append(stream)
 
 def parse_streams(streams, rules, stream_pddl, procedure_map, procedure_info):
-    stream_iter = iter(parse_lisp(stream_pddl))
+    stream_iter = iter(load_lisp(stream_pddl))
     assert('define' == next(stream_iter))
     pddl_type, pddl_name = next(stream_iter)
     assert('stream' == pddl_type)
@@ -0,0 +1,122 @@
+from __future__ import print_function
+
+import os
+import pickle
+import time
+from collections import namedtuple
+
+from pddlstream.language.external import External
+from pddlstream.language.object import get_object_state, set_object_state
+from pddlstream.language.stream import Stream
+from pddlstream.utils import ensure_dir, safe_remove, elapsed_time
+
+# A checkpoint pickles the state of a focused solve at an iteration boundary so that it can be resumed in a new process
+# Externals are pickled by name and re-bound to the newly parsed externals, so procedures need not be picklable
+# Stream generators and in-flight calls are not pickled, so resumed instances restart their generators
+# (unless they were replayed from a ResultCache, in which case they are enumerated once the cache is exhausted)
+# The domain is parsed again, so only the axioms added while disabling instances are pickled
+
+CHECKPOINT_VERSION = 4 # Increment when the pickled format changes
+EXTERNAL_ID = 'external'
+ONLINE_ATTRIBUTES = ['online_calls', 'online_overhead', 'online_success'] # Written to the statistics upon completion
+STATISTICS_ATTRIBUTES = ['total_calls', 'total_overhead', 'total_successes'] + ONLINE_ATTRIBUTES
+STORE_ATTRIBUTES = ['best_plan', 'best_cost', 'solutions']
+QUEUE_ATTRIBUTES = ['queue', 'skeleton_plans', 'added'] # The added keys are digests of object names
+
+Checkpoint = namedtuple('Checkpoint', ['evaluations', 'goal_expression', 'queue', 'disabled',
+                                       'num_iterations', 'search_time', 'sample_time'])
+
+def get_attributes(obj, attributes):
+    return {attribute: getattr(obj, attribute) for attribute in attributes}
+
+def set_attributes(obj, values):
+    for attribute, value in values.items():
+        setattr(obj, attribute, value)
+
+def get_external_attributes(external):
+    attributes = STATISTICS_ATTRIBUTES + ['instances']
+    if isinstance(external, Stream):
+        attributes.append('disabled_instances')
+    return attributes
+
+##################################################
+
+class CheckpointPickler(pickle.Pickler):
+    def __init__(self, f, externals):
+        pickle.Pickler.__init__(self, f, pickle.HIGHEST_PROTOCOL)
+        self.external_from_name = {external.name: external for external in externals}
+    def persistent_id(self, obj):
+        # Externals created during the solve (e.g. for optimizers) are pickled by value
+        if isinstance(obj, External) and (self.external_from_name.get(obj.name) is obj):
+            return EXTERNAL_ID, obj.name
+        return None
+
+class CheckpointUnpickler(pickle.Unpickler):
+    def __init__(self, f, externals):
+        pickle.Unpickler.__init__(self, f)
+        self.external_from_name = {external.name: external for external in externals}
+    def persistent_load(self, pid):
+        kind, name = pid
+        if (kind != EXTERNAL_ID) or (name not in self.external_from_name):
+            raise pickle.UnpicklingError('Checkpoint references an unknown external: {}'.format(name))
+        return self.external_from_name[name]
+
+##################################################
+
+def save_checkpoint(path, store, queue, disabled, externals, axioms,
+                    num_iterations=0, search_time=0, sample_time=0, flushed=False):
+    """
+    Writes the state of a focused solve to path
+    :param axioms: the axioms added to the domain since it was parsed
+    :param flushed: if True, the solve writes its online statistics after this checkpoint (e.g. the final one),
+        so a resumed solve starts its online statistics from zero rather than writing them again
+    :return: True if the checkpoint was written
+    """
+    start_time = time.time()
+    state = {
+        'version': CHECKPOINT_VERSION,
+        'objects': get_object_state(),
+        'externals': {external.name: get_attributes(external, get_external_attributes(external))
+                      for external in externals},
+        'axioms': list(axioms),
+        'flushed': flushed,
+        'store': get_attributes(store, STORE_ATTRIBUTES),
+        'checkpoint': Checkpoint(queue.evaluations, queue.goal_expression,
+                                 get_attributes(queue, QUEUE_ATTRIBUTES),
+                                 disabled, num_iterations, search_time, sample_time),
+    }
+    ensure_dir(path)
+    temp_path = '{}.{}'.format(path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as f:
+            CheckpointPickler(f, externals).dump(state)
+        os.rename(temp_path, path) # Atomic so that a preempted write never replaces the previous checkpoint
+    except (pickle.PicklingError, TypeError, AttributeError, RuntimeError, IOError, OSError) as e:
+        # Values (e.g. stream outputs) that cannot be pickled or are too deeply nested
+        print('Warning, unable to write checkpoint {}: {}'.format(path, e))
+        safe_remove(temp_path)
+        return False
+    if store.verbose:
+        print('Checkpoint: {} | Iteration: {} | Time: {:.3f}'.format(path, num_iterations, elapsed_time(start_time)))
+    return True
+
+def load_checkpoint(path, store, externals, domain):
+    """
+    Restores the objects, externals, domain axioms, and solutions from a checkpoint written by save_checkpoint
+    Externals are matched by name, so the problem must be parsed (with the new stream procedures) beforehand
+    :return: a Checkpoint with the remaining state
+    """
+    with open(path, 'rb') as f:
+        state = CheckpointUnpickler(f, externals).load()
+    if state['version'] != CHECKPOINT_VERSION:
+        raise ValueError('Checkpoint {} has version {} instead of {}'.format(
+            path, state['version'], CHECKPOINT_VERSION))
+    set_object_state(state['objects'])
+    for external in externals:
+        if external.name in state['externals']:
+            set_attributes(external, state['externals'][external.name])
+            if state['flushed']:
+                set_attributes(external, {attribute: 0 for attribute in ONLINE_ATTRIBUTES})
+    domain.axioms.extend(state['axioms'])
+    set_attributes(store, state['store'])
+    return state['checkpoint']
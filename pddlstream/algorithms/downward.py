@@ -2,14 +2,24 @@ from __future__ import print_function
 
 import os
 import re
+import shlex
+import subprocess
 import sys
 from collections import namedtuple
+from importlib import import_module
 from time import time
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 from pddlstream.language.constants import EQ, NOT, Head, Evaluation, get_prefix, get_args
 from pddlstream.language.conversion import is_atom, is_negated_atom, objects_from_evaluations, pddl_from_object, \
-    pddl_list_from_expression, obj_from_pddl
-from pddlstream.utils import read, write, INF, Verbose, clear_dir, get_file_path, MockSet, find_unique, int_ceil
+    pddl_list_from_expression, obj_from_pddl, fact_from_evaluation, FactTable, INTERN_FACTS
+from pddlstream.profiling import profiled
+from pddlstream.utils import read, write, INF, Verbose, clear_dir, get_file_path, MockSet, find_unique, int_ceil, \
+    safe_remove
 
 # TODO: possible bug when path has a space or period
 FD_PATH = get_file_path(__file__, '../../FastDownward/builds/release32/')
@@ -19,25 +29,70 @@ TRANSLATE_PATH = os.path.join(FD_BIN, 'translate')
 DOMAIN_INPUT = 'domain.pddl'
 PROBLEM_INPUT = 'problem.pddl'
 TRANSLATE_FLAGS = ['--negative-axioms'] # '--negative-axioms'
-original_argv = sys.argv[:]
-sys.argv = sys.argv[:1] + TRANSLATE_FLAGS + [DOMAIN_INPUT, PROBLEM_INPUT]
-sys.path.append(TRANSLATE_PATH)
-
-import pddl.f_expression
-import translate
-import pddl
-import instantiate
-import pddl_parser.lisp_parser
-import normalize
-import pddl_parser
-from pddl_parser.parsing_functions import parse_domain_pddl, parse_task_pddl, \
-    parse_condition, check_for_duplicates
-sys.argv = original_argv
+original_argv = sys.argv[:] # sys.argv is no longer modified but kept for backwards compatibility
+
+# The translator is imported on first use so that importing pddlstream has no side effects
+# python -X importtime -c "import pddlstream.algorithms.focused" should not list any translator module
+TRANSLATOR_MODULES = ['pddl', 'pddl.f_expression', 'pddl_parser', 'pddl_parser.lisp_parser',
+                      'pddl_parser.parsing_functions', 'normalize', 'instantiate', 'translate']
+DEFAULT_COST_SCALE = 1000 # TODO: make unit costs be equivalent to cost scale = 0
+
+translator_loaded = False
+
+def load_translator():
+    global translator_loaded
+    if translator_loaded:
+        return
+    if TRANSLATE_PATH not in sys.path:
+        sys.path.append(TRANSLATE_PATH) # Also enables the local translator imports throughout pddlstream
+    argv = sys.argv
+    sys.argv = sys.argv[:1] + TRANSLATE_FLAGS + [DOMAIN_INPUT, PROBLEM_INPUT] # translate parses sys.argv on import
+    try:
+        for name in TRANSLATOR_MODULES:
+            import_module(name)
+    finally:
+        sys.argv = argv
+    translator_loaded = True
+    set_cost_scale(DEFAULT_COST_SCALE)
+
+
+class LazyModule(object):
+    # Stands in for a translator module until an attribute is accessed
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+    def _load(self):
+        load_translator()
+        return sys.modules[self._name]
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self._name)
+
+pddl = LazyModule('pddl')
+pddl_parser = LazyModule('pddl_parser')
+normalize = LazyModule('normalize')
+instantiate = LazyModule('instantiate')
+translate = LazyModule('translate')
+
+def parse_domain_pddl(*args):
+    return pddl_parser.parsing_functions.parse_domain_pddl(*args)
+
+def parse_task_pddl(*args):
+    return pddl_parser.parsing_functions.parse_task_pddl(*args)
+
+def parse_condition(*args):
+    return pddl_parser.parsing_functions.parse_condition(*args)
+
+def check_for_duplicates(*args, **kwargs):
+    return pddl_parser.parsing_functions.check_for_duplicates(*args, **kwargs)
 
 TEMP_DIR = 'temp/'
 TRANSLATE_OUTPUT = 'output.sas'
 SEARCH_OUTPUT = 'sas_plan'
 SEARCH_COMMAND = 'downward --internal-plan-file %s %s < %s'
+SEARCH_BINARY = 'downward' # Reads the SAS task from stdin when it isn't redirected from a file
 
 # TODO: be careful when doing costs. Might not be admissible if use plus one for heuristic
 # TODO: modify parsing_functions to support multiple costs
@@ -107,7 +162,6 @@ def set_cost_scale(cost_scale):
 def scale_cost(cost):
     return int_ceil(get_cost_scale() * float(cost))
 
-set_cost_scale(1000) # TODO: make unit costs be equivalent to cost scale = 0
 
 ##################################################
 
@@ -164,9 +218,11 @@ def fd_from_fact(fact):
 
 def fact_from_fd(fd):
     assert(isinstance(fd, pddl.Literal) and not fd.negated)
+    if INTERN_FACTS:
+        return fact_from_evaluation(evaluation_from_fd(fd))
     return (fd.predicate,) + tuple(map(obj_from_pddl, fd.args))
 
-def evaluation_from_fd(fd):
+def create_evaluation_from_fd(fd):
     if isinstance(fd, pddl.Literal):
         head = Head(fd.predicate, tuple(map(obj_from_pddl, fd.args)))
         return Evaluation(head, not fd.negated)
@@ -176,7 +232,17 @@ def evaluation_from_fd(fd):
         #return Evaluation(head, float(fd.expression.value) / COST_SCALE) # Need to be careful
     raise ValueError(fd)
 
-def fd_from_evaluation(evaluation):
+def evaluation_from_fd(fd):
+    if not (INTERN_FACTS and isinstance(fd, pddl.Literal)):
+        return create_evaluation_from_fd(fd)
+    record = FactTable._record_from_fd.get(fd)
+    if record is None:
+        record = FactTable.from_evaluation(create_evaluation_from_fd(fd))
+        if record.id is not None:
+            FactTable._record_from_fd[fd] = record
+    return record.evaluation
+
+def create_fd_from_evaluation(evaluation):
     name = evaluation.head.function
     args = tuple(map(pddl_from_object, evaluation.head.args))
     if is_atom(evaluation):
@@ -187,6 +253,17 @@ def fd_from_evaluation(evaluation):
     expression = pddl.f_expression.NumericConstant(evaluation.value)
     return pddl.f_expression.Assign(fluent, expression)
 
+def fd_from_evaluation(evaluation):
+    # Literals are shared between tasks, while numeric assignments are created each time
+    if not (INTERN_FACTS and (is_atom(evaluation) or is_negated_atom(evaluation))):
+        return create_fd_from_evaluation(evaluation)
+    record = FactTable.from_evaluation(evaluation)
+    if record.fd is None:
+        record.fd = create_fd_from_evaluation(evaluation)
+        if record.id is not None:
+            FactTable._record_from_fd[record.fd] = record
+    return record.fd
+
 ##################################################
 
 def get_problem(init_evaluations, goal_expression, domain, unit_costs):
@@ -200,8 +277,8 @@ def get_problem(init_evaluations, goal_expression, domain, unit_costs):
                    task_requirements=pddl.tasks.Requirements([]), init=init, goal=goal, use_metric=not unit_costs)
 
 
-def task_from_domain_problem(domain, problem):
-    # TODO: prune eval
+def create_task(domain, problem):
+    # The task is not normalized
     domain_name, domain_requirements, types, type_dict, constants, \
         predicates, predicate_dict, functions, actions, axioms = domain
     task_name, task_domain_name, task_requirements, objects, init, goal, use_metric = problem
@@ -215,8 +292,13 @@ def task_from_domain_problem(domain, problem):
         finalmsg="please check :constants and :objects definitions")
     init.extend(pddl.Atom("=", (obj.name, obj.name)) for obj in objects)
 
-    task = pddl.Task(domain_name, task_name, requirements, types, objects,
+    return pddl.Task(domain_name, task_name, requirements, types, objects,
                      predicates, functions, init, goal, actions, axioms, use_metric)
+
+
+def task_from_domain_problem(domain, problem):
+    # TODO: prune eval
+    task = create_task(domain, problem)
     normalize.normalize(task)
     return task
 
@@ -234,6 +316,12 @@ def get_literals(condition):
 
 ##################################################
 
+def sas_text_from_task(sas_task):
+    output_file = StringIO()
+    sas_task.output(output_file)
+    return output_file.getvalue()
+
+@profiled('write_sas')
 def write_sas_task(sas_task, temp_dir):
     clear_dir(temp_dir)
     translate_path = os.path.join(temp_dir, TRANSLATE_OUTPUT)
@@ -258,12 +346,15 @@ def translate_and_write_pddl(domain_pddl, problem_pddl, temp_dir, verbose):
 
 ##################################################
 
-def run_search(temp_dir, planner=DEFAULT_PLANNER, max_planner_time=DEFAULT_MAX_TIME, max_cost=INF, debug=False):
+def get_planner_config(planner=DEFAULT_PLANNER, max_planner_time=DEFAULT_MAX_TIME, max_cost=INF):
     max_time = INFINITY if max_planner_time == INF else int(max_planner_time)
     max_cost = INFINITY if max_cost == INF else scale_cost(max_cost)
+    return SEARCH_OPTIONS[planner] % (max_time, max_cost)
+
+def run_search(temp_dir, planner=DEFAULT_PLANNER, max_planner_time=DEFAULT_MAX_TIME, max_cost=INF, debug=False):
     start_time = time()
     search = os.path.join(FD_BIN, SEARCH_COMMAND)
-    planner_config = SEARCH_OPTIONS[planner] % (max_time, max_cost)
+    planner_config = get_planner_config(planner, max_planner_time, max_cost)
     command = search % (temp_dir + SEARCH_OUTPUT, planner_config, temp_dir + TRANSLATE_OUTPUT)
     if debug:
         print('Search command:', command)
@@ -276,6 +367,30 @@ def run_search(temp_dir, planner=DEFAULT_PLANNER, max_planner_time=DEFAULT_MAX_T
         return None
     return read(temp_dir + SEARCH_OUTPUT)
 
+def run_search_pipe(sas_text, temp_dir, planner=DEFAULT_PLANNER, max_planner_time=DEFAULT_MAX_TIME,
+                    max_cost=INF, debug=False):
+    # Pipes the SAS task to downward instead of writing output.sas
+    # Only the plan file is touched on disk, and temp_dir is never cleared
+    start_time = time()
+    plan_path = os.path.join(temp_dir, SEARCH_OUTPUT)
+    safe_remove(plan_path)
+    command = [os.path.join(FD_BIN, SEARCH_BINARY), '--internal-plan-file', plan_path] + \
+              shlex.split(get_planner_config(planner, max_planner_time, max_cost))
+    if debug:
+        print('Search command:', ' '.join(command))
+    # Executed directly rather than through a shell
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, universal_newlines=True)
+    output, _ = process.communicate(sas_text)
+    if debug:
+        print(output[:-1])
+        print('Search runtime:', time() - start_time)
+    if not os.path.exists(plan_path):
+        return None
+    solution = read(plan_path)
+    safe_remove(plan_path)
+    return solution
+
 ##################################################
 
 def parse_solution(solution):
@@ -458,9 +573,12 @@ def make_cost(cost):
 InstantiatedTask = namedtuple('InstantiatedTask', ['task', 'atoms', 'actions', 'axioms',
                                                    'reachable_action_params', 'goal_list'])
 
+@profiled('instantiate')
 def instantiate_task(task):
-    normalize.normalize(task)
-    relaxed_reachable, atoms, actions, axioms, reachable_action_params = instantiate.explore(task)
+    # The task is already normalized by task_from_domain_problem
+    return create_instantiated_task(task, *instantiate.explore(task))
+
+def create_instantiated_task(task, relaxed_reachable, atoms, actions, axioms, reachable_action_params):
     if not relaxed_reachable:
         return None
 
@@ -476,6 +594,7 @@ def instantiate_task(task):
 
 ##################################################
 
+@profiled('translate')
 def sas_from_instantiated(instantiated_task):
     import timers
     import fact_groups
@@ -1,9 +1,17 @@
 from __future__ import print_function
 
 import time
+from multiprocessing.pool import ThreadPool
+from threading import Thread, Event
 
-from pddlstream.algorithms.algorithm import parse_problem, SolutionStore, has_costs, compile_fluent_streams, dump_plans, \
-    partition_externals
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from pddlstream.algorithms.checkpoint import save_checkpoint, load_checkpoint, set_attributes
+from pddlstream.algorithms.algorithm import parse_problem, solve_scope, SolutionStore, has_costs, \
+    compile_fluent_streams, dump_plans, partition_externals
 from pddlstream.algorithms.incremental import layered_process_stream_queue
 from pddlstream.algorithms.instantiation import Instantiator
 from pddlstream.algorithms.postprocess import locally_optimize
@@ -16,14 +24,18 @@ from pddlstream.algorithms.skeleton import SkeletonQueue, process_stream_plan, p
 # from pddlstream.algorithms.scheduling.incremental import incremental_stream_plan, exhaustive_stream_plan
 from pddlstream.algorithms.visualization import reset_visualizations, create_visualizations, \
     has_pygraphviz, log_plans
-from pddlstream.language.conversion import revert_solution
+from pddlstream.language.conversion import revert_solution, value_from_obj_plan
 from pddlstream.language.execution import get_action_info
+from pddlstream.language.external import FrozenInstances
 from pddlstream.language.statistics import load_stream_statistics, \
     write_stream_statistics
 from pddlstream.language.synthesizer import get_synthetic_stream_plan
+from pddlstream.profiling import add_span
 from pddlstream.utils import INF, elapsed_time
 from pddlstream.language.optimizer import combine_optimizers, replan_with_optimizers
 
+PIPELINE_PERIOD = 1e-1 # Seconds of sampling between checks on a pipelined search
+
 # TODO: make stream_info just a dict
 # TODO: implement the holdout of evaluations strategy
 
@@ -69,11 +81,14 @@ def process_disabled(store, evaluations, domain, disabled, stream_plan, action_p
 
 ##################################################
 
+@solve_scope
 def solve_focused(problem, stream_info={}, action_info={}, synthesizers=[],
                   max_time=INF, max_cost=INF, unit_costs=False,
-                  unit_efforts=False, effort_weight=None, eager_layers=1,
-                  search_sampling_ratio=1, use_skeleton=True,
-                  visualize=False, verbose=True, postprocess=False, **search_kwargs):
+                  unit_efforts=False, effort_weight=None, max_effort=INF, eager_layers=1,
+                  search_sampling_ratio=1, use_skeleton=True, sampling_workers=1,
+                  visualize=False, verbose=True, postprocess=False,
+                  anytime=False, solution_fn=None, stop_event=None, pipelined=False,
+                  checkpoint_path=None, checkpoint_period=0, resume_from=None, **search_kwargs):
     """
     Solves a PDDLStream problem by first hypothesizing stream outputs and then determining whether they exist
     :param problem: a PDDLStream problem
@@ -84,15 +99,29 @@ def solve_focused(problem, stream_info={}, action_info={}, synthesizers=[],
     :param max_cost: a strict upper bound on plan cost
     :param unit_costs: use unit costs rather than numeric costs
     :param effort_weight: a multiplier for stream effort compared to action costs
+    :param max_effort: optimistic stream instances with at least this effort (including their domain) are pruned
     :param eager_layers: the number of eager stream application layers per iteration
     :param search_sampling_ratio: the desired ratio of search time / sample time
+    :param sampling_workers: the number of skeletons whose next stream is sampled concurrently
+        (using threads for synchronous streams and the event loop for async def streams)
     :param visualize: if True, it draws the constraint network and stream plan as a graphviz file
     :param verbose: if True, this prints the result of each stream application
     :param postprocess: postprocess the stream plan to find a better solution
+    :param anytime: if True, continues to search for cheaper plans until max_time rather than
+        returning the first plan whose cost is below max_cost
+    :param solution_fn: a function called with each Solution(plan, cost, time) that improves on the best cost
+    :param stop_event: a threading.Event that terminates the solve once set
+    :param pipelined: if True, each search runs in a background thread on a snapshot of the evaluations
+        while the skeleton queue continues to sample (requires use_skeleton)
+    :param checkpoint_path: if not None, the state of the solve is pickled to this path at iteration boundaries
+        and upon termination
+    :param checkpoint_period: the minimum amount of time between checkpoints
+    :param resume_from: a checkpoint path from which to continue the solve, where the stream procedures are
+        re-bound by name to those of the problem (max_time applies to the resumed solve)
     :param search_kwargs: keyword args for the search subroutine
     :return: a tuple (plan, cost, evaluations) where plan is a sequence of actions
         (or None), cost is the cost of the plan, and evaluations is init but expanded
-        using stream applications
+        using stream applications. The profiling trace is available as solution.trace
     """
     # TODO: return to just using the highest level samplers at the start
     # TODO: select whether to search or sample based on expected success rates
@@ -104,12 +133,24 @@ def solve_focused(problem, stream_info={}, action_info={}, synthesizers=[],
     # TODO: no optimizers during search with relaxed_stream_plan
     num_iterations = 0
     search_time = sample_time = 0
-    store = SolutionStore(max_time, max_cost, verbose) # TODO: include other info here?
+    if solution_fn is not None:
+        # The plan is converted from Objects to values before it is reported
+        store_solution_fn = lambda s: solution_fn(s._replace(plan=value_from_obj_plan(s.plan)))
+    else:
+        store_solution_fn = None
+    store = SolutionStore(max_time, max_cost, verbose, anytime=anytime,
+                          solution_fn=store_solution_fn, stop_event=stop_event) # TODO: include other info here?
     evaluations, goal_expression, domain, externals = parse_problem(problem, stream_info)
     compile_fluent_streams(domain, externals)
+    num_axioms = len(domain.axioms) # Axioms are subsequently added when fluent stream instances are disabled
     unit_costs |= not has_costs(domain)
     full_action_info = get_action_info(action_info)
     load_stream_statistics(externals + synthesizers)
+    if resume_from is not None:
+        checkpoint = load_checkpoint(resume_from, store, externals, domain)
+        evaluations, goal_expression = checkpoint.evaluations, checkpoint.goal_expression
+        num_iterations, search_time, sample_time = \
+            checkpoint.num_iterations, checkpoint.search_time, checkpoint.sample_time
     if visualize and not has_pygraphviz():
         visualize = False
         print('Warning, visualize=True requires pygraphviz. Setting visualize=False')
@@ -119,24 +160,28 @@ def solve_focused(problem, stream_info={}, action_info={}, synthesizers=[],
     streams, functions, negative = partition_externals(externals)
     if verbose:
         print('Streams: {}\nFunctions: {}\nNegated: {}'.format(streams, functions, negative))
-    queue = SkeletonQueue(store, evaluations, goal_expression, domain)
+    queue = SkeletonQueue(store, evaluations, goal_expression, domain, sampling_workers=sampling_workers)
     disabled = set()
-    while not store.is_terminated():
-        start_time = time.time()
-        num_iterations += 1
-        print('\nIteration: {} | Queue: {} | Evaluations: {} | Cost: {} '
-              '| Search Time: {:.3f} | Sample Time: {:.3f} | Total Time: {:.3f}'.format(
-            num_iterations, len(queue), len(evaluations), store.best_cost,
-            search_time, sample_time, store.elapsed_time()))
+    if resume_from is not None:
+        set_attributes(queue, checkpoint.queue)
+        disabled = checkpoint.disabled
+    checkpoint_time = time.time()
+    write_checkpoint = lambda flushed=False: save_checkpoint(
+        checkpoint_path, store, queue, disabled, externals, domain.axioms[num_axioms:],
+        num_iterations, search_time, sample_time, flushed=flushed)
+    pipelined &= use_skeleton # TODO: pipeline process_disabled
+    search_pool = ThreadPool(processes=1) if pipelined else None
+    pending = None
 
-        layered_process_stream_queue(Instantiator(evaluations, eager_externals), evaluations, store, eager_layers)
+    def search(evaluations, domain, best_cost, iteration):
         solve_stream_plan = lambda sr: solve_stream_plan_fn(evaluations, goal_expression, domain, sr, negative,
-                                                            max_cost=store.best_cost, #max_cost=min(store.best_cost, max_cost),
+                                                            max_cost=best_cost, #max_cost=min(store.best_cost, max_cost),
                                                             unit_costs=unit_costs,
                                                             unit_efforts=unit_efforts, effort_weight=effort_weight,
                                                             **search_kwargs)
         #combined_plan, cost = solve_stream_plan(optimistic_process_streams(evaluations, streams + functions))
-        combined_plan, cost = iterative_solve_stream_plan(evaluations, streams, functions, solve_stream_plan)
+        combined_plan, cost = iterative_solve_stream_plan(evaluations, streams, functions, solve_stream_plan,
+                                                          unit_efforts=unit_efforts, max_effort=max_effort)
         if action_info:
             combined_plan = reorder_combined_plan(evaluations, combined_plan, full_action_info, domain)
             print('Combined plan: {}'.format(combined_plan))
@@ -148,25 +193,120 @@ def solve_focused(problem, stream_info={}, action_info={}, synthesizers=[],
         stream_plan = reorder_stream_plan(stream_plan) # TODO: is this redundant when combined_plan?
         dump_plans(stream_plan, action_plan, cost)
         if (stream_plan is not None) and visualize:
-            log_plans(stream_plan, action_plan, num_iterations)
-            create_visualizations(evaluations, stream_plan, num_iterations)
-        search_time += elapsed_time(start_time)
+            log_plans(stream_plan, action_plan, iteration)
+            create_visualizations(evaluations, stream_plan, iteration)
+        return stream_plan, action_plan, cost
+
+    def pipelined_search(*args):
+        # Each instance's state appears consistent throughout the search while sampling updates it
+        # Returns the search's own runtime because sampling overlaps it
+        start_time = time.time()
+        with FrozenInstances():
+            return search(*args), elapsed_time(start_time)
+
+    while not store.is_terminated():
+        if pending is None:
+            if (checkpoint_path is not None) and (checkpoint_period <= elapsed_time(checkpoint_time)):
+                write_checkpoint()
+                checkpoint_time = time.time()
+            start_time = iteration_time = time.time()
+            num_iterations += 1
+            print('\nIteration: {} | Queue: {} | Evaluations: {} | Cost: {} '
+                  '| Search Time: {:.3f} | Sample Time: {:.3f} | Total Time: {:.3f}'.format(
+                num_iterations, len(queue), len(evaluations), store.best_cost,
+                search_time, sample_time, store.elapsed_time()))
+
+            layered_process_stream_queue(Instantiator(evaluations, eager_externals), evaluations, store, eager_layers,
+                                         max_in_flight=sampling_workers)
+            if pipelined:
+                # The search uses a snapshot so that sampling can concurrently add evaluations and disabled axioms
+                search_time += elapsed_time(start_time)
+                num_evaluations = len(evaluations)
+                pending = search_pool.apply_async(pipelined_search, (
+                    evaluations.copy(), domain._replace(axioms=list(domain.axioms)), store.best_cost, num_iterations))
+                continue
+            stream_plan, action_plan, cost = search(evaluations, domain, store.best_cost, num_iterations)
+            search_time += elapsed_time(start_time)
+        elif not pending.ready():
+            # Samples the existing skeletons while the search is running
+            start_sample_time = time.time()
+            if queue:
+                queue.timed_process(PIPELINE_PERIOD)
+            else:
+                pending.wait(PIPELINE_PERIOD)
+            sample_time += elapsed_time(start_sample_time)
+            continue
+        else:
+            (stream_plan, action_plan, cost), runtime = pending.get()
+            pending = None
+            search_time += runtime # The overlapped sampling is only counted in sample_time
 
         # TODO: more generally just add the original plan skeleton to the plan
         # TODO: cutoff search exploration time at a certain point
         start_time = time.time()
         allocated_sample_time = search_sampling_ratio*search_time - sample_time
-        if use_skeleton:
+        if pipelined:
+            if (stream_plan is None) and (num_evaluations != len(evaluations)):
+                terminate = False # Searches again because the snapshot is outdated
+            else:
+                # Sampling already overlapped the search
+                terminate = not process_skeleton_queue(store, queue, stream_plan, action_plan, cost, 0)
+        elif use_skeleton:
             terminate = not process_skeleton_queue(store, queue, stream_plan, action_plan, cost, allocated_sample_time)
         else:
             terminate = not process_disabled(store, evaluations, domain, disabled, stream_plan, action_plan, cost,
                                              allocated_sample_time, effort_weight is not None)
         sample_time += elapsed_time(start_time)
+        add_span('iteration', iteration_time)
         if terminate:
             break
+    if search_pool is not None:
+        # Waits for an outstanding search because it shares the stream instances
+        search_pool.close()
+        search_pool.join()
+    queue.close()
+    if checkpoint_path is not None:
+        write_checkpoint(flushed=True) # The online statistics are written below
 
     if postprocess and (not unit_costs): # and synthesizers
         locally_optimize(evaluations, store, goal_expression, domain,
                          functions, negative, synthesizers, visualize)
     write_stream_statistics(externals + synthesizers, verbose)
-    return revert_solution(store.best_plan, store.best_cost, evaluations)
\ No newline at end of file
+    return revert_solution(store.best_plan, store.best_cost, evaluations)
+
+##################################################
+
+def iter_solve_focused(problem, max_time=INF, **kwargs):
+    """
+    Runs solve_focused in a background thread and yields each Solution(plan, cost, time) as soon as it improves
+    on the previous one. The search continues until max_time, until no cheaper plan exists,
+    or until the caller stops iterating (which terminates the search at its next check)
+    :param problem: a PDDLStream problem
+    :param max_time: the maximum amount of time to improve the solution
+    :param kwargs: keyword args for solve_focused
+    """
+    solutions = Queue()
+    stop_event = Event()
+    errors = []
+    def run():
+        try:
+            solve_focused(problem, max_time=max_time, anytime=True, solution_fn=solutions.put,
+                          stop_event=stop_event, **kwargs)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            solutions.put(None)
+    thread = Thread(target=run, name='iter_solve_focused')
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            solution = solutions.get()
+            if solution is None:
+                break
+            yield solution
+    finally:
+        stop_event.set()
+        thread.join() # Waits for the solve to write its statistics
+    if errors:
+        raise errors[0]
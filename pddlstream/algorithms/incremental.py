@@ -1,11 +1,12 @@
 import time
 
 #from pddlstream.language.statistics import load_stream_statistics, write_stream_statistics
-from pddlstream.algorithms.algorithm import parse_problem, SolutionStore, add_facts, add_certified, solve_finite
+from pddlstream.algorithms.algorithm import parse_problem, solve_scope, SolutionStore, add_facts, add_certified, solve_finite
 from pddlstream.algorithms.instantiation import Instantiator
 from pddlstream.language.conversion import revert_solution
 from pddlstream.language.function import FunctionInstance
 from pddlstream.language.stream import Stream
+from pddlstream.profiling import add_span
 from pddlstream.utils import INF
 from pddlstream.utils import elapsed_time
 
@@ -14,23 +15,45 @@ def ensure_no_fluent_streams(streams):
         if isinstance(stream, Stream) and stream.is_fluent():
             raise NotImplementedError('Algorithm does not support fluent stream: {}'.format(stream.name))
 
-def process_stream_queue(instantiator, evaluations, verbose=True):
-    instance = instantiator.stream_queue.popleft()
+def prefetch_stream_queue(instantiator, max_in_flight):
+    # Keeps the asynchronous instances at the front of the queue in flight
+    for i in range(min(max_in_flight, len(instantiator.stream_queue))):
+        instantiator.stream_queue[i].prefetch()
+
+def prefetch_batch(instantiator, instance):
+    # Submits the queued instances of a batched external so that they are evaluated in a single call
+    batch = instance.external.get_batch()
+    if (batch is None) or batch.pending: # The previous batch is still being consumed
+        return
+    instance.prefetch()
+    for other in instantiator.pop_batched(instance.external):
+        other.prefetch()
+
+def process_instance(instantiator, evaluations, instance, verbose=True):
     if instance.enumerated:
         return
     new_results, new_facts = instance.next_results(verbose=verbose)
     #if new_results and isinstance(instance, StreamInstance):
     #    evaluations.pop(evaluation_from_fact(instance.get_blocked_fact()), None)
+    effort = instantiator.get_effort(instance)
     for result in new_results:
         for evaluation in add_certified(evaluations, result):
-            instantiator.add_atom(evaluation)
+            instantiator.add_atom(evaluation, effort=effort)
     for evaluation in add_facts(evaluations, new_facts, result=None): # TODO: use instance?
-        instantiator.add_atom(evaluation)
+        instantiator.add_atom(evaluation, effort=effort)
     if not instance.enumerated:
-        instantiator.stream_queue.append(instance)
+        instantiator.push_instance(instance)
+
+def process_stream_queue(instantiator, evaluations, verbose=True, max_in_flight=1):
+    if 1 < max_in_flight:
+        prefetch_stream_queue(instantiator, max_in_flight)
+    instance = instantiator.stream_queue.popleft()
+    prefetch_batch(instantiator, instance)
+    process_instance(instantiator, evaluations, instance, verbose=verbose)
 
 ##################################################
 
+@solve_scope
 def solve_current(problem, **search_kwargs):
     """
     Solves a PDDLStream problem without applying any streams
@@ -47,12 +70,17 @@ def solve_current(problem, **search_kwargs):
 
 ##################################################
 
-def solve_exhaustive(problem, max_time=300, verbose=True, **search_kwargs):
+@solve_scope
+def solve_exhaustive(problem, max_time=300, max_in_flight=1, prioritized=False, max_effort=INF,
+                     verbose=True, **search_kwargs):
     """
     Solves a PDDLStream problem by applying all possible streams and searching once
     Requires a finite max_time when infinitely many stream instances
     :param problem: a PDDLStream problem
     :param max_time: the maximum amount of time to apply streams
+    :param max_in_flight: the number of queued async def stream calls that are concurrently evaluated
+    :param prioritized: if True, stream instances are applied in order of increasing effort rather than FIFO
+    :param max_effort: stream instances with at least this effort (including their domain) are never applied
     :param verbose: if True, this prints the result of each stream application
     :param search_kwargs: keyword args for the search subroutine
     :return: a tuple (plan, cost, evaluations) where plan is a sequence of actions
@@ -62,36 +90,46 @@ def solve_exhaustive(problem, max_time=300, verbose=True, **search_kwargs):
     start_time = time.time()
     evaluations, goal_expression, domain, externals = parse_problem(problem)
     ensure_no_fluent_streams(externals)
-    instantiator = Instantiator(evaluations, externals)
+    instantiator = Instantiator(evaluations, externals, prioritized=prioritized, max_effort=max_effort)
     while instantiator.stream_queue and (elapsed_time(start_time) < max_time):
-        process_stream_queue(instantiator, evaluations, verbose=verbose)
+        process_stream_queue(instantiator, evaluations, verbose=verbose, max_in_flight=max_in_flight)
     plan, cost = solve_finite(evaluations, goal_expression, domain, **search_kwargs)
     return revert_solution(plan, cost, evaluations)
 
 ##################################################
 
 def function_process_stream_queue(instantiator, evaluations, store):
+    deferred = [] # Requeued afterwards because the queue might be prioritized
     for _ in range(len(instantiator.stream_queue)):
-        if isinstance(instantiator.stream_queue[0], FunctionInstance):
-            process_stream_queue(instantiator, evaluations, verbose=store.verbose)
+        instance = instantiator.stream_queue.popleft()
+        if isinstance(instance, FunctionInstance):
+            prefetch_batch(instantiator, instance)
+            process_instance(instantiator, evaluations, instance, verbose=store.verbose)
         else:
-            instantiator.stream_queue.rotate(-1)
+            deferred.append(instance)
+    for instance in deferred: # Not processed, so any pending batch submissions remain
+        instantiator.stream_queue.append(instance)
 
-def layered_process_stream_queue(instantiator, evaluations, store, num_layers):
-    # TODO: priority queue and iteratively increase max stream max or add effort
+def layered_process_stream_queue(instantiator, evaluations, store, num_layers, max_in_flight=1):
+    # TODO: iteratively increase max_effort
     for _ in range(num_layers):
         for _ in range(len(instantiator.stream_queue)):
             if store.is_terminated():
                 return
-            process_stream_queue(instantiator, evaluations, verbose=store.verbose)
+            process_stream_queue(instantiator, evaluations, verbose=store.verbose, max_in_flight=max_in_flight)
 
-def solve_incremental(problem, max_time=INF, max_cost=INF, layers=1, verbose=True, **search_kwargs):
+@solve_scope
+def solve_incremental(problem, max_time=INF, max_cost=INF, layers=1, max_in_flight=1,
+                      prioritized=False, max_effort=INF, verbose=True, **search_kwargs):
     """
     Solves a PDDLStream problem by alternating between applying all possible streams and searching
     :param problem: a PDDLStream problem
     :param max_time: the maximum amount of time to apply streams
     :param max_cost: a strict upper bound on plan cost
     :param layers: the number of stream application layers per iteration
+    :param max_in_flight: the number of queued async def stream calls that are concurrently evaluated
+    :param prioritized: if True, stream instances are applied in order of increasing effort rather than FIFO
+    :param max_effort: stream instances with at least this effort (including their domain) are never applied
     :param verbose: if True, this prints the result of each stream application
     :param search_kwargs: keyword args for the search subroutine
     :return: a tuple (plan, cost, evaluations) where plan is a sequence of actions
@@ -102,17 +140,19 @@ def solve_incremental(problem, max_time=INF, max_cost=INF, layers=1, verbose=Tru
     evaluations, goal_expression, domain, externals = parse_problem(problem)
     ensure_no_fluent_streams(externals)
     #load_stream_statistics(externals)
-    instantiator = Instantiator(evaluations, externals)
+    instantiator = Instantiator(evaluations, externals, prioritized=prioritized, max_effort=max_effort)
     num_iterations = 0
     while not store.is_terminated():
+        iteration_time = time.time()
         num_iterations += 1
         print('Iteration: {} | Evaluations: {} | Cost: {} | Time: {:.3f}'.format(
             num_iterations, len(evaluations), store.best_cost, store.elapsed_time()))
         function_process_stream_queue(instantiator, evaluations, store)
         plan, cost = solve_finite(evaluations, goal_expression, domain, **search_kwargs)
         store.add_plan(plan, cost)
+        add_span('iteration', iteration_time)
         if not instantiator.stream_queue:
             break
-        layered_process_stream_queue(instantiator, evaluations, store, layers)
+        layered_process_stream_queue(instantiator, evaluations, store, layers, max_in_flight=max_in_flight)
     #write_stream_statistics(externals, verbose)
     return revert_solution(store.best_plan, store.best_cost, evaluations)
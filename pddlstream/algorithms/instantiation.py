@@ -1,9 +1,12 @@
 from collections import deque, defaultdict
-from itertools import product
+from heapq import heappush, heappop, nsmallest
+from itertools import count
 
-from pddlstream.language.conversion import is_atom, head_from_fact
-from pddlstream.language.constants import get_prefix, get_args
-from pddlstream.language.object import Object
+from pddlstream.algorithms.scheduling.recover_streams import get_instance_effort, COMBINE_OP
+from pddlstream.language.conversion import is_atom
+from pddlstream.language.constants import get_prefix, get_args, is_parameter
+from pddlstream.language.evaluations import EvaluationStore
+from pddlstream.utils import INF
 
 
 def get_mapping(atoms1, atoms2):
@@ -20,21 +23,75 @@ def get_mapping(atoms1, atoms2):
     return mapping
 
 
+def extend_mapping(mapping, params, args):
+    # Binds the parameters to args while checking constants and repeated parameters
+    new_mapping = dict(mapping)
+    for param, arg in zip(params, args):
+        if not is_parameter(param):
+            if param != arg:
+                return None
+        elif new_mapping.setdefault(param, arg) != arg:
+            return None
+    return new_mapping
+
+
+class PriorityStreamQueue(object):
+    # The subset of the deque interface used with Instantiator.stream_queue ordered by priority_fn
+    def __init__(self, priority_fn):
+        self.priority_fn = priority_fn
+        self.queue = []
+        self.counter = count() # FIFO among equal priorities
+    def append(self, instance):
+        heappush(self.queue, (self.priority_fn(instance), next(self.counter), instance))
+    def popleft(self):
+        return heappop(self.queue)[-1]
+    def __getitem__(self, index):
+        if index == 0:
+            return self.queue[0][-1]
+        return nsmallest(index + 1, self.queue)[-1][-1]
+    def __len__(self):
+        return len(self.queue)
+    def __iter__(self):
+        return (instance for _, _, instance in sorted(self.queue))
+
+##################################################
+
 class Instantiator(object): # Dynamic Stream Instantiator
-    def __init__(self, evaluations, streams):
-        # TODO: priority queue based on effort
-        # Could be useful for both incremental and focused
+    def __init__(self, evaluations, streams, prioritized=False, max_effort=INF, unit_efforts=False):
+        """
+        :param prioritized: if True, instances are processed in order of increasing effort
+            (instance effort plus the effort to achieve its domain) rather than first-in first-out
+        :param max_effort: instances whose effort is at least max_effort are never instantiated
+        """
         # One difference is that focused considers path while incremental is just immediate
-        #self.streams_from_atom = defaultdict(list)
         self.streams = streams
+        self.prioritized = prioritized
+        self.max_effort = max_effort
+        self.unit_efforts = unit_efforts
+        self.track_effort = prioritized or (max_effort < INF)
+        self.effort_from_head = {}
+        self.effort_from_instance = {}
         self.stream_instances = set()
-        self.stream_queue = deque()
+        self.stream_queue = PriorityStreamQueue(self.get_priority) if prioritized else deque()
+        self.batched_from_external = defaultdict(list) # Queued instances of batched externals yet to be submitted
         self.atoms = set()
         self.atoms_from_domain = defaultdict(list)
+        # Dispatch from a predicate to the (stream index, domain index) pairs it can match
+        self.domains_from_predicate = defaultdict(list)
+        self.domain_args = []
+        for i, stream in enumerate(self.streams):
+            self.domain_args.append([get_args(domain_atom) for domain_atom in stream.domain])
+            for j, domain_atom in enumerate(stream.domain):
+                self.domains_from_predicate[get_prefix(domain_atom)].append((i, j))
+        # Hash indices on the arguments in positions bound by previously joined domain atoms
+        self.index_from_positions = defaultdict(dict)
         # TODO: check that all inputs are included within domain
         for stream in self.streams:
             if not stream.inputs: # TODO: need to do with with domain...
                 self._add_instance(stream, tuple())
+        if isinstance(evaluations, EvaluationStore):
+            # Only the evaluations of domain predicates can be joined
+            evaluations = evaluations.get_evaluations(*self.domains_from_predicate)
         for atom in evaluations:
             self.add_atom(atom)
 
@@ -47,42 +104,98 @@ class Instantiator(object): # Dynamic Stream Instantiator
     #        # TODO: remove from set?
     #        yield stream_instance
 
-    def _add_instance(self, stream, input_objects):
+    def get_effort(self, stream_instance):
+        return self.effort_from_instance.get(stream_instance, 0)
+
+    def get_priority(self, stream_instance):
+        # Instances that are requeued after being called become progressively less preferred
+        effort = get_instance_effort(stream_instance, self.unit_efforts)
+        return self.get_effort(stream_instance) + stream_instance.num_calls*effort
+
+    def push_instance(self, stream_instance):
+        # Queues (or requeues) stream_instance
+        self.stream_queue.append(stream_instance)
+        if stream_instance.external.get_batch() is not None:
+            self.batched_from_external[stream_instance.external].append(stream_instance)
+
+    def pop_batched(self, external):
+        # The queued instances of a batched external since the last call (some may have been processed since)
+        return self.batched_from_external.pop(external, [])
+
+    def _add_instance(self, stream, input_objects, domain_effort=0):
         stream_instance = stream.get_instance(input_objects)
         if stream_instance in self.stream_instances:
             return False
+        if self.track_effort:
+            effort = domain_effort + get_instance_effort(stream_instance, self.unit_efforts)
+            if self.max_effort <= effort:
+                return False # Could be instantiated later through a domain with less effort
+            self.effort_from_instance[stream_instance] = effort
         self.stream_instances.add(stream_instance)
-        self.stream_queue.append(stream_instance)
+        self.push_instance(stream_instance)
         return True
 
-    def add_atom(self, atom):
+    def _add_domain_atom(self, i, j, head):
+        self.atoms_from_domain[(i, j)].append(head)
+        for positions, index in self.index_from_positions[(i, j)].items():
+            key = tuple(head.args[p] for p in positions)
+            index.setdefault(key, []).append(head)
+
+    def _get_candidates(self, i, j, mapping):
+        # Atoms satisfying domain atom j of stream i that are consistent with the bound parameters
+        params = self.domain_args[i][j]
+        positions = tuple(p for p, param in enumerate(params) if is_parameter(param) and (param in mapping))
+        if not positions:
+            return self.atoms_from_domain[(i, j)]
+        indices = self.index_from_positions[(i, j)]
+        if positions not in indices:
+            index = {}
+            for head in self.atoms_from_domain[(i, j)]:
+                index.setdefault(tuple(head.args[p] for p in positions), []).append(head)
+            indices[positions] = index
+        key = tuple(mapping[params[p]] for p in positions)
+        return indices[positions].get(key, [])
+
+    def _join(self, i, remaining, mapping, efforts):
+        if not remaining:
+            stream = self.streams[i]
+            input_objects = tuple(mapping[p] for p in stream.inputs)
+            self._add_instance(stream, input_objects, domain_effort=COMBINE_OP(efforts))
+            return
+        # Greedily selects the most selective domain atom given the current bindings
+        best_j, best_candidates = None, None
+        for j in remaining:
+            candidates = self._get_candidates(i, j, mapping)
+            if not candidates:
+                return
+            if (best_candidates is None) or (len(candidates) < len(best_candidates)):
+                best_j, best_candidates = j, candidates
+        new_remaining = [j for j in remaining if j != best_j]
+        params = self.domain_args[i][best_j]
+        for head in best_candidates:
+            new_mapping = extend_mapping(mapping, params, head.args)
+            if new_mapping is not None:
+                self._join(i, new_remaining, new_mapping, efforts + [self.effort_from_head.get(head, 0)])
+
+    def add_atom(self, atom, effort=0):
+        # effort is the effort to achieve atom, such as the effort of the instance that certified it
         if not is_atom(atom):
             return False
         head = atom.head
         if head in self.atoms:
             return False
         self.atoms.add(head)
+        if self.track_effort:
+            self.effort_from_head[head] = effort
         # TODO: doing this in a way that will eventually allow constants
-
-        for i, stream in enumerate(self.streams):
-            for j, domain_atom in enumerate(stream.domain):
-                if get_prefix(head) != get_prefix(domain_atom):
-                    continue
-                if len(head.args) != len(get_args(domain_atom)):
-                    raise ValueError(head, domain_atom)
-                if any(isinstance(b, Object) and (a != b) for (a, b) in
-                       zip(head.args, get_args(domain_atom))):
-                    continue
-                self.atoms_from_domain[(i, j)].append(head)
-                values = [self.atoms_from_domain[(i, k)] if j != k else [head]
-                          for k in range(len(stream.domain))]
-                domain = list(map(head_from_fact, stream.domain))
-                #domain = stream.domain
-                for combo in product(*values):
-                    mapping = get_mapping(domain, combo)
-                    if mapping is None:
-                        continue
-                    input_objects = tuple(mapping[p] for p in stream.inputs)
-                    self._add_instance(stream, input_objects)
+        for i, j in self.domains_from_predicate[get_prefix(head)]:
+            params = self.domain_args[i][j]
+            if len(head.args) != len(params):
+                raise ValueError(head, self.streams[i].domain[j])
+            mapping = extend_mapping({}, params, head.args)
+            if mapping is None:
+                continue
+            self._add_domain_atom(i, j, head)
+            remaining = [k for k in range(len(self.domain_args[i])) if k != j]
+            self._join(i, remaining, mapping, [effort])
         return True
-
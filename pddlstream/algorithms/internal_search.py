@@ -0,0 +1,453 @@
+from __future__ import print_function
+
+import random
+from collections import namedtuple, deque
+from heapq import heappush, heappop
+from itertools import count
+from time import time
+
+from pddlstream.algorithms.downward import DEFAULT_PLANNER, DEFAULT_MAX_TIME, scale_cost
+from pddlstream.utils import INF, elapsed_time
+
+# In-process search over a translated sas_task that mirrors the configurations in SEARCH_OPTIONS
+# Avoids writing output.sas, forking downward, and reading sas_plan back from disk
+# TODO: landmark heuristics (lmcut currently falls back to hmax and cea to hadd)
+# TODO: mutex pruning using sas_task.mutexes
+
+SearchConfig = namedtuple('SearchConfig', ['search', 'heuristic', 'weight', 'preferred',
+                                           'plus_one', 'reopen', 'randomize'])
+# search: eager, lazy, or ehc
+# weight: None is greedy (f = h), otherwise f = g + weight*h
+
+INTERNAL_SEARCH_OPTIONS = {
+    # Optimal
+    'dijkstra': SearchConfig('eager', 'blind', 1, False, False, True, False),
+    'max-astar': SearchConfig('eager', 'hmax', 1, False, False, True, False),
+    'lmcut-astar': SearchConfig('eager', 'hmax', 1, False, False, True, False),
+
+    # Suboptimal
+    'ff-astar': SearchConfig('eager', 'ff', 1, False, False, True, False),
+    'ff-eager': SearchConfig('eager', 'ff', None, False, True, False, False),
+    'ff-eager-pref': SearchConfig('eager', 'ff', None, True, True, False, False),
+    'ff-lazy': SearchConfig('lazy', 'ff', None, True, True, False, False),
+    'goal-lazy': SearchConfig('lazy', 'goal', None, False, False, False, True),
+    'add-random-lazy': SearchConfig('lazy', 'add', None, False, True, False, True),
+    'ff-eager-wastar1000': SearchConfig('eager', 'ff', 1000, True, False, False, False),
+    'ff-ehc': SearchConfig('ehc', 'ff', None, True, False, False, False),
+}
+
+for w in range(1, 1+5):
+    INTERNAL_SEARCH_OPTIONS['ff-wastar{}'.format(w)] = SearchConfig('lazy', 'ff', w, True, False, True, False)
+    INTERNAL_SEARCH_OPTIONS['cea-wastar{}'.format(w)] = SearchConfig('lazy', 'add', w, True, True, False, False)
+
+TIME_CHECK_PERIOD = 100 # Expansions between timeout checks
+
+##################################################
+
+UnaryOperator = namedtuple('UnaryOperator', ['preconditions', 'effect', 'cost', 'operator'])
+
+class SearchTask(object):
+    # Compiled sas_task with integer facts for fast successor generation and relaxed exploration
+    def __init__(self, sas_task, plus_one=False):
+        self.sas_task = sas_task
+        self.plus_one = int(plus_one)
+        variables = sas_task.variables
+        self.ranges = list(variables.ranges)
+        self.offsets = []
+        num_facts = 0
+        for size in self.ranges:
+            self.offsets.append(num_facts)
+            num_facts += size
+        self.num_facts = num_facts
+        self.goal = [(var, val) for var, val in sas_task.goal.pairs]
+        self.goal_facts = [self.fact(var, val) for var, val in self.goal]
+        self.goal_set = frozenset(self.goal_facts)
+
+        self.names = []
+        self.costs = []
+        self.preconditions = []
+        self.effects = []
+        for op in sas_task.operators:
+            preconditions = list(op.prevail) + [(var, pre) for var, pre, _, _ in op.pre_post if pre != -1]
+            effects = [(var, post, tuple(cond)) for var, _, post, cond in op.pre_post]
+            self.names.append(op.name)
+            self.costs.append(op.cost if sas_task.metric else 1)
+            self.preconditions.append(tuple(preconditions))
+            self.effects.append(tuple(effects))
+        self.min_cost = min(self.costs) if self.costs else 0
+
+        # Derived variables are reset to their initial (default) value before evaluating axioms
+        self.derived = [var for var, layer in enumerate(variables.axiom_layers) if layer != -1]
+        self.defaults = {var: sas_task.init.values[var] for var in self.derived}
+        layers = {}
+        for axiom in sas_task.axioms:
+            var, _ = axiom.effect
+            layers.setdefault(variables.axiom_layers[var], []).append(
+                (tuple(axiom.condition), axiom.effect))
+        self.axiom_layers = [layers[layer] for layer in sorted(layers)]
+
+        self.unary_operators = []
+        for index, (preconditions, effects) in enumerate(zip(self.preconditions, self.effects)):
+            cost = self.costs[index] + self.plus_one
+            for var, post, cond in effects:
+                facts = {self.fact(v, d) for v, d in preconditions + cond}
+                self.unary_operators.append(UnaryOperator(
+                    tuple(facts), self.fact(var, post), cost, index))
+        for conditions, (var, val) in sum(self.axiom_layers, []):
+            facts = {self.fact(v, d) for v, d in conditions}
+            self.unary_operators.append(UnaryOperator(tuple(facts), self.fact(var, val), 0, None))
+        self.unary_from_fact = [[] for _ in range(self.num_facts)]
+        self.free_unary = []
+        for u, unary in enumerate(self.unary_operators):
+            if not unary.preconditions:
+                self.free_unary.append(u)
+            for fact in unary.preconditions:
+                self.unary_from_fact[fact].append(u)
+    def fact(self, var, val):
+        return self.offsets[var] + val
+    def evaluate_axioms(self, values):
+        for var in self.derived:
+            values[var] = self.defaults[var]
+        for axioms in self.axiom_layers:
+            changed = True
+            while changed:
+                changed = False
+                for conditions, (var, val) in axioms:
+                    if (values[var] != val) and all(values[v] == d for v, d in conditions):
+                        values[var] = val
+                        changed = True
+        return tuple(values)
+    def initial_state(self):
+        return self.evaluate_axioms(list(self.sas_task.init.values))
+    def is_goal(self, state):
+        return all(state[var] == val for var, val in self.goal)
+    def is_applicable(self, state, index):
+        return all(state[var] == val for var, val in self.preconditions[index])
+    def applicable(self, state):
+        return [index for index in range(len(self.names)) if self.is_applicable(state, index)]
+    def apply(self, state, index):
+        values = list(state)
+        for var, post, cond in self.effects[index]:
+            if all(state[v] == d for v, d in cond):
+                values[var] = post
+        return self.evaluate_axioms(values)
+
+##################################################
+
+class RelaxedHeuristic(object):
+    # hmax, hadd, and hff through a single Dijkstra-like relaxed exploration
+    def __init__(self, task, combine=sum, relaxed_plan=False):
+        self.task = task
+        self.combine = combine
+        self.relaxed_plan = relaxed_plan
+    def explore(self, state):
+        task = self.task
+        costs = [INF]*task.num_facts
+        achievers = [None]*task.num_facts
+        remaining = [len(unary.preconditions) for unary in task.unary_operators]
+        accumulated = [0]*len(task.unary_operators)
+        expanded = [False]*task.num_facts
+        queue = []
+        for var, val in enumerate(state):
+            fact = task.fact(var, val)
+            costs[fact] = 0
+            heappush(queue, (0, fact))
+        for u in task.free_unary:
+            unary = task.unary_operators[u]
+            if unary.cost < costs[unary.effect]:
+                costs[unary.effect] = unary.cost
+                achievers[unary.effect] = u
+                heappush(queue, (unary.cost, unary.effect))
+        num_goals = len(task.goal_set)
+        reached = 0
+        while queue and (reached < num_goals):
+            cost, fact = heappop(queue)
+            if expanded[fact]:
+                continue
+            expanded[fact] = True
+            if fact in task.goal_set:
+                reached += 1
+            for u in task.unary_from_fact[fact]:
+                remaining[u] -= 1
+                accumulated[u] = self.combine([accumulated[u], cost])
+                if remaining[u] == 0:
+                    unary = task.unary_operators[u]
+                    new_cost = accumulated[u] + unary.cost
+                    if new_cost < costs[unary.effect]:
+                        costs[unary.effect] = new_cost
+                        achievers[unary.effect] = u
+                        heappush(queue, (new_cost, unary.effect))
+        return costs, achievers
+    def extract_relaxed_plan(self, state, achievers):
+        operators = set()
+        marked = set()
+        stack = list(self.task.goal_facts)
+        while stack:
+            fact = stack.pop()
+            if fact in marked:
+                continue
+            marked.add(fact)
+            u = achievers[fact]
+            if u is None:
+                continue # Achieved in the state
+            unary = self.task.unary_operators[u]
+            if unary.operator is not None:
+                operators.add(unary.operator)
+            stack.extend(unary.preconditions)
+        return operators
+    def __call__(self, state):
+        costs, achievers = self.explore(state)
+        goal_costs = [costs[fact] for fact in self.task.goal_facts]
+        if any(cost == INF for cost in goal_costs):
+            return INF, []
+        if not self.relaxed_plan:
+            return self.combine([0] + goal_costs), []
+        operators = self.extract_relaxed_plan(state, achievers)
+        h = sum(self.task.costs[index] + self.task.plus_one for index in operators)
+        preferred = [index for index in operators if self.task.is_applicable(state, index)]
+        return h, preferred
+
+def goal_count(task):
+    def fn(state):
+        return sum(state[var] != val for var, val in task.goal), []
+    return fn
+
+def blind(task):
+    def fn(state):
+        return (0 if task.is_goal(state) else task.min_cost), []
+    return fn
+
+def get_heuristic(task, name):
+    if name == 'blind':
+        return blind(task)
+    if name == 'goal':
+        return goal_count(task)
+    if name == 'hmax':
+        return RelaxedHeuristic(task, combine=max)
+    if name == 'add':
+        return RelaxedHeuristic(task, combine=sum)
+    if name == 'ff':
+        return RelaxedHeuristic(task, combine=sum, relaxed_plan=True)
+    raise ValueError(name)
+
+##################################################
+
+class SearchTimeout(Exception):
+    pass
+
+class Search(object):
+    def __init__(self, task, config, max_time=INF, max_cost=INF):
+        self.task = task
+        self.config = config
+        self.heuristic = get_heuristic(task, config.heuristic)
+        self.max_time = max_time
+        self.max_cost = max_cost
+        self.start_time = time()
+        self.g = {}
+        self.real_g = {} # Cost without the plus one transform for the bound
+        self.parents = {}
+        self.counter = count()
+        self.expanded = 0
+        self.evaluated = 0
+    def action_cost(self, index):
+        return self.task.costs[index] + self.task.plus_one
+    def evaluate(self, state):
+        self.evaluated += 1
+        return self.heuristic(state)
+    def priority(self, g, h):
+        if self.config.weight is None:
+            return h
+        return g + self.config.weight*h
+    def check_time(self):
+        self.expanded += 1
+        if (self.expanded % TIME_CHECK_PERIOD == 0) and (self.max_time <= elapsed_time(self.start_time)):
+            raise SearchTimeout()
+    def successors(self, state, preferred=[]):
+        indices = self.task.applicable(state)
+        if self.config.randomize:
+            random.shuffle(indices)
+        preferred = set(preferred)
+        for index in indices:
+            yield index, (index in preferred)
+    def within_bound(self, g_cost):
+        return g_cost < self.max_cost
+    def add_node(self, state, g, real_g, parent=None):
+        self.g[state] = g
+        self.real_g[state] = real_g
+        self.parents[state] = parent
+    def retrace(self, state):
+        plan = []
+        while self.parents[state] is not None:
+            state, index = self.parents[state]
+            plan.append(index)
+        return plan[::-1]
+
+class AlternationOpenList(object):
+    # Alternates between the regular and preferred open lists like FastDownward
+    def __init__(self, use_preferred):
+        self.queues = [[], []] if use_preferred else [[]]
+        self.turn = 0
+    def push(self, key, entry, preferred=False):
+        heappush(self.queues[0], (key, entry))
+        if preferred and (len(self.queues) == 2):
+            heappush(self.queues[1], (key, entry))
+    def pop(self):
+        for _ in range(len(self.queues)):
+            queue = self.queues[self.turn % len(self.queues)]
+            self.turn += 1
+            if queue:
+                return heappop(queue)[1]
+        raise IndexError()
+    def __len__(self):
+        return sum(map(len, self.queues))
+
+def eager_search(search):
+    # Heuristic is evaluated upon generation
+    task, config = search.task, search.config
+    initial = task.initial_state()
+    h, preferred = search.evaluate(initial)
+    if h == INF:
+        return None
+    search.add_node(initial, 0, 0)
+    open_list = AlternationOpenList(config.preferred)
+    open_list.push((search.priority(0, h), h, next(search.counter)), (0, initial, preferred))
+    closed = set()
+    while open_list:
+        g, state, preferred = open_list.pop()
+        if (state in closed) or (search.g[state] < g):
+            continue
+        closed.add(state)
+        if task.is_goal(state):
+            return search.retrace(state)
+        search.check_time()
+        for index, is_preferred in search.successors(state, preferred):
+            successor = task.apply(state, index)
+            new_g = g + search.action_cost(index)
+            new_real_g = search.real_g[state] + task.costs[index]
+            if not search.within_bound(new_real_g):
+                continue
+            if successor in search.g:
+                if (search.g[successor] <= new_g) or ((successor in closed) and not config.reopen):
+                    continue
+                closed.discard(successor)
+            search.add_node(successor, new_g, new_real_g, parent=(state, index))
+            h, successor_preferred = search.evaluate(successor)
+            if h == INF:
+                continue
+            open_list.push((search.priority(new_g, h), h, next(search.counter)),
+                           (new_g, successor, successor_preferred), preferred=is_preferred)
+    return None
+
+def lazy_search(search):
+    # Heuristic is evaluated upon expansion (deferred evaluation)
+    task, config = search.task, search.config
+    open_list = AlternationOpenList(config.preferred)
+    open_list.push((0, next(search.counter)), (0, 0, None, None))
+    while open_list:
+        g, real_g, parent, index = open_list.pop()
+        if parent is None:
+            state = task.initial_state()
+        else:
+            state = task.apply(parent, index)
+        if (state in search.g) and ((search.g[state] <= g) or not config.reopen):
+            continue
+        search.add_node(state, g, real_g, parent=None if parent is None else (parent, index))
+        if task.is_goal(state):
+            return search.retrace(state)
+        search.check_time()
+        h, preferred = search.evaluate(state)
+        if h == INF:
+            continue
+        successors = list(search.successors(state, preferred))
+        # preferred_successors_first
+        successors.sort(key=lambda pair: not pair[1])
+        for index, is_preferred in successors:
+            new_real_g = real_g + task.costs[index]
+            if not search.within_bound(new_real_g):
+                continue
+            new_g = g + search.action_cost(index)
+            open_list.push((search.priority(new_g, h), next(search.counter)),
+                           (new_g, new_real_g, state, index), preferred=is_preferred)
+    return None
+
+def enforced_hill_climbing(search):
+    # Breadth-first search from the current state until a strictly better state is found
+    task = search.task
+    state = task.initial_state()
+    search.add_node(state, 0, 0)
+    h, preferred = search.evaluate(state)
+    if h == INF:
+        return None
+    while not task.is_goal(state):
+        visited = {state}
+        queue = deque([(state, preferred)])
+        improved = False
+        while queue and not improved:
+            current, current_preferred = queue.popleft()
+            search.check_time()
+            successors = sorted(search.successors(current, current_preferred), key=lambda pair: not pair[1])
+            for index, _ in successors:
+                successor = task.apply(current, index)
+                if successor in visited:
+                    continue
+                visited.add(successor)
+                new_g = search.g[current] + search.action_cost(index)
+                new_real_g = search.real_g[current] + task.costs[index]
+                if not search.within_bound(new_real_g):
+                    continue
+                if (successor in search.g) and (search.g[successor] <= new_g):
+                    continue
+                search.add_node(successor, new_g, new_real_g, parent=(current, index))
+                new_h, new_preferred = search.evaluate(successor)
+                if new_h < h:
+                    state, h, preferred = successor, new_h, new_preferred
+                    improved = True
+                    break
+                if new_h != INF:
+                    queue.append((successor, new_preferred))
+        if not improved:
+            return None
+    return search.retrace(state)
+
+SEARCH_ALGORITHMS = {
+    'eager': eager_search,
+    'lazy': lazy_search,
+    'ehc': enforced_hill_climbing,
+}
+
+##################################################
+
+def format_plan(task, plan):
+    # Same format as the sas_plan written by FastDownward
+    lines = [task.names[index] for index in plan]
+    cost_type = 'general cost' if task.sas_task.metric else 'unit cost'
+    lines.append('; cost = {} ({})'.format(sum(task.costs[index] for index in plan), cost_type))
+    return '\n'.join(lines) + '\n'
+
+def run_internal_search(sas_task, planner=DEFAULT_PLANNER, max_planner_time=DEFAULT_MAX_TIME,
+                        max_cost=INF, debug=False):
+    """
+    Searches the sas_task in-process without calling the downward binary
+    :param sas_task: the translated SAS+ task
+    :param planner: a key of INTERNAL_SEARCH_OPTIONS (the same names as SEARCH_OPTIONS)
+    :param max_planner_time: the maximum search runtime
+    :param max_cost: a strict upper bound on the plan cost
+    :return: the plan in the sas_plan format parsed by parse_solution or None
+    """
+    if planner not in INTERNAL_SEARCH_OPTIONS:
+        raise ValueError('Planner {} is not supported by the internal search'.format(planner))
+    start_time = time()
+    config = INTERNAL_SEARCH_OPTIONS[planner]
+    task = SearchTask(sas_task, plus_one=config.plus_one)
+    scaled_cost = INF if max_cost == INF else scale_cost(max_cost)
+    search = Search(task, config, max_time=max_planner_time, max_cost=scaled_cost)
+    try:
+        plan = SEARCH_ALGORITHMS[config.search](search)
+    except SearchTimeout:
+        plan = None
+    if debug:
+        print('Internal search: {} | Expanded: {} | Evaluated: {} | Solved: {} | Runtime: {:.3f}'.format(
+            planner, search.expanded, search.evaluated, plan is not None, elapsed_time(start_time)))
+    if plan is None:
+        return None
+    return format_plan(task, plan)
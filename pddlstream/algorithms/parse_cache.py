@@ -0,0 +1,87 @@
+import hashlib
+import os
+import pickle
+from copy import deepcopy
+
+from pddlstream.algorithms.downward import Domain, parse_lisp, parse_domain_pddl
+from pddlstream.utils import ensure_dir, get_python_version, safe_remove
+
+# Parsing is keyed on a hash of the PDDL text, so repeated solves of the same domain and streams skip the parser
+# The parsed domain is cached in memory and copied per solve because parse_constants and the compilations mutate it
+# The parsed lisp is additionally cached on disk (unlike pddl objects, which store string hashes that vary per process)
+# Streams are reconstructed from the cached lisp on each solve because they are bound to the procedures in stream_map
+
+PARSE_CACHE = True # Disable to always parse
+CACHE_DIR = 'parse_cache/py{:d}/'
+CACHE_VERSION = 1 # Increment when the parsed format changes
+
+lisp_from_key = {} # key -> pickled lisp
+domain_from_key = {} # key -> Domain
+
+def get_cache_dir():
+    return CACHE_DIR.format(get_python_version())
+
+def get_parse_key(pddl):
+    return hashlib.sha1('{}\n{}'.format(CACHE_VERSION, pddl).encode('utf-8')).hexdigest()
+
+def get_cache_path(key):
+    return os.path.join(get_cache_dir(), '{}.pkl'.format(key))
+
+def clear_parse_cache(disk=False):
+    lisp_from_key.clear()
+    domain_from_key.clear()
+    cache_dir = get_cache_dir()
+    if disk and os.path.exists(cache_dir):
+        for file_name in os.listdir(cache_dir):
+            safe_remove(os.path.join(cache_dir, file_name))
+
+##################################################
+
+def read_lisp(key):
+    path = get_cache_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+def write_lisp(key, data):
+    path = get_cache_path(key)
+    ensure_dir(path)
+    temp_path = '{}.{}'.format(path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.rename(temp_path, path) # Atomic so that concurrent solves never read a partial file
+    except (IOError, OSError):
+        safe_remove(temp_path)
+
+def load_lisp(pddl, disk=True):
+    # Returns a fresh list that callers are free to mutate
+    if not PARSE_CACHE:
+        return parse_lisp(pddl)
+    key = get_parse_key(pddl)
+    if key not in lisp_from_key:
+        data = read_lisp(key) if disk else None
+        if data is None:
+            data = pickle.dumps(parse_lisp(pddl), pickle.HIGHEST_PROTOCOL)
+            if disk:
+                write_lisp(key, data)
+        lisp_from_key[key] = data
+    try:
+        return pickle.loads(lisp_from_key[key])
+    except Exception: # Corrupted file
+        del lisp_from_key[key]
+        safe_remove(get_cache_path(key))
+        return parse_lisp(pddl)
+
+def load_domain(domain_pddl, disk=True):
+    # Returns a fresh Domain that callers are free to mutate
+    if not PARSE_CACHE:
+        return Domain(*parse_domain_pddl(parse_lisp(domain_pddl)))
+    key = get_parse_key(domain_pddl)
+    if key not in domain_from_key:
+        domain_from_key[key] = Domain(*parse_domain_pddl(load_lisp(domain_pddl, disk=disk)))
+    return deepcopy(domain_from_key[key])
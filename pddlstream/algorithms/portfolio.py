@@ -0,0 +1,132 @@
+from __future__ import print_function
+
+import os
+import shlex
+import subprocess
+import tempfile
+import time
+
+from pddlstream.algorithms.downward import TEMP_DIR, TRANSLATE_OUTPUT, SEARCH_OUTPUT, FD_BIN, DEFAULT_MAX_TIME, \
+    SEARCH_OPTIONS, SEARCH_BINARY, get_planner_config, parse_solution, sas_text_from_task
+from pddlstream.language.statistics import StatisticsDatabase, sqlite3
+from pddlstream.utils import INF, elapsed_time, ensure_dir, safe_rm_dir, read, write
+
+# Runs several SEARCH_OPTIONS configurations on the same SAS task in parallel downward processes
+# Configurations that have produced the returned plan most often are launched first
+
+PORTFOLIO = 'portfolio' # planner=PORTFOLIO uses the default Portfolio
+DEFAULT_PORTFOLIO = ['ff-astar', 'ff-eager-pref', 'ff-lazy', 'cea-wastar3', 'lmcut-astar']
+POLL_PERIOD = 1e-2 # Seconds between checks for finished configurations
+KILL_DELAY = 1 # Seconds after max_planner_time before the remaining configurations are killed
+
+def start_search(sas_path, plan_path, planner, max_planner_time, max_cost, stdout):
+    command = [os.path.join(FD_BIN, SEARCH_BINARY), '--internal-plan-file', plan_path] + \
+              shlex.split(get_planner_config(planner, max_planner_time, max_cost))
+    with open(sas_path, 'r') as stdin:
+        # Not started through a shell so that kill terminates downward itself
+        return subprocess.Popen(command, stdin=stdin, stdout=stdout, stderr=subprocess.STDOUT)
+
+##################################################
+
+class Portfolio(object):
+    """
+    Runs several search configurations in parallel and returns the first (or cheapest) plan
+    Pass as planner=Portfolio(...) to solve_focused, solve_incremental, or abstrips_solve_from_task
+    :param planners: names of SEARCH_OPTIONS configurations
+    :param max_workers: the number of configurations launched per search, preferring those that won most often
+    :param anytime: if True, waits until every configuration terminates (or max_planner_time) and
+        returns the cheapest plan rather than the first plan
+    :param persist: if True, win statistics are loaded from and added to the statistics database
+    """
+    def __init__(self, planners=DEFAULT_PORTFOLIO, max_workers=None, anytime=False, persist=True):
+        for planner in planners:
+            if planner not in SEARCH_OPTIONS:
+                raise ValueError('Unknown planner: {}'.format(planner))
+        self.planners = list(planners)
+        self.max_workers = len(self.planners) if max_workers is None else max_workers
+        assert 1 <= self.max_workers
+        self.anytime = anytime
+        self.persist = persist and (sqlite3 is not None)
+        self.statistics = {planner: {'runs': 0, 'wins': 0, 'runtime': 0.} for planner in self.planners}
+        if self.persist:
+            with StatisticsDatabase() as database:
+                for planner, statistics in database.load_planners().items():
+                    if planner in self.statistics:
+                        self.statistics[planner].update(statistics)
+    def get_win_rate(self, planner):
+        # Laplace smoothing so untried configurations are launched
+        statistics = self.statistics[planner]
+        return (statistics['wins'] + 1.) / (statistics['runs'] + 2.)
+    def get_order(self):
+        return sorted(self.planners, key=lambda p: (-self.get_win_rate(p), self.planners.index(p)))
+    def _update(self, runtimes, winner):
+        updates = []
+        for planner, runtime in runtimes.items():
+            wins = int(planner == winner)
+            self.statistics[planner]['runs'] += 1
+            self.statistics[planner]['wins'] += wins
+            self.statistics[planner]['runtime'] += runtime
+            updates.append((planner, 1, wins, runtime))
+        if self.persist:
+            with StatisticsDatabase() as database:
+                database.update_planners(updates)
+    def search(self, sas_task, temp_dir=TEMP_DIR, max_planner_time=DEFAULT_MAX_TIME, max_cost=INF, debug=False):
+        start_time = time.time()
+        # Each call has its own directory so that concurrent searches (e.g. from a SearchPool) do not collide
+        ensure_dir(temp_dir)
+        portfolio_dir = tempfile.mkdtemp(prefix='portfolio', dir=temp_dir)
+        sas_path = os.path.join(portfolio_dir, TRANSLATE_OUTPUT)
+        write(sas_path, sas_text_from_task(sas_task))
+        processes = {}
+        with open(os.devnull, 'w') as devnull:
+            for planner in self.get_order()[:self.max_workers]:
+                plan_path = os.path.join(portfolio_dir, '{}.{}'.format(SEARCH_OUTPUT, planner))
+                processes[planner] = (start_search(sas_path, plan_path, planner, max_planner_time,
+                                                   max_cost, devnull), plan_path)
+            runtimes = {}
+            solutions = {}
+            while True:
+                for planner, (process, plan_path) in processes.items():
+                    if (planner in runtimes) or (process.poll() is None):
+                        continue
+                    runtimes[planner] = elapsed_time(start_time)
+                    if os.path.exists(plan_path):
+                        solutions[planner] = read(plan_path)
+                if (solutions and not self.anytime) or (len(runtimes) == len(processes)) or \
+                        (max_planner_time + KILL_DELAY < elapsed_time(start_time)):
+                    break
+                time.sleep(POLL_PERIOD)
+            for planner, (process, _) in processes.items():
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+                    runtimes[planner] = elapsed_time(start_time)
+        safe_rm_dir(portfolio_dir)
+
+        winner = None
+        if solutions:
+            winner = min(solutions, key=lambda p: (parse_solution(solutions[p])[1], runtimes[p]))
+        self._update(runtimes, winner)
+        if debug:
+            print('Portfolio: {} | Winner: {} | Runtime: {:.3f}'.format(
+                sorted(processes), winner, elapsed_time(start_time)))
+        if winner is None:
+            return None
+        return solutions[winner]
+    def dump(self):
+        for planner in self.get_order():
+            statistics = self.statistics[planner]
+            print('{}: {} wins / {} runs | {:.3f} runtime'.format(
+                planner, statistics['wins'], statistics['runs'], statistics['runtime']))
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.get_order())
+
+##################################################
+
+default_portfolio = None
+
+def get_default_portfolio():
+    global default_portfolio
+    if default_portfolio is None:
+        default_portfolio = Portfolio()
+    return default_portfolio
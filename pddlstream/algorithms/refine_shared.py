@@ -3,8 +3,8 @@ from itertools import product
 from pddlstream.algorithms.instantiation import Instantiator
 from pddlstream.algorithms.reorder import separate_plan
 from pddlstream.algorithms.scheduling.utils import evaluations_from_stream_plan
-from pddlstream.algorithms.scheduling.recover_streams import get_instance_effort
 from pddlstream.language.conversion import evaluation_from_fact, substitute_expression
+from pddlstream.language.evaluations import overlay_evaluations
 from pddlstream.language.stream import StreamResult
 from pddlstream.language.object import OptimisticObject
 from pddlstream.utils import INF
@@ -45,27 +45,22 @@ def is_double_bound(stream_instance, double_bindings):
 
 def optimistic_process_streams(evaluations, streams, double_bindings=None, unit_efforts=False, max_effort=INF):
     # TODO: iteratively increase max_effort to bias towards easier streams to start
-    # TODO: cut off instantiation using max_effort
     # TODO: make each repeated optimistic object have ordinal more effort
     # TODO: enforce that the search uses one optimistic object before claiming the next (like in my first version)
     # Can even fall back on converting streams to test streams
     # Additive max effort in case something requires a long sequence to achieve
+    # Prioritizing ensures each fact is first added with its minimum effort, so the max_effort cutoff is exact
     results = []
-    #effort_from_fact = {}
-    instantiator = Instantiator(evaluations, streams)
+    instantiator = Instantiator(evaluations, streams, prioritized=(max_effort < INF),
+                                max_effort=max_effort, unit_efforts=unit_efforts)
     while instantiator.stream_queue:
         instance = instantiator.stream_queue.popleft()
         if not is_double_bound(instance, double_bindings):
             continue
-        effort = get_instance_effort(instance, unit_efforts)
-        #op = sum # max | sum
-        #total_effort = effort + op(effort_from_fact[fact] for fact in instance.get_domain())
-        if max_effort <= effort:
-            continue
+        effort = instantiator.get_effort(instance)
         for stream_result in instance.next_optimistic():
             for fact in stream_result.get_certified():
-                #effort_from_fact[fact] = min(effort_from_fact.get(fact, INF), effort)
-                instantiator.add_atom(evaluation_from_fact(fact))
+                instantiator.add_atom(evaluation_from_fact(fact), effort=effort)
             results.append(stream_result) # TODO: don't readd if all repeated facts?
     return results
 
@@ -74,18 +69,17 @@ def optimistic_process_streams(evaluations, streams, double_bindings=None, unit_
 def optimistic_stream_grounding(stream_instance, bindings, evaluations, opt_evaluations,
                                 bind=True, immediate=False):
     # TODO: combination for domain predicates
-    evaluation_set = set(evaluations)
     opt_instances = []
     if not bind:
         bindings = {}
     input_objects = [bindings.get(i, [i]) for i in stream_instance.input_objects]
     for combo in product(*input_objects):
         mapping = dict(zip(stream_instance.input_objects, combo))
-        domain = set(map(evaluation_from_fact, substitute_expression(
+        domain = list(map(evaluation_from_fact, substitute_expression(
             stream_instance.get_domain(), mapping))) # TODO: could just instantiate first
-        if domain <= opt_evaluations:
+        if all(e in opt_evaluations for e in domain):
             instance = stream_instance.external.get_instance(combo)
-            if (instance.opt_index != 0) and (not immediate or (domain <= evaluation_set)):
+            if (instance.opt_index != 0) and (not immediate or all(e in evaluations for e in domain)):
                 instance.opt_index -= 1
             opt_instances.append(instance)
     return opt_instances
@@ -94,8 +88,7 @@ def optimistic_stream_grounding(stream_instance, bindings, evaluations, opt_eval
 def optimistic_process_stream_plan(evaluations, stream_plan):
     # TODO: can also use the instantiator and operate directly on the outputs
     # TODO: could bind by just using new_evaluations
-    evaluations = set(evaluations)
-    opt_evaluations = set(evaluations)
+    opt_evaluations = overlay_evaluations(evaluations)
     opt_bindings = {}
     opt_results = []
     for opt_result in stream_plan:
@@ -103,7 +96,7 @@ def optimistic_process_stream_plan(evaluations, stream_plan):
         for instance in optimistic_stream_grounding(opt_result.instance, opt_bindings,
                                                     evaluations, opt_evaluations):
             results = instance.next_optimistic()
-            opt_evaluations.update(evaluation_from_fact(f) for r in results for f in r.get_certified())
+            opt_evaluations.update((evaluation_from_fact(f), r) for r in results for f in r.get_certified())
             opt_results += results
             for result in results:
                 if isinstance(result, StreamResult): # Could not add if same value
@@ -167,13 +160,14 @@ def recursive_solve_stream_plan(evaluations, streams, functions, stream_results,
                                        solve_stream_plan, depth + 1)
 
 
-def iterative_solve_stream_plan(evaluations, streams, functions, solve_stream_plan):
+def iterative_solve_stream_plan(evaluations, streams, functions, solve_stream_plan, unit_efforts=False, max_effort=INF):
     # TODO: option to toggle commit using max_depth?
     # TODO: constrain to use previous plan to some degree
     num_iterations = 0
     while True:
         num_iterations += 1
-        stream_results = optimistic_process_streams(evaluations, streams + functions)
+        stream_results = optimistic_process_streams(evaluations, streams + functions,
+                                                    unit_efforts=unit_efforts, max_effort=max_effort)
         combined_plan, cost, depth = recursive_solve_stream_plan(evaluations, streams, functions,
                                                                  stream_results, solve_stream_plan, 0)
         print('Attempt: {} | Results: {} | Depth: {} | Success: {}'.format(num_iterations, len(stream_results),
@@ -1,20 +1,24 @@
+import time
 from collections import namedtuple, deque
 
 from pddlstream.algorithms.downward import fd_from_evaluation, task_from_domain_problem, get_problem, fd_from_fact, \
-    is_applicable, apply_action, get_action_instances, substitute_derived
-from pddlstream.algorithms.scheduling.recover_axioms import get_achieving_axioms, extract_axioms, \
-    extract_axiom_plan, instantiate_axioms
+    is_applicable, get_action_instances, substitute_derived
+from pddlstream.algorithms.scheduling.recover_axioms import AxiomEvaluator
 from pddlstream.algorithms.scheduling.utils import evaluations_from_stream_plan
 from pddlstream.language.constants import EQ, And, get_prefix
 from pddlstream.language.conversion import evaluation_from_fact
 from pddlstream.language.external import Result
 from pddlstream.language.function import PredicateResult
 from pddlstream.language.stream import StreamResult
-from pddlstream.utils import INF, Verbose, MockSet, implies, neighbors_from_orders, topological_sort
+from pddlstream.profiling import profiled
+from pddlstream.utils import INF, implies, neighbors_from_orders, topological_sort, elapsed_time
 
 
 # TODO: should I use the product of all future probabilities?
 
+MAX_EXACT_VERTICES = 14 # Plans with more operators are greedily reordered
+MAX_REORDER_TIME = 1 # Seconds before the exact reordering is abandoned
+
 def get_partial_orders(stream_plan, init_facts=set()):
     achieved_facts = set(init_facts) # TODO: achieved objects
     partial_orders = set()
@@ -96,8 +100,9 @@ def compute_expected_cost(stream_plan, stats_fn=get_stream_stats):
 
 Subproblem = namedtuple('Subproblem', ['cost', 'head', 'subset'])
 
-def dynamic_programming(vertices, valid_head_fn, stats_fn, prune=True, greedy=False):
+def dynamic_programming(vertices, valid_head_fn, stats_fn, prune=True, greedy=False, max_time=INF):
     # 2^N rather than N!
+    # Returns None if max_time is exceeded
     # TODO: can just do on the infos themselves
     dominates = lambda v1, v2: all(s1 <= s2 for s1, s2 in zip(stats_fn(v1), stats_fn(v2)))
     effort_orders = set()
@@ -115,7 +120,10 @@ def dynamic_programming(vertices, valid_head_fn, stats_fn, prune=True, greedy=Fa
     subset = frozenset()
     queue = deque([subset]) # Acyclic because subsets
     subproblems = {subset: Subproblem(0, None, None)}
+    start_time = time.time()
     while queue:
+        if max_time < elapsed_time(start_time):
+            return None
         subset = queue.popleft()
         applied = set()
         for v in priority_ordering:
@@ -146,8 +154,61 @@ def dynamic_programming(vertices, valid_head_fn, stats_fn, prune=True, greedy=Fa
         subset = subproblem.subset
     return ordering
 
+def get_ratio(stats):
+    # The optimal order for independent operators is by increasing overhead / (1 - p_success)
+    p_success, overhead = stats
+    if 1 <= p_success:
+        return INF
+    return overhead / (1. - p_success)
+
+def greedy_ordering(vertices, valid_head_fn, stats_fn):
+    # Builds the ordering from the back (like dynamic_programming) by placing the largest ratio last
+    ordering = []
+    subset = frozenset()
+    remaining = list(vertices)
+    while remaining:
+        candidates = [v for v in remaining if valid_head_fn(v, subset)]
+        if not candidates:
+            raise RuntimeError('Cyclic ordering constraints: {}'.format(remaining))
+        v = max(candidates, key=lambda v: get_ratio(stats_fn(v)))
+        remaining.remove(v)
+        ordering.append(v)
+        subset = subset | {v}
+    return ordering[::-1]
+
+def improve_ordering(ordering, valid_head_fn, stats_fn, max_time=INF):
+    # Swaps adjacent operators that reduce the expected cost until a local minimum or max_time
+    ordering = list(ordering)
+    start_time = time.time()
+    improved = True
+    while improved and (elapsed_time(start_time) < max_time):
+        improved = False
+        for i in reversed(range(len(ordering) - 1)):
+            v1, v2 = ordering[i], ordering[i+1]
+            (p_success1, overhead1), (p_success2, overhead2) = stats_fn(v1), stats_fn(v2)
+            if (overhead1 + p_success1*overhead2) <= (overhead2 + p_success2*overhead1):
+                continue
+            subset = frozenset(ordering[i+2:])
+            if valid_head_fn(v1, subset) and valid_head_fn(v2, subset | {v1}):
+                ordering[i], ordering[i+1] = v2, v1
+                improved = True
+    return ordering
+
+def reorder_plan(vertices, valid_head_fn, stats_fn, max_exact=MAX_EXACT_VERTICES,
+                 max_time=MAX_REORDER_TIME, **kwargs):
+    # Exact for small plans and greedy with local improvement otherwise
+    start_time = time.time()
+    if len(vertices) <= max_exact:
+        ordering = dynamic_programming(vertices, valid_head_fn, stats_fn, max_time=max_time, **kwargs)
+        if ordering is not None:
+            return ordering
+    ordering = greedy_ordering(vertices, valid_head_fn, stats_fn)
+    return improve_ordering(ordering, valid_head_fn, stats_fn,
+                            max_time=max(0, max_time - elapsed_time(start_time)))
+
 ##################################################
 
+@profiled('reorder')
 def reorder_stream_plan(stream_plan, **kwargs):
     if stream_plan is None:
         return None
@@ -155,10 +216,11 @@ def reorder_stream_plan(stream_plan, **kwargs):
     in_stream_orders, out_stream_orders = neighbors_from_orders(stream_orders)
     valid_combine = lambda v, subset: out_stream_orders[v] <= subset
     #valid_combine = lambda v, subset: in_stream_orders[v] & subset
-    return dynamic_programming(stream_plan, valid_combine, get_stream_stats, **kwargs)
+    return reorder_plan(stream_plan, valid_combine, get_stream_stats, **kwargs)
 
 ##################################################
 
+@profiled('reorder')
 def reorder_combined_plan(evaluations, combined_plan, action_info, domain, **kwargs):
     if combined_plan is None:
         return None
@@ -172,7 +234,7 @@ def reorder_combined_plan(evaluations, combined_plan, action_info, domain, **kwa
         name, _ = operator
         info = action_info[name]
         return info.p_success, info.overhead
-    return dynamic_programming(combined_plan, valid_combine, stats_fn, **kwargs)
+    return reorder_plan(combined_plan, valid_combine, stats_fn, **kwargs)
 
 
 def get_stream_instances(stream_plan):
@@ -189,39 +251,13 @@ def get_stream_instances(stream_plan):
     return stream_instances
 
 def replace_derived(task, negative_init, action_instances):
-    import pddl_to_prolog
-    import build_model
-    import axiom_rules
-    import pddl
-
-    original_actions = task.actions
-    original_init = task.init
-    task.actions = []
-    function_assignments = {f.fluent: f.expression for f in task.init
-                            if isinstance(f, pddl.f_expression.FunctionAssignment)}
-    task.init = (set(task.init) | {a.negate() for a in negative_init}) - set(function_assignments)
+    # The state along the plan is tracked by the evaluator rather than task.init
+    evaluator = AxiomEvaluator(task, negative_init)
     for instance in action_instances:
-        #axiom_plan = extract_axiom_plan(task, instance, negative_from_name={}) # TODO: refactor this
-
-        # TODO: just instantiate task?
-        with Verbose(False):
-            model = build_model.compute_model(pddl_to_prolog.translate(task))  # Changes based on init
-        # fluent_facts = instantiate.get_fluent_facts(task, model)
-        fluent_facts = MockSet()
-        instantiated_axioms = instantiate_axioms(model, task.init, fluent_facts)
-        goal_list = [] # TODO: include the goal?
-        with Verbose(False):  # TODO: helpful_axioms prunes axioms that are already true (e.g. not Unsafe)
-            helpful_axioms, axiom_init, _ = axiom_rules.handle_axioms([instance], instantiated_axioms, goal_list)
-        axiom_from_atom = get_achieving_axioms(task.init | negative_init | set(axiom_init), helpful_axioms)
-        # negated_from_name=negated_from_name)
-        axiom_plan = []
-        extract_axioms(axiom_from_atom, instance.precondition, axiom_plan)
-
-        substitute_derived(axiom_plan, instance)
-        assert(is_applicable(task.init, instance))
-        apply_action(task.init, instance)
-    task.actions = original_actions
-    task.init = original_init
+        axiom_plan = evaluator.get_axiom_plan(instance)
+        substitute_derived(axiom_plan or [], instance)
+        assert(is_applicable(evaluator.state, instance))
+        evaluator.apply_action(instance)
 
 def get_combined_orders(evaluations, stream_plan, action_plan, domain):
     if action_plan is None:
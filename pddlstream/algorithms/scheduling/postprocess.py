@@ -1,5 +1,5 @@
 from pddlstream.algorithms.downward import get_problem, task_from_domain_problem
-from pddlstream.algorithms.scheduling.recover_streams import get_achieving_streams, extract_stream_plan
+from pddlstream.algorithms.scheduling.recover_streams import AchieverIndex, extract_stream_plan
 from pddlstream.algorithms.scheduling.simultaneous import get_stream_actions
 from pddlstream.algorithms.search import solve_from_task
 from pddlstream.language.constants import And
@@ -22,9 +22,14 @@ def reschedule_stream_plan(evaluations, preimage_facts, domain, stream_results,
 
 ##################################################
 
-def shorten_stream_plan(evaluations, stream_plan, target_facts):
+def get_evaluation_subgoals(evaluations, stream_plan, target_facts):
+    all_subgoals = set(target_facts) | set(flatten(r.instance.get_domain() for r in stream_plan))
+    return set(filter(evaluations.__contains__, map(evaluation_from_fact, all_subgoals)))
+
+
+def shorten_stream_plan(evaluations, stream_plan, target_facts, achiever_index=None):
+    # achiever_index must contain exactly the results in stream_plan
     all_subgoals = set(target_facts) | set(flatten(r.instance.get_domain() for r in stream_plan))
-    evaluation_subgoals = set(filter(evaluations.__contains__, map(evaluation_from_fact, all_subgoals)))
     open_subgoals = set(filter(lambda f: evaluation_from_fact(f) not in evaluations, all_subgoals))
     results_from_fact = {}
     for result in stream_plan:
@@ -38,18 +43,26 @@ def shorten_stream_plan(evaluations, stream_plan, target_facts):
             new_stream_plan.remove(removed_result)
             return new_stream_plan
         if all(2 <= len(results_from_fact[fact]) for fact in certified_subgoals):
-            node_from_atom = get_achieving_streams(evaluation_subgoals, set(stream_plan) - {removed_result})
-            if all(fact in node_from_atom for fact in target_facts):
+            if achiever_index is None:
+                achiever_index = AchieverIndex(get_evaluation_subgoals(evaluations, stream_plan, target_facts),
+                                               stream_plan)
+            achiever_index.remove_result(removed_result)
+            if all(fact in achiever_index for fact in target_facts):
                 new_stream_plan = []
-                extract_stream_plan(node_from_atom, target_facts, new_stream_plan)
+                extract_stream_plan(achiever_index.node_from_atom, target_facts, new_stream_plan)
                 return new_stream_plan
+            achiever_index.add_result(removed_result)
     return None
 
 
 def prune_stream_plan(evaluations, stream_plan, target_facts):
+    # A single achiever index is updated as results are pruned rather than recomputed per candidate
+    # The initial evaluation subgoals are a superset of those needed by any pruned stream plan
+    achiever_index = AchieverIndex(get_evaluation_subgoals(evaluations, stream_plan, target_facts), stream_plan)
     while True:
-        new_stream_plan = shorten_stream_plan(evaluations, stream_plan, target_facts)
+        new_stream_plan = shorten_stream_plan(evaluations, stream_plan, target_facts, achiever_index)
         if new_stream_plan is None:
             break
+        achiever_index.remove_results(set(stream_plan) - set(new_stream_plan))
         stream_plan = new_stream_plan
-    return stream_plan
\ No newline at end of file
+    return stream_plan
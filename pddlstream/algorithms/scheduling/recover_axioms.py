@@ -1,6 +1,7 @@
 from collections import defaultdict, deque
 
-from pddlstream.algorithms.downward import get_literals, conditions_hold
+from pddlstream.algorithms.downward import get_literals, conditions_hold, apply_action
+from pddlstream.algorithms.translator import DatalogModel
 from pddlstream.language.constants import is_parameter
 from pddlstream.utils import Verbose, MockSet
 
@@ -198,3 +199,56 @@ def extract_axiom_plan(task, action_instance, negative_from_name, static_state=s
     #if not success:
     #    return None
     return axiom_plan
+
+##################################################
+
+class AxiomEvaluator(object):
+    """
+    Recovers the axioms supporting the derived preconditions along a sequence of action instances
+    The Datalog model is computed once and extended with the add effects of each applied action
+    Deleted facts remain in the model, which only adds axiom instances whose conditions are checked against the state
+    """
+    def __init__(self, task, negative_init=set()):
+        import pddl
+        import pddl_to_prolog
+        function_assignments = {f for f in task.init if isinstance(f, pddl.f_expression.FunctionAssignment)}
+        self.state = (set(task.init) | {a.negate() for a in negative_init}) - function_assignments
+        self.negative_init = set(negative_init)
+        self.axioms_from_name = get_derived_predicates(task.axioms)
+        original_actions, original_init = task.actions, task.init
+        task.actions, task.init = [], self.state
+        with Verbose(False):
+            program = pddl_to_prolog.translate(task)
+        task.actions, task.init = original_actions, original_init
+        self.model = DatalogModel(program)
+        self.num_atoms = 0
+        self.instantiated_axioms = []
+        self.extend([fact.atom for fact in program.facts])
+    def extend(self, atoms):
+        self.model.extend(atoms)
+        new_atoms = self.model.atoms[self.num_atoms:]
+        self.num_atoms = len(self.model.atoms)
+        # Every fact is fluent, so the instantiated axioms don't depend on the state
+        self.instantiated_axioms.extend(instantiate_axioms(new_atoms, self.state, MockSet()))
+    def get_axiom_plan(self, action_instance):
+        # Returns None if the non-derived preconditions do not hold (like extract_axiom_plan)
+        import axiom_rules
+        nonderived_preconditions = [l for l in action_instance.precondition
+                                    if l.predicate not in self.axioms_from_name]
+        if not conditions_hold(self.state, nonderived_preconditions):
+            return None
+        if not self.axioms_from_name:
+            return []
+        goal_list = [] # TODO: include the goal?
+        with Verbose(False):  # TODO: helpful_axioms prunes axioms that are already true (e.g. not Unsafe)
+            helpful_axioms, axiom_init, _ = axiom_rules.handle_axioms(
+                [action_instance], self.instantiated_axioms, goal_list)
+        axiom_from_atom = get_achieving_axioms(self.state | self.negative_init | set(axiom_init), helpful_axioms)
+        axiom_plan = []
+        extract_axioms(axiom_from_atom, action_instance.precondition, axiom_plan)
+        return axiom_plan
+    def apply_action(self, action_instance):
+        apply_action(self.state, action_instance)
+        self.extend(effect for _, effect in action_instance.add_effects)
+    def __repr__(self):
+        return '{}({}, {})'.format(self.__class__.__name__, len(self.state), len(self.instantiated_axioms))
@@ -27,7 +27,8 @@ def get_achieving_streams(evaluations, stream_results, unit_efforts=False): #, m
         if is_atom(atom):
             node_from_atom[fact_from_evaluation(atom)] = Node(0, None)
 
-    queue = [HeapElement(node.effort, atom) for atom, node in node_from_atom.items()]
+    # Only atoms that are conditions of some stream result need to be processed
+    queue = [HeapElement(node.effort, atom) for atom, node in node_from_atom.items() if atom in unprocessed_from_atom]
     while queue:
         atom = heappop(queue).value
         if atom not in unprocessed_from_atom:
@@ -54,11 +55,125 @@ def extract_stream_plan(node_from_atom, target_facts, stream_plan):
     # TODO: prune with rules
     # TODO: linearization that takes into account satisfied goals at each level
     # TODO: can optimize for all streams & axioms all at once
-    for fact in target_facts:
-        if fact not in node_from_atom:
-            raise RuntimeError('Preimage fact {} is not achievable!'.format(fact))
-        stream_result = node_from_atom[fact].stream_result
-        if (stream_result is None) or (stream_result in stream_plan):
-            continue
-        extract_stream_plan(node_from_atom, stream_result.instance.get_domain(), stream_plan)
-        stream_plan.append(stream_result) # TODO: don't add if satisfied
+    # Iterative post-order traversal (avoids the recursion limit and the linear stream_plan membership test)
+    added = set(stream_plan)
+    stack = [(iter(target_facts), None)]
+    while stack:
+        facts, parent = stack[-1]
+        for fact in facts:
+            if fact not in node_from_atom:
+                raise RuntimeError('Preimage fact {} is not achievable!'.format(fact))
+            stream_result = node_from_atom[fact].stream_result
+            if (stream_result is None) or (stream_result in added):
+                continue
+            stack.append((iter(stream_result.instance.get_domain()), stream_result))
+            break
+        else:
+            stack.pop()
+            if parent is not None:
+                stream_plan.append(parent) # TODO: don't add if satisfied
+                added.add(parent)
+
+##################################################
+
+class AchieverIndex(object):
+    """
+    Maintains the minimum effort achiever of each fact as stream results are added and removed
+    Removing a result only recomputes the facts whose achievers depended on it
+    """
+    def __init__(self, evaluations, stream_results=[], unit_efforts=False):
+        self.unit_efforts = unit_efforts
+        self.node_from_atom = {NULL_COND: Node(0, None)}
+        for atom in evaluations:
+            if is_atom(atom):
+                self.node_from_atom[fact_from_evaluation(atom)] = Node(0, None)
+        self.results = set()
+        self.conditions_from_stream = {}
+        self.effort_from_stream = {}
+        self.results_from_condition = defaultdict(set)
+        self.results_from_certified = defaultdict(set)
+        queue = [HeapElement(node.effort, atom) for atom, node in self.node_from_atom.items()]
+        self._register(stream_results)
+        self._propagate(queue)
+    def __contains__(self, fact):
+        return fact in self.node_from_atom
+    def get(self, fact, default=None):
+        return self.node_from_atom.get(fact, default)
+    def get_achievers(self):
+        node_from_atom = dict(self.node_from_atom)
+        del node_from_atom[NULL_COND]
+        return node_from_atom
+    def _register(self, stream_results):
+        new_results = []
+        for result in stream_results:
+            if result in self.results:
+                continue
+            self.results.add(result)
+            self.conditions_from_stream[result] = result.instance.get_domain() + (NULL_COND,)
+            self.effort_from_stream[result] = get_instance_effort(result.instance, self.unit_efforts)
+            for atom in self.conditions_from_stream[result]:
+                self.results_from_condition[atom].add(result)
+            for atom in result.get_certified():
+                self.results_from_certified[atom].add(result)
+            new_results.append(result)
+        return new_results
+    def _relax(self, result, queue):
+        conditions = self.conditions_from_stream[result]
+        if not all(cond in self.node_from_atom for cond in conditions):
+            return
+        total_effort = self.effort_from_stream[result] + COMBINE_OP(
+            self.node_from_atom[cond].effort for cond in conditions)
+        for new_atom in result.get_certified():
+            if (new_atom not in self.node_from_atom) or (total_effort < self.node_from_atom[new_atom].effort):
+                self.node_from_atom[new_atom] = Node(total_effort, result)
+                heappush(queue, HeapElement(total_effort, new_atom))
+    def _propagate(self, queue):
+        while queue:
+            effort, atom = heappop(queue)
+            node = self.node_from_atom.get(atom, None)
+            if (node is None) or (node.effort != effort): # Stale entry
+                continue
+            for result in self.results_from_condition.get(atom, []):
+                self._relax(result, queue)
+    def add_results(self, stream_results):
+        queue = []
+        for result in self._register(stream_results):
+            self._relax(result, queue)
+        self._propagate(queue)
+    def add_result(self, stream_result):
+        self.add_results([stream_result])
+    def remove_results(self, stream_results):
+        removed = set(stream_results) & self.results
+        if not removed:
+            return
+        for result in removed:
+            self.results.remove(result)
+            for atom in self.conditions_from_stream.pop(result):
+                self.results_from_condition[atom].discard(result)
+            for atom in result.get_certified():
+                self.results_from_certified[atom].discard(result)
+            del self.effort_from_stream[result]
+        # Invalidates the facts whose achievers transitively depend on a removed result
+        invalid = set()
+        stack = [atom for result in removed for atom in result.get_certified()]
+        while stack:
+            atom = stack.pop()
+            node = self.node_from_atom.get(atom, None)
+            if (atom in invalid) or (node is None) or (node.stream_result is None):
+                continue
+            if (node.stream_result not in removed) and \
+                    all(cond not in invalid for cond in node.stream_result.instance.get_domain()):
+                continue
+            invalid.add(atom)
+            del self.node_from_atom[atom]
+            for result in self.results_from_condition.get(atom, []):
+                stack.extend(result.get_certified())
+        # Recomputes the invalidated facts from their remaining achievers
+        queue = []
+        for result in {result for atom in invalid for result in self.results_from_certified.get(atom, [])}:
+            self._relax(result, queue)
+        self._propagate(queue)
+    def remove_result(self, stream_result):
+        self.remove_results([stream_result])
+    def __repr__(self):
+        return '{}(results={}, facts={})'.format(self.__class__.__name__, len(self.results), len(self.node_from_atom) - 1)
@@ -1,6 +1,6 @@
 from pddlstream.algorithms.downward import get_problem, task_from_domain_problem, apply_action, fact_from_fd, \
     conditions_hold, get_goal_instance, plan_preimage, get_literals, instantiate_task, \
-    sas_from_instantiated, scale_cost, fd_from_fact
+    sas_from_instantiated, scale_cost, fd_from_fact, fd_from_evaluation
 from pddlstream.algorithms.scheduling.postprocess import reschedule_stream_plan, prune_stream_plan
 from pddlstream.algorithms.scheduling.recover_axioms import get_derived_predicates, extract_axiom_plan
 from pddlstream.algorithms.scheduling.recover_streams import get_achieving_streams, extract_stream_plan, \
@@ -10,13 +10,16 @@ from pddlstream.algorithms.scheduling.simultaneous import extract_function_resul
 from pddlstream.algorithms.scheduling.utils import partition_results, \
     get_results_from_head, apply_streams
 from pddlstream.algorithms.search import abstrips_solve_from_task
-from pddlstream.language.conversion import obj_from_pddl_plan, obj_from_pddl, substitute_expression
+from pddlstream.algorithms.translator import instantiate_domain_problem
+from pddlstream.language.conversion import obj_from_pddl_plan, obj_from_pddl, substitute_expression, is_atom
 from pddlstream.language.function import PredicateResult, Predicate
 from pddlstream.language.optimizer import partition_external_plan, is_optimizer_result
 from pddlstream.language.stream import Stream, StreamResult
+from pddlstream.profiling import profiled
 from pddlstream.utils import Verbose, MockSet, INF
 
 DO_RESCHEDULE = False
+INCREMENTAL_TRANSLATION = True
 
 def instantiate_actions(opt_task, type_to_objects, function_assignments, action_plan):
     action_instances = []
@@ -125,6 +128,7 @@ def convert_fluent_streams(stream_plan, real_states, step_from_fact, node_from_a
 
 ##################################################
 
+@profiled('recover_stream_plan')
 def recover_stream_plan(evaluations, goal_expression, domain, stream_results, action_plan, negative, unit_costs):
     import pddl
     import instantiate
@@ -237,7 +241,12 @@ def relaxed_stream_plan(evaluations, goal_expression, domain, stream_results, ne
     problem = get_problem(opt_evaluations, goal_expression, stream_domain, unit_costs) # begin_metric
 
     with Verbose(debug):
-        instantiated = instantiate_task(task_from_domain_problem(stream_domain, problem))
+        if INCREMENTAL_TRANSLATION:
+            # Only the model of the real evaluations is retained across iterations
+            base_init = [fd_from_evaluation(e) for e in evaluations if is_atom(e)]
+            instantiated = instantiate_domain_problem(stream_domain, problem, base_init=base_init)
+        else:
+            instantiated = instantiate_task(task_from_domain_problem(stream_domain, problem))
     if instantiated is None:
         return None, INF
     if (effort_weight is not None) or any(map(is_optimizer_result, applied_results)):
@@ -1,6 +1,7 @@
 from collections import defaultdict
 
 from pddlstream.language.conversion import evaluation_from_fact
+from pddlstream.language.evaluations import EvaluationStore, overlay_evaluations
 from pddlstream.language.stream import StreamResult
 from pddlstream.language.function import FunctionResult
 from pddlstream.algorithms.scheduling.recover_streams import get_achieving_streams
@@ -31,34 +32,40 @@ def evaluations_from_stream_plan(evaluations, stream_plan):
 def partition_results(evaluations, results, apply_now):
     applied_results = []
     deferred_results = []
-    opt_evaluations = set(evaluations)
+    opt_evaluations = overlay_evaluations(evaluations)
     for result in results:
         assert(not result.instance.disabled)
         assert(not result.instance.enumerated)
-        domain = set(map(evaluation_from_fact, result.instance.get_domain()))
-        if isinstance(result, FunctionResult) or (apply_now(result) and (domain <= opt_evaluations)):
+        domain = map(evaluation_from_fact, result.instance.get_domain())
+        if isinstance(result, FunctionResult) or (apply_now(result) and all(e in opt_evaluations for e in domain)):
             applied_results.append(result)
-            opt_evaluations.update(map(evaluation_from_fact, result.get_certified()))
+            opt_evaluations.update((evaluation_from_fact(f), result) for f in result.get_certified())
         else:
             deferred_results.append(result)
     return applied_results, deferred_results
 
 def evaluations_from_stream_plan(evaluations, stream_results, max_effort=INF):
-    opt_evaluations = set(evaluations)
+    opt_evaluations = overlay_evaluations(evaluations)
     for result in stream_results:
         assert(not result.instance.disabled)
         assert(not result.instance.enumerated)
-        domain = set(map(evaluation_from_fact, result.instance.get_domain()))
-        assert(domain <= opt_evaluations)
-        opt_evaluations.update(map(evaluation_from_fact, result.get_certified()))
+        assert(all(evaluation_from_fact(f) in opt_evaluations for f in result.instance.get_domain()))
+        opt_evaluations.update((evaluation_from_fact(f), result) for f in result.get_certified())
+    # The existing evaluations have result None
+    result_from_evaluation = overlay_evaluations(evaluations, inherit_results=False)
     node_from_atom = get_achieving_streams(evaluations, stream_results)
-    result_from_evaluation = {evaluation_from_fact(f): n.stream_result
-                              for f, n in node_from_atom.items() if n.effort < max_effort}
+    for result in stream_results:
+        for fact in result.get_certified():
+            node = node_from_atom.get(fact)
+            if (node is not None) and (node.stream_result is not None) and (node.effort < max_effort):
+                result_from_evaluation[evaluation_from_fact(fact)] = node.stream_result
     return result_from_evaluation
 
 ##################################################
 
 def get_results_from_head(evaluations):
+    if isinstance(evaluations, EvaluationStore):
+        return evaluations.get_results_from_head()
     results_from_head = defaultdict(list)
     for evaluation, stream_result in evaluations.items():
         results_from_head[evaluation.head].append((evaluation.value, stream_result))
@@ -67,7 +74,8 @@ def get_results_from_head(evaluations):
 
 
 def apply_streams(evaluations, stream_results):
-    function_evaluations = {e: None for e in evaluations}
+    # The existing evaluations have result None
+    function_evaluations = overlay_evaluations(evaluations, inherit_results=False)
     for result in stream_results:
         for fact in result.get_certified():
             function_evaluations[evaluation_from_fact(fact)] = result
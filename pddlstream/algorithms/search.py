@@ -5,6 +5,9 @@ from time import time
 
 from pddlstream.algorithms.downward import write_sas_task, parse_solution, run_search, TEMP_DIR, sas_from_pddl, write_pddl, \
     translate_and_write_pddl
+from pddlstream.algorithms.internal_search import run_internal_search
+from pddlstream.algorithms.portfolio import Portfolio, PORTFOLIO, get_default_portfolio
+from pddlstream.profiling import profiled, profile
 from pddlstream.utils import INF, Verbose, safe_rm_dir
 
 # TODO: manual_patterns
@@ -14,13 +17,30 @@ from pddlstream.utils import INF, Verbose, safe_rm_dir
 # TODO: allow switch to higher-level in heuristic
 # TODO: recursive application of these
 
+@profiled('search')
+def run_sas_search(sas_task, temp_dir=TEMP_DIR, internal=False, search_pool=None, debug=False, **kwargs):
+    # internal=True searches in-process without writing output.sas or calling downward
+    # search_pool=SearchPool(...) runs the search on one of the pool's threads (or worker processes if internal)
+    # planner=Portfolio(...) or planner=PORTFOLIO runs several downward configurations in parallel
+    planner = kwargs.get('planner', None)
+    if planner == PORTFOLIO:
+        planner = get_default_portfolio()
+    if isinstance(planner, Portfolio):
+        kwargs.pop('planner')
+        return planner.search(sas_task, temp_dir=temp_dir, debug=debug, **kwargs)
+    if search_pool is not None:
+        return search_pool.search(sas_task, internal=internal, debug=debug, **kwargs)
+    if internal:
+        return run_internal_search(sas_task, debug=debug, **kwargs)
+    write_sas_task(sas_task, temp_dir)
+    return run_search(temp_dir, debug=debug, **kwargs)
+
 def solve_from_task(sas_task, temp_dir=TEMP_DIR, clean=False, debug=False, hierarchy=[], **kwargs):
     # TODO: can solve using another planner and then still translate using FastDownward
     start_time = time()
     with Verbose(debug):
         print('\n' + 50*'-' + '\n')
-        write_sas_task(sas_task, temp_dir)
-        solution = run_search(temp_dir, debug=True, **kwargs)
+        solution = run_sas_search(sas_task, temp_dir, debug=True, **kwargs)
         if clean:
             safe_rm_dir(temp_dir)
         print('Total runtime:', time() - start_time)
@@ -37,8 +57,10 @@ def solve_from_pddl(domain_pddl, problem_pddl, temp_dir=TEMP_DIR, clean=False, d
     with Verbose(debug):
         write_pddl(domain_pddl, problem_pddl, temp_dir)
         #run_translate(temp_dir, verbose)
-        translate_and_write_pddl(domain_pddl, problem_pddl, temp_dir, debug)
-        solution = run_search(temp_dir, debug=debug, **kwargs)
+        with profile('translate'):
+            translate_and_write_pddl(domain_pddl, problem_pddl, temp_dir, debug)
+        with profile('search'):
+            solution = run_search(temp_dir, debug=debug, **kwargs)
         if clean:
             safe_rm_dir(temp_dir)
         print('Total runtime:', time() - start_time)
@@ -71,8 +93,7 @@ def plan_subgoals(sas_task, subgoal_plan, temp_dir, **kwargs):
     full_cost = 0
     for subgoal in subgoal_plan:
         sas_task.goal.pairs = subgoal
-        write_sas_task(sas_task, temp_dir)
-        plan, cost = parse_solution(run_search(temp_dir, debug=True, **kwargs))
+        plan, cost = parse_solution(run_sas_search(sas_task, temp_dir, debug=True, **kwargs))
         if plan is None:
             return None, INF
         full_plan.extend(plan)
@@ -177,8 +198,7 @@ def abstrips_solve_from_task(sas_task, temp_dir=TEMP_DIR, clean=False, debug=Fal
             local_sas_task = deepcopy(sas_task)
             prune_hierarchy_pre_eff(local_sas_task, hierarchy[level:]) # TODO: break if no pruned
             add_subgoals(local_sas_task, last_plan)
-            write_sas_task(local_sas_task, temp_dir)
-            plan, cost = parse_solution(run_search(temp_dir, debug=True, **kwargs))
+            plan, cost = parse_solution(run_sas_search(local_sas_task, temp_dir, debug=True, **kwargs))
             if (level == len(hierarchy)) or (plan is None):
                 # TODO: fall back on standard search
                 break
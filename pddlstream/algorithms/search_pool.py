@@ -0,0 +1,165 @@
+from __future__ import print_function
+
+import multiprocessing
+import os
+import threading
+from itertools import count
+from multiprocessing.pool import ThreadPool
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+from pddlstream.algorithms.downward import TEMP_DIR, sas_text_from_task, run_search_pipe
+from pddlstream.algorithms.internal_search import run_internal_search
+from pddlstream.utils import ensure_dir, safe_rm_dir
+
+# downward solves a single task per process, so each external search pipes its task to a new downward process
+# (without a shell) from one of the pool's threads, which wait on the subprocess without holding the GIL
+# The internal search is python, so it runs in long-lived worker processes instead
+# TODO: cancel requests whose results are no longer needed
+# TODO: route requests for the same problem to the same worker
+
+POLL_PERIOD = 1. # Seconds between checks that the workers are alive
+
+def get_worker_dir(temp_dir, worker_id):
+    return os.path.join(temp_dir, 'worker{}/'.format(worker_id))
+
+def search_worker(requests, results):
+    # Long-lived process that receives SAS tasks over a queue and runs the internal search on them
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, task, kwargs = request
+        try:
+            results.put((request_id, run_internal_search(task, **kwargs), None))
+        except Exception as e:
+            results.put((request_id, None, '{}: {}'.format(e.__class__.__name__, e)))
+
+##################################################
+
+class SearchPool(object):
+    """
+    A pool that runs several planning requests concurrently
+    Pass as search_pool=... to solve_focused, solve_incremental, or abstrips_solve_from_task
+    :param num_workers: the maximum number of concurrent searches of each kind (external and internal)
+    """
+    def __init__(self, num_workers=None, temp_dir=TEMP_DIR):
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        assert 1 <= num_workers
+        self.num_workers = num_workers
+        self.temp_dir = temp_dir
+        self.threads = ThreadPool(num_workers)
+        self.local = threading.local() # The scratch directory of each thread
+        self.worker_ids = count()
+        self.requests = None
+        self.results = None
+        self.workers = [] # Started upon the first internal request
+        self.request_ids = count()
+        self.pending = set()
+        self.completed = {}
+        self.async_results = {}
+        self.receiving = False
+        self.condition = threading.Condition() # Allows results to be collected from several threads
+        self.closed = False
+    def _start_workers(self):
+        self.requests = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        for worker_id in range(self.num_workers):
+            worker = multiprocessing.Process(target=search_worker, name='search_worker{}'.format(worker_id),
+                                             args=(self.requests, self.results))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+    def _search_pipe(self, sas_text, kwargs):
+        if not hasattr(self.local, 'worker_dir'):
+            with self.condition:
+                self.local.worker_dir = get_worker_dir(self.temp_dir, next(self.worker_ids))
+            ensure_dir(self.local.worker_dir)
+        return run_search_pipe(sas_text, self.local.worker_dir, **kwargs)
+    def submit(self, sas_task, internal=False, **kwargs):
+        # Returns immediately with an id that is passed to result
+        if self.closed:
+            raise RuntimeError('SearchPool is closed')
+        with self.condition:
+            request_id = next(self.request_ids)
+            self.pending.add(request_id)
+            if internal:
+                if not self.workers:
+                    self._start_workers()
+                self.requests.put((request_id, sas_task, kwargs))
+            else:
+                # The downward binary parses the SAS text, so only the internal search needs the task object
+                self.async_results[request_id] = self.threads.apply_async(
+                    self._search_pipe, (sas_text_from_task(sas_task), kwargs))
+        return request_id
+    def _receive(self):
+        while True:
+            try:
+                return self.results.get(timeout=POLL_PERIOD)
+            except Empty:
+                if not all(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError('A search worker unexpectedly terminated')
+    def _wait(self, request_id):
+        # One thread at a time receives from the workers (without the lock) and buffers results for the others
+        with self.condition:
+            while request_id not in self.completed:
+                if request_id not in self.pending:
+                    raise KeyError(request_id)
+                if self.receiving:
+                    self.condition.wait(POLL_PERIOD)
+                    continue
+                self.receiving = True
+                self.condition.release()
+                try:
+                    received_id, solution, error = self._receive()
+                finally:
+                    self.condition.acquire()
+                    self.receiving = False
+                    self.condition.notify_all()
+                self.completed[received_id] = (solution, error)
+            self.pending.discard(request_id)
+            return self.completed.pop(request_id)
+    def result(self, request_id):
+        with self.condition:
+            async_result = self.async_results.pop(request_id, None)
+        if async_result is None:
+            solution, error = self._wait(request_id)
+        else:
+            try:
+                solution, error = async_result.get(), None
+            except Exception as e:
+                solution, error = None, '{}: {}'.format(e.__class__.__name__, e)
+            with self.condition:
+                self.pending.discard(request_id)
+        if error is not None:
+            raise RuntimeError('Search request {} failed: {}'.format(request_id, error))
+        return solution
+    def search(self, sas_task, **kwargs):
+        return self.result(self.submit(sas_task, **kwargs))
+    def map(self, sas_tasks, **kwargs):
+        # Solves several tasks concurrently
+        request_ids = [self.submit(sas_task, **kwargs) for sas_task in sas_tasks]
+        return [self.result(request_id) for request_id in request_ids]
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.threads.close()
+        self.threads.join()
+        for _ in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join()
+        for worker_id in range(next(self.worker_ids)):
+            safe_rm_dir(get_worker_dir(self.temp_dir, worker_id))
+        self.workers = []
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.num_workers)
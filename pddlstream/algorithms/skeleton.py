@@ -1,17 +1,24 @@
+import hashlib
 import time
-from collections import namedtuple, Sized
+from collections import namedtuple
+try:
+    from collections.abc import Sized
+except ImportError:
+    from collections import Sized
 from heapq import heappush, heappop
+from multiprocessing.pool import ThreadPool
 
 from pddlstream.algorithms.algorithm import add_certified, add_facts
 from pddlstream.language.conversion import evaluation_from_fact
 from pddlstream.language.function import FunctionResult
 from pddlstream.language.stream import StreamResult, StreamInstance
 from pddlstream.language.synthesizer import SynthStreamResult
+from pddlstream.profiling import profiled
 from pddlstream.utils import elapsed_time, HeapElement, INF
 from pddlstream.algorithms.downward import task_from_domain_problem, get_problem, get_action_instances, \
-    get_goal_instance, plan_preimage, is_valid_plan, substitute_derived, is_applicable, apply_action
+    get_goal_instance, plan_preimage, is_valid_plan, substitute_derived, is_applicable
 from pddlstream.algorithms.reorder import replace_derived
-from pddlstream.algorithms.scheduling.recover_axioms import extract_axiom_plan
+from pddlstream.algorithms.scheduling.recover_axioms import AxiomEvaluator
 
 # TODO: handle this in a partially ordered way
 # TODO: alternatively store just preimage and reachieve
@@ -19,16 +26,15 @@ from pddlstream.algorithms.scheduling.recover_axioms import extract_axiom_plan
 def is_solution(domain, evaluations, action_plan, goal_expression):
     task = task_from_domain_problem(domain, get_problem(evaluations, goal_expression, domain, unit_costs=True))
     action_instances = get_action_instances(task, action_plan) + [get_goal_instance(task.goal)]
-    #original_init = task.init
-    task.init = set(task.init)
+    evaluator = AxiomEvaluator(task)
     for instance in action_instances:
-        axiom_plan = extract_axiom_plan(task, instance, negative_from_name={}, static_state=task.init)
+        axiom_plan = evaluator.get_axiom_plan(instance)
         if axiom_plan is None:
             return False
         #substitute_derived(axiom_plan, instance)
-        #if not is_applicable(task.init, instance):
+        #if not is_applicable(evaluator.state, instance):
         #    return False
-        apply_action(task.init, instance)
+        evaluator.apply_action(instance)
     return True
     #replace_derived(task, set(), plan_instances)
     #preimage = plan_preimage(plan_instances, [])
@@ -36,9 +42,11 @@ def is_solution(domain, evaluations, action_plan, goal_expression):
 
 ##################################################
 
+@profiled('process_skeleton')
 def process_skeleton(skeleton, queue, accelerate=1):
-    # TODO: hash combinations to prevent repeats
-    stream_plan, plan_attempts, bindings, plan_index, cost = skeleton
+    stream_plan, plan_attempts = skeleton.stream_plan, skeleton.plan_attempts
+    plan_index, cost = skeleton.plan_index, skeleton.cost
+    bindings = skeleton.get_bindings()
     new_values = False
     is_wild = False
     if not stream_plan:
@@ -52,7 +60,7 @@ def process_skeleton(skeleton, queue, accelerate=1):
         # TODO: what should I do if the cost=inf (from incremental/exhaustive)
         #for result in stream_plan:
         #    result.instance.disabled = False
-        stream_plan[0].instance.enable(queue.evaluations, queue.domain)
+        stream_plan[0].remap_instance(bindings).enable(queue.evaluations, queue.domain)
         # TODO: only disable if not used elsewhere
         # TODO: could just hash instances
         return new_values
@@ -61,15 +69,16 @@ def process_skeleton(skeleton, queue, accelerate=1):
     results = []
     index = None
     for i, (result, attempt) in enumerate(zip(stream_plan, plan_attempts)):
-        if result.instance.num_calls != attempt:
-            for j in range(attempt, result.instance.num_calls):
-                results.extend(result.instance.results_history[j])
+        instance = result.remap_instance(bindings)
+        if instance.num_calls != attempt:
+            for j in range(attempt, instance.num_calls):
+                results.extend(instance.results_history[j])
             index = i
             break
 
     if index is None:
         index = 0
-        instance = stream_plan[index].instance
+        instance = stream_plan[index].remap_instance(bindings)
         #assert(instance.opt_index == 0)
         assert (not any(evaluation_from_fact(f) not in queue.evaluations for f in instance.get_domain()))
         new_results, new_facts = instance.next_results(accelerate=accelerate, verbose=queue.store.verbose)
@@ -81,34 +90,46 @@ def process_skeleton(skeleton, queue, accelerate=1):
         is_wild |= bool(add_facts(queue.evaluations, new_facts, result=None)) # TODO: use instance
         #new_values |= is_wild
 
-    opt_result = stream_plan[index] # TODO: could do several at once but no real point
+    opt_result = stream_plan[index].remap_inputs(bindings) # TODO: could do several at once but no real point
     for result in results:
         add_certified(queue.evaluations, result)
         #if (type(result) is PredicateResult) and (opt_result.value != result.value):
         if not result.is_successful():
             continue # TODO: check if satisfies target certified
-        new_bindings = bindings.copy()
+        new_bindings = {}
         new_stream_plan =  stream_plan[:index] + stream_plan[index+1:]
         new_plan_attempts = plan_attempts[:index] + plan_attempts[index+1:]
         if isinstance(result, StreamResult):
             for opt, obj in zip(opt_result.output_objects, result.output_objects):
-                assert(opt not in new_bindings) # TODO: return failure if conflicting bindings
+                assert(opt not in bindings) # TODO: return failure if conflicting bindings
                 new_bindings[opt] = obj
         new_cost = cost
         if type(result) is FunctionResult:
             new_cost += (result.value - opt_result.value)
-        queue.add_skeleton(new_stream_plan, new_plan_attempts, new_bindings, plan_index, new_cost)
+        queue.add_skeleton(new_stream_plan, new_plan_attempts, new_bindings, plan_index, new_cost, parent=skeleton)
 
     if (plan_attempts[index] == 0) and isinstance(opt_result, SynthStreamResult): # TODO: only add if failure?
-        decomposition = opt_result.decompose()
+        decomposition = tuple(opt_result.decompose())
         new_stream_plan = stream_plan[:index] + decomposition + stream_plan[index+1:]
         new_plan_attempts = plan_attempts[:index] + [0]*len(decomposition) + plan_attempts[index+1:]
-        queue.add_skeleton(new_stream_plan, new_plan_attempts, bindings, plan_index, cost)
+        queue.add_skeleton(new_stream_plan, new_plan_attempts, {}, plan_index, cost, parent=skeleton)
     if not opt_result.instance.enumerated:
         plan_attempts[index] = opt_result.instance.num_calls
-        queue.add_skeleton(*skeleton)
+        queue.push_skeleton(skeleton)
     return new_values
 
+def get_sample_instance(skeleton, queue):
+    # Returns the instance that process_skeleton would sample or None if it would reuse previous results
+    if not skeleton.stream_plan:
+        return None
+    if (queue.store.best_cost < INF) and (queue.store.best_cost <= skeleton.cost):
+        return None
+    bindings = skeleton.get_bindings()
+    instances = [result.remap_instance(bindings) for result in skeleton.stream_plan]
+    if any(instance.num_calls != attempt for instance, attempt in zip(instances, skeleton.plan_attempts)):
+        return None
+    return instances[0]
+
 ##################################################
 
 # TODO: want to minimize number of new sequences as they induce overhead
@@ -154,31 +175,117 @@ def compute_effort(plan_attempts):
 ##################################################
 
 SkeletonKey = namedtuple('SkeletonKey', ['attempted', 'effort'])
-Skeleton = namedtuple('Skeleton', ['stream_plan', 'plan_attempts',
-                                   'bindings', 'plan_index', 'cost'])
+
+def get_digest(string):
+    # Derived from object names, which are preserved by checkpoints (unlike the hashes of objects)
+    # Collisions between 128-bit digests are negligible, so skeletons are compared by their digests alone
+    return int(hashlib.md5(string.encode('utf-8')).hexdigest(), 16)
+
+def hash_bindings(bindings):
+    # Independent of the order, so the hash of a node's bindings extends the hash of its parent's bindings
+    bindings_hash = 0
+    for opt, obj in bindings.items():
+        bindings_hash ^= get_digest('{}={}'.format(opt.pddl, obj.pddl))
+    return bindings_hash
+
+def get_result_name(result):
+    name, input_objects, outputs = result.get_tuple()
+    if not isinstance(result, FunctionResult):
+        outputs = ' '.join(obj.pddl for obj in outputs)
+    return '{}({})->{}'.format(name, ' '.join(obj.pddl for obj in input_objects), outputs)
+
+def hash_stream_plan(stream_plan):
+    return get_digest('\n'.join(map(get_result_name, stream_plan)))
+
+class Skeleton(object):
+    """
+    A persistent node in the tree of partially bound stream plans
+    Stores only the bindings introduced since its parent, and the stream_plan tuple retains the optimistic
+    results, which are remapped using the bindings when processed
+    """
+    __slots__ = ['stream_plan', 'plan_attempts', 'parent', 'new_bindings', 'plan_index', 'cost',
+                 'bindings_hash', 'bindings']
+    def __init__(self, stream_plan, plan_attempts, new_bindings, plan_index, cost, parent=None):
+        if (parent is not None) and not new_bindings:
+            # Shares the bindings of the parent without extending the chain
+            parent, new_bindings = parent.parent, parent.new_bindings
+        self.stream_plan = tuple(stream_plan)
+        self.plan_attempts = list(plan_attempts)
+        self.parent = parent
+        self.new_bindings = new_bindings
+        self.plan_index = plan_index
+        self.cost = cost
+        # The bindings along a path are disjoint
+        self.bindings_hash = hash_bindings(self.new_bindings)
+        if self.parent is not None:
+            self.bindings_hash ^= self.parent.bindings_hash
+        self.bindings = None # Merged while the node is expanded
+    def merge_bindings(self):
+        bindings = {}
+        node = self
+        while (node is not None) and (node.bindings is None):
+            bindings.update(node.new_bindings)
+            node = node.parent
+        if node is not None:
+            bindings.update(node.bindings) # A node that is being expanded
+        return bindings
+    def get_bindings(self):
+        # The result is shared and must not be modified
+        if self.bindings is None:
+            self.bindings = self.merge_bindings()
+        return self.bindings
+    def release(self):
+        # Only expanded nodes store their merged bindings
+        self.bindings = None
+    def get_key(self):
+        # The same remaining stream plan under the same bindings
+        return self.plan_index, self.bindings_hash, hash_stream_plan(self.stream_plan)
+    def __repr__(self):
+        return '{}(plan={}, remaining={}, cost={})'.format(
+            self.__class__.__name__, self.plan_index, len(self.stream_plan), self.cost)
 
 SkeletonPlan = namedtuple('SkeletonPlan', ['stream_plan', 'action_plan', 'cost'])
 
 class SkeletonQueue(Sized):
-    # TODO: hash existing plan skeletons to prevent the same
-    def __init__(self, store, evaluations, goal_expression, domain):
+    def __init__(self, store, evaluations, goal_expression, domain, sampling_workers=1):
         self.store = store
         self.evaluations = evaluations
         self.goal_expression = goal_expression
         self.domain = domain
         self.queue = []
         self.skeleton_plans = []
+        self.added = set() # Keys of the skeletons previously added, which are never added again
+        # Threads rather than processes because stream generators cannot be pickled
+        # Only streams that release the GIL (e.g. compiled or subprocess calls) are sped up
+        assert 1 <= sampling_workers
+        self.sampling_workers = sampling_workers
+        self.pool = None
         # TODO: include eager streams in the queue?
         # TODO: make an "action" for returning to the search (if it is the best decision)
 
-    def add_skeleton(self, stream_plan, plan_attempts, bindings, plan_index, cost):
-        stream_plan = [result.remap_inputs(bindings) for result in stream_plan]
-        attempted = sum(plan_attempts) != 0 # Bias towards unused
-        effort = compute_effort(plan_attempts)
+    def push_skeleton(self, skeleton):
+        attempted = sum(skeleton.plan_attempts) != 0 # Bias towards unused
+        effort = compute_effort(skeleton.plan_attempts)
         key = SkeletonKey(attempted, effort)
-        skeleton = Skeleton(stream_plan, plan_attempts, bindings, plan_index, cost)
         heappush(self.queue, HeapElement(key, skeleton))
 
+    def add_skeleton(self, stream_plan, plan_attempts, new_bindings, plan_index, cost, parent=None):
+        # Returns the new skeleton or None if an identical skeleton was previously added
+        skeleton = Skeleton(stream_plan, plan_attempts, new_bindings, plan_index, cost, parent=parent)
+        if not self.mark_added(skeleton):
+            return None
+        self.push_skeleton(skeleton)
+        return skeleton
+
+    def mark_added(self, skeleton):
+        # Returns False if an identical skeleton was previously added
+        # Only the key is stored, so a skeleton is freed once it is expanded and its descendants are
+        key = skeleton.get_key()
+        if key in self.added:
+            return False
+        self.added.add(key)
+        return True
+
     def new_skeleton(self, stream_plan, action_plan, cost):
         # TODO: iteratively recompute full plan skeletons
         plan_index = len(self.skeleton_plans)
@@ -192,30 +299,95 @@ class SkeletonQueue(Sized):
     def is_active(self):
         return self.queue and (not self.store.is_terminated())
 
+    def pop_skeletons(self, only_unattempted=False):
+        skeletons = []
+        while self.is_active() and (len(skeletons) < self.sampling_workers):
+            key, _ = self.queue[0]
+            if only_unattempted and key.attempted:
+                break
+            _, skeleton = heappop(self.queue)
+            skeletons.append(skeleton)
+        return skeletons
+
+    def merge_results(self, instance, output):
+        new_results, new_facts = output
+        instance.disable(self.evaluations, self.domain)
+        if new_results and isinstance(instance, StreamInstance):
+            self.evaluations.pop(evaluation_from_fact(instance.get_blocked_fact()), None)
+        add_facts(self.evaluations, new_facts, result=None)
+        return bool(new_results)
+
+    def sample_instances(self, instances, accelerate=1):
+        # Samples the instances concurrently and merges the results of each on this thread as soon as it finishes
+        verbose = self.store.verbose
+        for instance in instances:
+            assert not any(evaluation_from_fact(f) not in self.evaluations for f in instance.get_domain())
+        def sample(instance):
+            return instance, instance.next_results(accelerate=accelerate, verbose=verbose)
+        # Asynchronous streams are already in flight on the event loop, so only synchronous ones use threads
+        local_instances = []
+        sync_instances = []
+        for instance in instances:
+            if instance.prefetch():
+                local_instances.append(instance)
+            else:
+                sync_instances.append(instance)
+        outputs = []
+        if 1 < len(sync_instances):
+            if self.pool is None:
+                self.pool = ThreadPool(self.sampling_workers)
+            outputs = self.pool.imap_unordered(sample, sync_instances)
+        else:
+            local_instances.extend(sync_instances)
+        new_values = False
+        for instance in local_instances: # While the threads are sampling
+            new_values |= self.merge_results(*sample(instance))
+        for output in outputs:
+            new_values |= self.merge_results(*output)
+        return new_values
+
+    def process_skeletons(self, skeletons, accelerate=1):
+        new_values = False
+        if 1 < len(skeletons):
+            instances = []
+            for skeleton in skeletons:
+                instance = get_sample_instance(skeleton, self)
+                if (instance is not None) and (not instance.enumerated) and (instance not in instances):
+                    instances.append(instance)
+            # process_skeleton then consumes the new results from the instance history
+            new_values |= self.sample_instances(instances, accelerate=accelerate)
+        for skeleton in skeletons:
+            new_values |= process_skeleton(skeleton, self, accelerate=accelerate)
+            skeleton.release()
+        return new_values
+
     def greedily_process(self):
         # TODO: search until new disabled or new evaluation?
         while self.is_active():
-            key, _ = self.queue[0]
-            if key.attempted:
+            skeletons = self.pop_skeletons(only_unattempted=True)
+            if not skeletons:
                 break
-            _, skeleton = heappop(self.queue)
-            process_skeleton(skeleton, self)
+            self.process_skeletons(skeletons)
 
     def process_until_success(self):
         success = False
         while self.is_active() and (not success):
-            _, skeleton = heappop(self.queue)
-            success |= process_skeleton(skeleton, self)
+            success |= self.process_skeletons(self.pop_skeletons())
             # TODO: break if successful?
             self.greedily_process()
 
     def timed_process(self, max_time):
         start_time = time.time()
         while self.is_active() and (elapsed_time(start_time) <= max_time):
-            _, skeleton = heappop(self.queue)
-            process_skeleton(skeleton, self)
+            self.process_skeletons(self.pop_skeletons())
             self.greedily_process()
 
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
     def __len__(self):
         return len(self.queue)
 
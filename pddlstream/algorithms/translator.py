@@ -0,0 +1,180 @@
+from __future__ import print_function
+
+from collections import OrderedDict
+from copy import copy, deepcopy
+
+from pddlstream.algorithms.downward import create_task, create_instantiated_task
+from pddlstream.profiling import profiled
+
+# Caches the normalized domain and its Datalog program across planning calls
+# The relaxed-reachability model is extended in place while the facts only grow (e.g. solve_incremental)
+# Optimistic facts are withdrawn between focused iterations, so the model is only extended with the real (base) facts
+# and each call extends a copy of it with the optimistic facts
+
+MAX_TRANSLATORS = 4 # Distinct (actions, axioms, goal) combinations
+STATIC_RULE_ATTRIBUTES = {'effect', 'conditions'} # The remaining attributes of a rule index its matched atoms
+
+class DatalogModel(object):
+    # Datalog is monotone, so adding facts never invalidates previously derived atoms
+    def __init__(self, program):
+        import build_model
+        self.rules = build_model.convert_rules(program)
+        self.unifier = build_model.Unifier(self.rules)
+        self.queue = build_model.Queue([])
+        self.facts = set()
+        self.rule_copies = None # Maps the rules returned by the unifier to this model's copies
+    @property
+    def atoms(self):
+        return self.queue.queue
+    def copy(self):
+        # The unifier, the rules' conditions and effects, and the atoms are shared
+        # Only the mutable state (the queue and the atoms indexed by each rule) is copied
+        model = self.__class__.__new__(self.__class__)
+        memo = {id(atom): atom for atom in self.atoms}
+        model.rule_copies = {}
+        model.rules = []
+        for unified_rule in self.get_unified_rules():
+            rule = self.get_rule(unified_rule)
+            new_rule = copy(rule)
+            for attribute, value in vars(rule).items():
+                if attribute not in STATIC_RULE_ATTRIBUTES:
+                    setattr(new_rule, attribute, deepcopy(value, memo))
+            model.rule_copies[unified_rule] = new_rule
+            model.rules.append(new_rule)
+        model.unifier = self.unifier
+        model.queue = deepcopy(self.queue, memo)
+        model.facts = set(self.facts)
+        return model
+    def get_unified_rules(self):
+        # The rules that the (shared) unifier returns
+        if self.rule_copies is None:
+            return self.rules
+        return list(self.rule_copies)
+    def get_rule(self, rule):
+        if self.rule_copies is None:
+            return rule
+        return self.rule_copies[rule]
+    def extend(self, facts):
+        new_facts = sorted(set(facts) - self.facts)
+        for atom in new_facts:
+            self.facts.add(atom)
+            self.queue.push(atom.predicate, atom.args)
+        while self.queue:
+            atom = self.queue.pop()
+            for rule, cond_index in self.unifier.unify(atom):
+                rule = self.get_rule(rule)
+                rule.update_index(atom, cond_index)
+                rule.fire(atom, cond_index, self.queue.push)
+        return new_facts
+    def __repr__(self):
+        return '{}({}, {})'.format(self.__class__.__name__, len(self.facts), len(self.atoms))
+
+
+class IncrementalTranslator(object):
+    def __init__(self, domain, problem):
+        import normalize
+        import pddl_to_prolog
+        task = create_task(domain, problem._replace(init=list(problem.init)))
+        # Normalization can add axioms and predicates, which shouldn't leak into the domain
+        task.actions, task.axioms, task.predicates = list(task.actions), list(task.axioms), list(task.predicates)
+        normalize.normalize(task)
+        self.actions, self.axioms, self.predicates, self.goal = \
+            task.actions, task.axioms, task.predicates, task.goal
+
+        # Same as pddl_to_prolog.translate without the facts
+        self.program = pddl_to_prolog.PrologProgram()
+        for conditions, effect in normalize.build_exploration_rules(task):
+            self.program.add_rule(pddl_to_prolog.Rule(conditions, effect))
+        self.program.normalize()
+        self.program.split_rules()
+        self.rule_facts = [fact.atom for fact in self.program.facts] # From rules without conditions
+        self.object_facts = any(condition.predicate == '@object'
+                                for rule in self.program.rules for condition in rule.conditions)
+        self.model = None
+        self.num_rebuilds = 0
+        self.num_calls = 0
+    def get_task(self, domain, problem):
+        task = create_task(domain, problem)
+        task.actions, task.axioms, task.predicates, task.goal = \
+            self.actions, self.axioms, self.predicates, self.goal
+        return task
+    def get_facts(self, task):
+        import pddl
+        import pddl_to_prolog
+        program = pddl_to_prolog.PrologProgram()
+        pddl_to_prolog.translate_facts(program, task)
+        facts = [fact.atom for fact in program.facts] + self.rule_facts
+        if self.object_facts:
+            facts.extend(pddl.Atom('@object', [obj]) for obj in program.objects)
+        return facts
+    def partition_facts(self, facts, base_init):
+        # Base facts are the initial atoms that hold in later calls (e.g. the real evaluations)
+        base_init = set(base_init)
+        base_objects = {arg for atom in base_init for arg in atom.args}
+        rule_facts = set(self.rule_facts)
+        base_facts = []
+        opt_facts = []
+        for fact in facts:
+            if (fact in base_init) or (fact in rule_facts) or \
+                    ((fact.predicate == '@object') and (fact.args[0] in base_objects)):
+                base_facts.append(fact)
+            else:
+                opt_facts.append(fact)
+        return base_facts, opt_facts
+    @profiled('instantiate')
+    def instantiate(self, domain, problem, base_init=None):
+        import instantiate
+        self.num_calls += 1
+        task = self.get_task(domain, problem)
+        facts = self.get_facts(task)
+        if base_init is None:
+            base_facts, opt_facts = facts, []
+        else:
+            base_facts, opt_facts = self.partition_facts(facts, base_init)
+        if (self.model is None) or not (self.model.facts <= set(base_facts)):
+            self.model = DatalogModel(self.program)
+            self.num_rebuilds += 1
+        self.model.extend(base_facts)
+        model = self.model
+        if opt_facts:
+            model = self.model.copy()
+            model.extend(opt_facts)
+        return create_instantiated_task(task, *instantiate.instantiate(task, model.atoms))
+    def __repr__(self):
+        return '{}(calls={}, rebuilds={}, model={})'.format(
+            self.__class__.__name__, self.num_calls, self.num_rebuilds, self.model)
+
+##################################################
+
+translators = OrderedDict()
+
+def get_effect_key(effect):
+    return tuple(effect.parameters), effect.condition, effect.literal
+
+def get_action_key(action):
+    # Conditions, literals, and typed objects are hashed and compared by their contents
+    cost = None if action.cost is None else str(action.cost)
+    return action.name, tuple(action.parameters), action.num_external_parameters, action.precondition, \
+           tuple(map(get_effect_key, action.effects)), cost
+
+def get_axiom_key(axiom):
+    return axiom.name, tuple(axiom.parameters), axiom.num_external_parameters, axiom.condition
+
+def get_translator(domain, problem):
+    # Keyed on the contents of the actions and axioms, which are often copied (e.g. by load_domain)
+    key = (tuple(map(get_action_key, domain.actions)), tuple(map(get_axiom_key, domain.axioms)), problem.goal)
+    if key in translators:
+        translators[key] = translators.pop(key) # Most recently used
+    else:
+        translators[key] = IncrementalTranslator(domain, problem)
+        while MAX_TRANSLATORS < len(translators):
+            translators.popitem(last=False)
+    return translators[key]
+
+def instantiate_domain_problem(domain, problem, base_init=None):
+    # Equivalent to instantiate_task(task_from_domain_problem(domain, problem))
+    # base_init is the subset of problem.init that holds in subsequent calls, which are otherwise assumed monotone
+    return get_translator(domain, problem).instantiate(domain, problem, base_init=base_init)
+
+def reset_translators():
+    translators.clear()
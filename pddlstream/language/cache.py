@@ -0,0 +1,118 @@
+from __future__ import print_function
+
+import hashlib
+import os
+import pickle
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from pddlstream.utils import INF, read_pickle, write_pickle, ensure_dir, safe_remove
+
+# Memoizes the outputs of stream and function calls across instances, solves, and (optionally) runs
+# Only deterministic procedures (e.g. from_test and from_fn) should be cached
+# Samplers are replayed from the cache but never resumed, as a fresh generator would have to regenerate the replayed
+# outputs to skip them. An instance that exhausts a partial entry without a generator of its own is enumerated
+# TODO: store the cache in a database that supports concurrent writers
+
+PROTOCOL = 2 # Readable in both python2 and python3
+
+def serialize(value):
+    return pickle.dumps(value, protocol=PROTOCOL)
+
+
+def get_cache_key(name, input_values, fluent_values=[]):
+    # Hashes the serialized input values, so equal values need not be hashable or identical
+    # Returns None if the input values cannot be serialized
+    try:
+        data = serialize((name, tuple(input_values), sorted(map(serialize, fluent_values))))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+    return hashlib.sha1(data).hexdigest()
+
+##################################################
+
+class ResultCache(object):
+    """
+    A least-recently-used cache of outputs keyed on the external name and its hashed input values
+    Pass as StreamInfo(cache=...) or FunctionInfo(cache=...). One cache can be shared by several externals
+    A sampler that is replayed from its entry (e.g. in a later run) produces only the outputs in the entry,
+    so samplers should only be cached if they are enumerated within a single solve
+    :param max_size: the maximum number of entries
+    :param max_age: the maximum time (in seconds) that an entry is valid
+    :param filename: a pickle file that is loaded upon creation and written by save
+    """
+    def __init__(self, max_size=INF, max_age=INF, filename=None):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.filename = filename
+        self.entries = OrderedDict() # key -> (creation time, outputs)
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock() # Externals can be called by concurrent sampling threads
+        self.load()
+    def _expired(self, creation_time):
+        return self.max_age < (time.time() - creation_time)
+    def _evict(self):
+        if self.max_age < INF:
+            for key in [key for key, (creation_time, _) in self.entries.items() if self._expired(creation_time)]:
+                del self.entries[key]
+        while self.max_size < len(self.entries):
+            self.entries.popitem(last=False) # Least recently used
+    def __contains__(self, key):
+        with self.lock:
+            return (key in self.entries) and not self._expired(self.entries[key][0])
+    def __len__(self):
+        return len(self.entries)
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            creation_time, outputs = self.entries.pop(key)
+            if self._expired(creation_time):
+                self.misses += 1
+                return default
+            self.entries[key] = (creation_time, outputs) # Most recently used
+            self.hits += 1
+            return outputs
+    def set(self, key, outputs):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time(), outputs)
+            self._evict()
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    def _read(self):
+        if (self.filename is None) or not os.path.exists(self.filename):
+            return OrderedDict()
+        return read_pickle(self.filename)
+    def load(self):
+        with self.lock:
+            for key, entry in self._read().items():
+                if key not in self.entries:
+                    self.entries[key] = entry
+            self._evict()
+    def save(self):
+        # Merges with the entries written by other runs since this cache was loaded
+        if self.filename is None:
+            return
+        self.load()
+        with self.lock:
+            if os.path.dirname(self.filename):
+                ensure_dir(self.filename)
+            temp_path = '{}.{}'.format(self.filename, os.getpid())
+            try:
+                write_pickle(temp_path, self.entries)
+                os.rename(temp_path, self.filename) # Atomic so that concurrent runs never read a partial file
+            except (IOError, OSError):
+                safe_remove(temp_path)
+                raise
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.save()
+    def __repr__(self):
+        return '{}(entries={}, hits={}, misses={})'.format(
+            self.__class__.__name__, len(self), self.hits, self.misses)
@@ -24,6 +24,27 @@ Evaluation = namedtuple('Evaluation', ['head', 'value'])
 Atom = lambda head: Evaluation(head, True)
 NegatedAtom = lambda head: Evaluation(head, False)
 
+class PDDLSolution(tuple):
+    """
+    The (plan, cost, evaluations) tuple returned by the solvers
+    It also carries the profiling trace of the solve
+    """
+    def __new__(cls, plan, cost, evaluations, trace=None):
+        solution = super(PDDLSolution, cls).__new__(cls, (plan, cost, evaluations))
+        solution.trace = trace
+        return solution
+    def __getnewargs__(self):
+        return tuple(self)
+    @property
+    def plan(self):
+        return self[0]
+    @property
+    def cost(self):
+        return self[1]
+    @property
+    def evaluations(self):
+        return self[2]
+
 ##################################################
 
 def And(*expressions):
@@ -1,11 +1,18 @@
 from __future__ import print_function
 
-import collections
 from itertools import product
+from threading import Lock
+
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
 
 from pddlstream.language.constants import EQ, AND, OR, NOT, CONNECTIVES, QUANTIFIERS, OPERATORS, Head, Evaluation, \
-    get_prefix, get_args, is_parameter
-from pddlstream.language.object import Object, OptimisticObject
+    get_prefix, get_args, is_parameter, PDDLSolution
+from pddlstream.language.evaluations import EvaluationStore
+from pddlstream.language.object import Object, OptimisticObject, REGISTRY_ATTRIBUTES, RELEASED_TABLES
+from pddlstream.profiling import get_trace
 from pddlstream.utils import str_from_object
 
 def replace_expression(parent, fn):
@@ -13,7 +20,7 @@ def replace_expression(parent, fn):
     if prefix == EQ:
         assert(len(parent) == 3)
         value = parent[2]
-        if isinstance(parent[2], collections.Sequence):
+        if isinstance(parent[2], Sequence):
             value = replace_expression(value, fn)
         return prefix, replace_expression(parent[1], fn), value
     elif prefix in CONNECTIVES:
@@ -101,6 +108,8 @@ def is_negated_atom(evaluation):
 
 def objects_from_evaluations(evaluations):
     # TODO: assumes object predicates
+    if isinstance(evaluations, EvaluationStore):
+        return evaluations.get_objects()
     objects = set()
     for evaluation in evaluations:
         objects.update(evaluation.head.args)
@@ -111,7 +120,7 @@ def objects_from_evaluations(evaluations):
 def head_from_fact(fact):
     return Head(get_prefix(fact), get_args(fact))
 
-def evaluation_from_fact(fact):
+def create_evaluation(fact):
     prefix = get_prefix(fact)
     if prefix == EQ:
         head, value = fact[1:]
@@ -123,7 +132,7 @@ def evaluation_from_fact(fact):
         value = True
     return Evaluation(head_from_fact(head), value)
 
-def fact_from_evaluation(evaluation):
+def create_fact(evaluation):
     head = (evaluation.head.function,) + evaluation.head.args
     if is_atom(evaluation):
         return head
@@ -131,6 +140,94 @@ def fact_from_evaluation(evaluation):
         return (NOT, head)
     return (EQ, head, evaluation.value)
 
+##################################################
+
+# Ground facts are converted between their representations in nearly every loop
+# Each is interned once per solve and its other representations are memoized
+
+INTERN_FACTS = True
+
+class FactRecord(object):
+    __slots__ = ['id', 'evaluation', 'fact', 'fd']
+    def __init__(self, id, evaluation):
+        self.id = id # Index within the FactTable
+        self.evaluation = evaluation
+        self.fact = None
+        self.fd = None
+    def __repr__(self):
+        return '{}({}, {})'.format(self.__class__.__name__, self.id, self.evaluation)
+
+
+def same_value(value1, value2):
+    # 1 == True, but (= (f) 1) and (f) are different facts
+    return (value1 is value2) or (value1.__class__ is value2.__class__)
+
+
+class FactTable(object):
+    _records = []
+    _record_from_evaluation = {}
+    _record_from_fact = {}
+    _record_from_fd = {}
+    _lock = Lock() # Interned by both the sampling and a pipelined search
+    @staticmethod
+    def from_evaluation(evaluation):
+        record = FactTable._record_from_evaluation.get(evaluation)
+        if record is None:
+            with FactTable._lock:
+                record = FactTable._record_from_evaluation.get(evaluation)
+                if record is None:
+                    record = FactRecord(len(FactTable._records), evaluation)
+                    FactTable._records.append(record)
+                    FactTable._record_from_evaluation[evaluation] = record
+        elif not same_value(record.evaluation.value, evaluation.value):
+            return FactRecord(None, evaluation) # Not interned
+        return record
+    @staticmethod
+    def from_fact(fact):
+        try:
+            record = FactTable._record_from_fact.get(fact)
+        except TypeError: # Unhashable
+            return FactRecord(None, create_evaluation(fact))
+        if record is None:
+            record = FactTable.from_evaluation(create_evaluation(fact))
+            if record.id is not None:
+                FactTable._record_from_fact[fact] = record
+        elif (get_prefix(fact) == EQ) and not same_value(record.evaluation.value, fact[2]):
+            return FactRecord(None, create_evaluation(fact))
+        return record
+    @staticmethod
+    def reset():
+        with FactTable._lock:
+            FactTable._records = []
+            FactTable._record_from_evaluation = {}
+            FactTable._record_from_fact = {}
+            FactTable._record_from_fd = {}
+    @staticmethod
+    def from_id(id):
+        return FactTable._records[id]
+    @staticmethod
+    def size():
+        return len(FactTable._records)
+
+# The table refers to objects by name, so it is reset and scoped along with them
+# Its strong references would otherwise keep the objects of finished solves from being evicted
+REGISTRY_ATTRIBUTES[FactTable] = ['_records', '_record_from_evaluation', '_record_from_fact', '_record_from_fd']
+RELEASED_TABLES.append(FactTable)
+
+
+def evaluation_from_fact(fact):
+    if not INTERN_FACTS:
+        return create_evaluation(fact)
+    return FactTable.from_fact(fact).evaluation
+
+def fact_from_evaluation(evaluation):
+    if not INTERN_FACTS:
+        return create_fact(evaluation)
+    record = FactTable.from_evaluation(evaluation)
+    if record.fact is None:
+        record.fact = create_fact(evaluation)
+    return record.fact
+
 # def state_from_evaluations(evaluations):
 #     # TODO: default value?
 #     # TODO: could also implement within predicates
@@ -184,7 +281,7 @@ def value_from_obj_plan(obj_plan):
             name, inputs, outputs = operator
             new_inputs = params_from_objects(inputs) # values_from_objects
             new_outputs = outputs
-            if isinstance(new_outputs, collections.Sequence):
+            if isinstance(new_outputs, Sequence):
                 new_outputs = params_from_objects(new_outputs) # values_from_objects
             new_operator = (name, new_inputs, new_outputs)
         else:
@@ -199,7 +296,7 @@ def value_from_obj_plan(obj_plan):
 
 def revert_solution(plan, cost, evaluations):
     init = list(map(value_from_obj_expression, map(fact_from_evaluation, evaluations)))
-    return value_from_obj_plan(plan), cost, init
+    return PDDLSolution(value_from_obj_plan(plan), cost, init, trace=get_trace())
 
 
 #def opt_obj_from_value(value):
@@ -0,0 +1,145 @@
+from collections import OrderedDict, defaultdict
+from heapq import merge
+from itertools import count
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+# Maps each Evaluation to the result that certified it (None for the initial state) in insertion order
+# Indexed on the predicate, head, and objects so that queries are independent of the total number of evaluations
+# An overlay is a copy-on-write child whose (optimistic) evaluations are never written to its parent
+# The parent shouldn't be modified while an overlay is in use
+
+evaluation_order = count() # Shared so evaluations are ordered across a store and its overlays
+
+
+class HeadIndex(object):
+    # Drop-in for the results_from_head dictionary
+    def __init__(self, store):
+        self.store = store
+    def __getitem__(self, head):
+        return self.store.get_results(head)
+
+
+class EvaluationStore(MutableMapping):
+    def __init__(self, evaluations=[], parent=None, inherit_results=True):
+        """
+        :param evaluations: an iterable of (evaluation, result) pairs or a dictionary
+        :param parent: the EvaluationStore that this overlays
+        :param inherit_results: if False, the parent's evaluations are reported as having result None
+        """
+        self.parent = parent
+        self.inherit_results = inherit_results
+        self.result_from_evaluation = OrderedDict() # Evaluations that are not in the parent
+        self.override_from_evaluation = {} # Results replacing those of the parent
+        self.order_from_evaluation = {}
+        self.evaluations_from_predicate = defaultdict(OrderedDict)
+        self.evaluations_from_head = defaultdict(OrderedDict)
+        self.count_from_object = defaultdict(int)
+        if isinstance(evaluations, MutableMapping):
+            evaluations = evaluations.items()
+        for evaluation, result in evaluations:
+            self[evaluation] = result
+
+    def overlay(self, inherit_results=True):
+        return self.__class__(parent=self, inherit_results=inherit_results)
+
+    def copy(self):
+        return self.__class__(self.items())
+
+    def _in_parent(self, evaluation):
+        return (self.parent is not None) and (evaluation in self.parent)
+
+    def __contains__(self, evaluation):
+        return (evaluation in self.result_from_evaluation) or self._in_parent(evaluation)
+
+    def __getitem__(self, evaluation):
+        if evaluation in self.result_from_evaluation:
+            return self.result_from_evaluation[evaluation]
+        if evaluation in self.override_from_evaluation:
+            return self.override_from_evaluation[evaluation]
+        if self._in_parent(evaluation):
+            return self.parent[evaluation] if self.inherit_results else None
+        raise KeyError(evaluation)
+
+    def __setitem__(self, evaluation, result):
+        if evaluation in self.result_from_evaluation:
+            self.result_from_evaluation[evaluation] = result
+            return
+        if self._in_parent(evaluation):
+            self.override_from_evaluation[evaluation] = result
+            return
+        self.result_from_evaluation[evaluation] = result
+        self.order_from_evaluation[evaluation] = next(evaluation_order)
+        self.evaluations_from_predicate[evaluation.head.function][evaluation] = None
+        self.evaluations_from_head[evaluation.head][evaluation] = None
+        for obj in evaluation.head.args:
+            self.count_from_object[obj] += 1
+
+    def __delitem__(self, evaluation):
+        if self._in_parent(evaluation):
+            raise NotImplementedError('Cannot remove {} from an overlay'.format(evaluation))
+        del self.result_from_evaluation[evaluation]
+        del self.order_from_evaluation[evaluation]
+        head = evaluation.head
+        for index, key in [(self.evaluations_from_predicate, head.function), (self.evaluations_from_head, head)]:
+            del index[key][evaluation]
+            if not index[key]:
+                del index[key]
+        for obj in head.args:
+            self.count_from_object[obj] -= 1
+            if not self.count_from_object[obj]:
+                del self.count_from_object[obj]
+
+    def __iter__(self):
+        if self.parent is not None:
+            for evaluation in self.parent:
+                yield evaluation
+        for evaluation in self.result_from_evaluation:
+            yield evaluation
+
+    def __len__(self):
+        return len(self.result_from_evaluation) + (0 if self.parent is None else len(self.parent))
+
+    ##################################################
+
+    def _iterate_ordered(self, index_name, key):
+        # (order, evaluation) pairs in insertion order
+        local = ((self.order_from_evaluation[e], e) for e in getattr(self, index_name).get(key, {}))
+        if self.parent is None:
+            return local
+        return merge(self.parent._iterate_ordered(index_name, key), local)
+
+    def get_evaluations(self, *predicates):
+        # Evaluations of any of the predicates in insertion order
+        ordered = [self._iterate_ordered('evaluations_from_predicate', p) for p in set(predicates)]
+        return [evaluation for _, evaluation in merge(*ordered)]
+
+    def get_head_evaluations(self, head):
+        return [evaluation for _, evaluation in self._iterate_ordered('evaluations_from_head', head)]
+
+    def get_results(self, head):
+        return [(evaluation.value, self[evaluation]) for evaluation in self.get_head_evaluations(head)]
+
+    def get_results_from_head(self):
+        return HeadIndex(self)
+
+    def get_objects(self):
+        objects = set() if self.parent is None else self.parent.get_objects()
+        objects.update(self.count_from_object)
+        return objects
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, len(self))
+
+##################################################
+
+def overlay_evaluations(evaluations, inherit_results=True):
+    # Also accepts a dictionary or set of evaluations
+    if isinstance(evaluations, EvaluationStore):
+        return evaluations.overlay(inherit_results=inherit_results)
+    if isinstance(evaluations, MutableMapping) and inherit_results:
+        return EvaluationStore(evaluations)
+    return EvaluationStore((evaluation, None) for evaluation in evaluations)
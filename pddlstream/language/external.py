@@ -1,20 +1,29 @@
-from collections import Counter
+from collections import Counter, namedtuple
+from threading import Lock, local
 
+from pddlstream.language.cache import get_cache_key
 from pddlstream.language.conversion import substitute_expression, values_from_objects
 from pddlstream.language.constants import get_args, is_parameter
 from pddlstream.language.object import Object
 from pddlstream.language.statistics import geometric_cost, Performance
+from pddlstream.profiling import add_span, EXTERNAL
 from pddlstream.utils import elapsed_time, get_mapping, INF
 
 DEBUG = 'debug'
 
+frozen_states = local() # The instance states seen by a thread within FrozenInstances
+
+# The state of an instance that is updated by sampling while read (and refined) by a pipelined search
+InstanceState = namedtuple('InstanceState', ['enumerated', 'disabled', 'opt_index'])
+
 class ExternalInfo(object):
-    def __init__(self, eager, p_success, overhead, effort_fn):
+    def __init__(self, eager, p_success, overhead, effort_fn, cache=None):
         # TODO: enable eager=True for inexpensive test streams by default
         self.eager = eager
         self.p_success = p_success
         self.overhead = overhead
         self.effort_fn = effort_fn
+        self.cache = cache # A ResultCache that memoizes the outputs of deterministic externals
         # TODO: allow specification of p_success & overhead as effort
 
 ##################################################
@@ -34,6 +43,10 @@ class Result(object):
     def get_certified(self):
         raise NotImplementedError()
 
+    def remap_instance(self, bindings):
+        # The instance after substituting bindings without constructing a new result
+        raise NotImplementedError()
+
     def remap_inputs(self, bindings):
         raise NotImplementedError()
 
@@ -44,12 +57,11 @@ class Result(object):
 
 class Instance(object):
     _Result = None
+    _state_lock = Lock()
     def __init__(self, external, input_objects):
         self.external = external
         self.input_objects = tuple(input_objects)
-        self.enumerated = False
-        self.disabled = False
-        self.opt_index = 0
+        self._state = InstanceState(enumerated=False, disabled=False, opt_index=0)
         self.results_history = []
         self.mapping = get_mapping(self.external.inputs, self.input_objects)
         for constant in self.external.constants:
@@ -57,9 +69,51 @@ class Instance(object):
         self.domain = substitute_expression(self.external.domain, self.get_mapping())
         self.successes = 0
         self.opt_results = []
+        self._cache_key = None
+
+    def _get_state(self):
+        states = getattr(frozen_states, 'states', None)
+        if states is None:
+            return self._state
+        if self not in states:
+            states[self] = self._state
+        return states[self]
+
+    def _set_state(self, **kwargs):
+        # Writes through to the shared state as well as this thread's snapshot
+        with Instance._state_lock:
+            self._state = self._state._replace(**kwargs)
+        states = getattr(frozen_states, 'states', None)
+        if states is not None:
+            states[self] = states.get(self, self._state)._replace(**kwargs)
+
+    @property
+    def enumerated(self):
+        return self._get_state().enumerated
+
+    @enumerated.setter
+    def enumerated(self, enumerated):
+        self._set_state(enumerated=enumerated)
+
+    @property
+    def disabled(self):
+        return self._get_state().disabled
+
+    @disabled.setter
+    def disabled(self, disabled):
+        self._set_state(disabled=disabled)
+
+    @property
+    def opt_index(self):
+        return self._get_state().opt_index
+
+    @opt_index.setter
+    def opt_index(self, opt_index):
+        self._set_state(opt_index=opt_index)
 
     def update_statistics(self, start_time, results):
         overhead = elapsed_time(start_time)
+        add_span(self.external.name, start_time, category=EXTERNAL, inputs=self.get_input_values())
         successes = len([r.is_successful() for r in results])
         self.external.update_statistics(overhead, bool(successes))
         self.results_history.append(results)
@@ -120,6 +174,14 @@ class Instance(object):
     def get_input_values(self):
         return values_from_objects(self.input_objects)
 
+    def get_cache_key(self):
+        # None if the external isn't cached or the input values cannot be serialized
+        if self.external.info.cache is None:
+            return None
+        if self._cache_key is None:
+            self._cache_key = get_cache_key(self.external.name, self.get_input_values())
+        return self._cache_key
+
     def get_mapping(self):
         return self.mapping
 
@@ -135,16 +197,34 @@ class Instance(object):
     def next_results(self, accelerate=1, verbose=False):
         raise NotImplementedError()
 
+    def prefetch(self):
+        # Starts the next call without blocking if the procedure is asynchronous
+        # Returns whether a call is in flight
+        return False
+
     def disable(self, evaluations, domain):
         self.disabled = True
 
     def enable(self, evaluations, domain):
         self.disabled = False
 
+class FrozenInstances(object):
+    """
+    Fixes the state (enumerated, disabled, and opt_index) of each instance the first time that it's read within a block
+    Updates within the block are written through to the instance
+    Used by a pipelined search while the sampling thread concurrently updates the instances
+    """
+    def __enter__(self):
+        frozen_states.states = {}
+        return self
+    def __exit__(self, *args):
+        frozen_states.states = None
+
 ##################################################
 
 class External(Performance):
     _Instance = None
+    _instance_lock = Lock()
     def __init__(self, name, info, inputs, domain):
         super(External, self).__init__(name, info)
         self.inputs = tuple(inputs)
@@ -158,10 +238,16 @@ class External(Performance):
         self.constants = {a for i in self.domain for a in get_args(i) if not is_parameter(a)}
         self.instances = {}
 
+    def get_batch(self):
+        # The BatchFn that evaluates many instances at once or None
+        return None
+
     def get_instance(self, input_objects):
         input_objects = tuple(input_objects)
         if input_objects not in self.instances:
-            self.instances[input_objects] = self._Instance(self, input_objects)
+            with External._instance_lock: # Instantiated by both the sampling and a pipelined search
+                if input_objects not in self.instances:
+                    self.instances[input_objects] = self._Instance(self, input_objects)
         return self.instances[input_objects]
 
 ##################################################
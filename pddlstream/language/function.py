@@ -3,6 +3,7 @@ import time
 from pddlstream.language.conversion import substitute_expression, list_from_conjunction, str_from_head
 from pddlstream.language.constants import Not, Equal, get_prefix, get_args, is_head
 from pddlstream.language.external import ExternalInfo, Result, Instance, External, DEBUG, get_procedure_fn
+from pddlstream.language.generator import is_coroutine_fn, wait_for, EventLoopThread, get_batch
 from pddlstream.utils import str_from_object
 
 # https://stackoverflow.com/questions/847936/how-can-i-find-the-number-of-arguments-of-a-python-function
@@ -15,8 +16,8 @@ from pddlstream.utils import str_from_object
 #from inspect import signature
 
 class FunctionInfo(ExternalInfo):
-    def __init__(self, opt_fn=None, eager=False, p_success=None, overhead=None, effort_fn=None):
-        super(FunctionInfo, self).__init__(eager, p_success, overhead, effort_fn)
+    def __init__(self, opt_fn=None, eager=False, p_success=None, overhead=None, effort_fn=None, cache=None):
+        super(FunctionInfo, self).__init__(eager, p_success, overhead, effort_fn, cache=cache)
         self.opt_fn = opt_fn
         #self.order = 0
 
@@ -32,12 +33,15 @@ class FunctionResult(Result):
     def get_tuple(self):
         return self.external.name, self.instance.input_objects, self.value
 
-    def remap_inputs(self, bindings):
+    def remap_instance(self, bindings):
         # TODO: move this to the instance class?
         input_objects = [bindings.get(i, i) for i in self.instance.input_objects]
         new_instance = self.external.get_instance(input_objects)
         new_instance.opt_index = self.instance.opt_index
-        return self.__class__(new_instance, self.value, self.opt_index)
+        return new_instance
+
+    def remap_inputs(self, bindings):
+        return self.__class__(self.remap_instance(bindings), self.value, self.opt_index)
 
     def is_successful(self):
         return True
@@ -48,6 +52,15 @@ class FunctionResult(Result):
 
 class FunctionInstance(Instance):  # Head(Instance):
     #_opt_value = 0
+    def __init__(self, external, input_objects):
+        super(FunctionInstance, self).__init__(external, input_objects)
+        self._future = None
+
+    def __getstate__(self):
+        # An in-flight call is not pickled and is instead made again when needed
+        state = self.__dict__.copy()
+        state['_future'] = None
+        return state
 
     def get_head(self):
         return substitute_expression(self.external.head, self.get_mapping())
@@ -57,12 +70,23 @@ class FunctionInstance(Instance):  # Head(Instance):
         assert not self.enumerated
         self.enumerated = True
         input_values = self.get_input_values()
-        try:
-            value = self.external.fn(*input_values)
-        except TypeError as err:
-            print('Function [{}] expects {} inputs'.format(self.external.name, len(input_values)))
-            raise err
+        key = self.get_cache_key()
+        cached_value = None if key is None else self.external.info.cache.get(key)
+        if cached_value is not None:
+            value = cached_value
+        elif self._future is not None:
+            value = self._future.result()
+            self._future = None
+        else:
+            try:
+                value = self.external.fn(*input_values)
+            except TypeError as err:
+                print('Function [{}] expects {} inputs'.format(self.external.name, len(input_values)))
+                raise err
+            value = wait_for(value)
         self.value = self.external._codomain(value)
+        if (key is not None) and (cached_value is None):
+            self.external.info.cache.set(key, self.value)
         # TODO: cast the inputs and test whether still equal?
         #if not (type(self.value) is self.external._codomain):
         #if not isinstance(self.value, self.external._codomain):
@@ -83,6 +107,20 @@ class FunctionInstance(Instance):  # Head(Instance):
         new_facts = []
         return results, new_facts
 
+    def prefetch(self):
+        batch = self.external.get_batch()
+        if self.enumerated or ((batch is None) and not is_coroutine_fn(self.external.fn)):
+            return False
+        key = self.get_cache_key()
+        if (key is not None) and (key in self.external.info.cache):
+            return False
+        if self._future is None:
+            if batch is not None:
+                self._future = batch.submit(self.get_input_values())
+            else:
+                self._future = EventLoopThread.get().submit(self.external.fn(*self.get_input_values()))
+        return True
+
     def next_optimistic(self):
         if self.enumerated or self.disabled:
             return []
@@ -120,6 +158,8 @@ class Function(External):
         #    raise TypeError('Function [{}] expects inputs {} but its procedure has inputs {}'.format(
         #        self.name, list(self.inputs), arg_spec.args))
         self.opt_fn = opt_fn if (self.info.opt_fn is None) else self.info.opt_fn
+    def get_batch(self):
+        return get_batch(self.fn)
     def __repr__(self):
         return '{}=?{}'.format(str_from_head(self.head), self._codomain.__name__)
 
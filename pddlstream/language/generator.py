@@ -1,9 +1,21 @@
+import inspect
+import threading
 import time
-from collections import Iterator, namedtuple, deque
+from collections import namedtuple, deque
+try:
+    from collections.abc import Iterator
+except ImportError:
+    from collections import Iterator
 from itertools import count
 
 from pddlstream.utils import INF, elapsed_time
 
+try:
+    import asyncio
+    from concurrent.futures import Future
+except ImportError:
+    asyncio = None # Python 2
+
 # TODO: indicate wild stream output just from the output form
 
 class BoundedGenerator(Iterator):
@@ -27,6 +39,17 @@ class BoundedGenerator(Iterator):
         self.history.append(next(self.generator))
         return self.history[-1]
     __next__ = next
+    def prefetch(self):
+        if self.enumerated:
+            return False
+        return prefetch_next(self.generator)
+
+
+def prefetch_next(generator):
+    # Starts computing the next element without blocking if the generator is asynchronous
+    if hasattr(generator, 'prefetch'):
+        return generator.prefetch()
+    return False
 
 
 def get_next(generator, default=[]):
@@ -46,10 +69,14 @@ def get_next(generator, default=[]):
 
 def from_list_gen_fn(list_gen_fn):
     # Purposefully redundant for now
+    if is_async_gen_fn(list_gen_fn):
+        return from_async_list_gen_fn(list_gen_fn)
     return list_gen_fn
 
 
 def from_gen_fn(gen_fn):
+    if is_async_gen_fn(gen_fn):
+        return from_async_gen_fn(gen_fn)
     return from_list_gen_fn(lambda *args, **kwargs: ([] if ov is None else [ov]
                                                      for ov in gen_fn(*args, **kwargs)))
 
@@ -67,13 +94,20 @@ def from_sampler(sampler, max_attempts=INF):
 
 def from_list_fn(list_fn):
     #return lambda *args, **kwargs: iter([list_fn(*args, **kwargs)])
+    if is_coroutine_fn(list_fn):
+        return from_async_list_fn(list_fn)
     return lambda *args, **kwargs: BoundedGenerator(iter([list_fn(*args, **kwargs)]), max_calls=1)
 
 
+def list_from_outputs(outputs):
+    return [] if outputs is None else [outputs]
+
+
 def from_fn(fn):
+    if is_coroutine_fn(fn):
+        return from_async_list_fn(fn, transform=list_from_outputs)
     def list_fn(*args, **kwargs):
-        outputs = fn(*args, **kwargs)
-        return [] if outputs is None else [outputs]
+        return list_from_outputs(fn(*args, **kwargs))
     return from_list_fn(list_fn)
 
 def outputs_from_boolean(boolean):
@@ -81,6 +115,8 @@ def outputs_from_boolean(boolean):
 
 
 def from_test(test):
+    if is_coroutine_fn(test):
+        return from_async_list_fn(test, transform=lambda b: list_from_outputs(outputs_from_boolean(b)))
     return from_fn(lambda *args, **kwargs: outputs_from_boolean(test(*args, **kwargs)))
 
 
@@ -100,6 +136,265 @@ def fn_from_constant(constant):
 
 ##################################################
 
+# Asynchronous procedures (async def functions and generators) are run on a background event loop
+# Many calls can be in flight at once by prefetching the next element of several generators
+
+def is_coroutine_fn(fn):
+    return (asyncio is not None) and inspect.iscoroutinefunction(fn)
+
+
+def is_async_gen_fn(fn):
+    return (asyncio is not None) and hasattr(inspect, 'isasyncgenfunction') and inspect.isasyncgenfunction(fn)
+
+
+def is_awaitable(value):
+    return (asyncio is not None) and inspect.isawaitable(value)
+
+
+class EventLoopThread(object):
+    _instance = None
+    _lock = threading.Lock()
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name='pddlstream_event_loop')
+        self.thread.daemon = True
+        self.thread.start()
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+    @classmethod
+    def get(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+    def submit(self, awaitable):
+        # Returns a thread-safe concurrent.futures.Future
+        future = Future()
+        def schedule():
+            try:
+                task = asyncio.ensure_future(awaitable)
+            except Exception as e:
+                future.set_exception(e)
+                return
+            def done(task):
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+            task.add_done_callback(done)
+        self.loop.call_soon_threadsafe(schedule)
+        return future
+
+
+def wait_for(value):
+    # Blocks until an awaitable value is computed
+    if not is_awaitable(value):
+        return value
+    return EventLoopThread.get().submit(value).result()
+
+
+class AsyncGenerator(Iterator):
+    """
+    A synchronous iterator over an asynchronous generator (or a single coroutine) that runs on the event loop
+    """
+    def __init__(self, generator, transform=lambda v: v):
+        self.generator = generator
+        self.transform = transform
+        self.future = None
+        self.terminated = False
+    def _next_awaitable(self):
+        if inspect.isawaitable(self.generator):
+            coroutine, self.generator = self.generator, None
+            return coroutine
+        if self.generator is None:
+            raise StopIteration()
+        return self.generator.__anext__()
+    def prefetch(self):
+        if self.terminated:
+            return False
+        if self.future is None:
+            try:
+                self.future = EventLoopThread.get().submit(self._next_awaitable())
+            except StopIteration:
+                self.terminated = True
+                return False
+        return True
+    def next(self):
+        if not self.prefetch():
+            raise StopIteration()
+        future, self.future = self.future, None
+        try:
+            return self.transform(future.result())
+        except StopAsyncIteration:
+            self.terminated = True
+            raise StopIteration()
+    __next__ = next
+
+
+def from_async(generator):
+    # Wraps the output of a procedure that was not converted using the from_ methods
+    if (asyncio is None) or not (inspect.isawaitable(generator) or hasattr(generator, '__anext__')):
+        return generator
+    if inspect.isawaitable(generator):
+        return BoundedGenerator(AsyncGenerator(generator), max_calls=1)
+    return AsyncGenerator(generator)
+
+
+def from_async_list_gen_fn(list_gen_fn):
+    return lambda *args, **kwargs: AsyncGenerator(list_gen_fn(*args, **kwargs))
+
+
+def from_async_gen_fn(gen_fn):
+    return lambda *args, **kwargs: AsyncGenerator(gen_fn(*args, **kwargs), transform=list_from_outputs)
+
+
+def from_async_list_fn(list_fn, transform=lambda v: v):
+    return lambda *args, **kwargs: BoundedGenerator(
+        AsyncGenerator(list_fn(*args, **kwargs), transform=transform), max_calls=1)
+
+##################################################
+
+# Batched procedures map a list of input tuples to a list of outputs (one per input tuple)
+# Each call is deferred until its result is needed, at which point every pending call is evaluated at once
+# Algorithms group calls by prefetching the queued instances of the same external
+
+class BatchCall(object):
+    def __init__(self, batch, input_values):
+        self.batch = batch
+        self.input_values = input_values
+        self.event = threading.Event() # Set once evaluated, possibly by another thread
+        self.value = None
+        self.error = None
+    @property
+    def done(self):
+        return self.event.is_set()
+    def set_result(self, value):
+        self.value = value
+        self.event.set()
+    def set_error(self, error):
+        self.error = error
+        self.event.set()
+    def result(self):
+        # Same interface as concurrent.futures.Future
+        if not self.done:
+            self.batch.flush(self)
+            self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+    def __repr__(self):
+        return '{}{}'.format(self.__class__.__name__, self.input_values)
+
+
+class BatchFn(object):
+    """
+    A function over individual inputs that evaluates batch_fn on many inputs at once
+    Can be directly used as the procedure of a Function or Predicate
+    If batch_fn raises, the exception is raised by the result of each call in the batch
+    :param batch_fn: a function from a list of input tuples to a list of outputs with the same length
+    :param max_batch_size: the maximum number of input tuples passed to a single batch_fn call
+    """
+    def __init__(self, batch_fn, max_batch_size=INF):
+        assert 1 <= max_batch_size
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.pending = deque()
+        self.lock = threading.RLock()
+        self.num_batches = 0
+        self.num_calls = 0
+    def submit(self, input_values):
+        call = BatchCall(self, tuple(input_values))
+        with self.lock:
+            self.pending.append(call)
+        return call
+    def flush(self, call=None):
+        # Evaluates call along with the other pending calls
+        # The lock is released while batch_fn runs so that other threads can submit calls
+        with self.lock:
+            calls = []
+            if call is not None:
+                if call not in self.pending:
+                    return # Already evaluated or being evaluated by another thread
+                self.pending.remove(call)
+                calls.append(call)
+            while self.pending and (len(calls) < self.max_batch_size):
+                calls.append(self.pending.popleft())
+            if not calls:
+                return
+        try:
+            outputs = list(self.batch_fn([c.input_values for c in calls]))
+            if len(outputs) != len(calls):
+                raise ValueError('Batch function returned {} outputs for {} inputs'.format(len(outputs), len(calls)))
+        except Exception as e:
+            for c in calls:
+                c.set_error(e)
+            return
+        with self.lock:
+            self.num_batches += 1
+            self.num_calls += len(calls)
+        for c, output in zip(calls, outputs):
+            c.set_result(output)
+    def __call__(self, *input_values):
+        return self.submit(input_values).result()
+    def __repr__(self):
+        return '{}(batches={}, calls={}, pending={})'.format(
+            self.__class__.__name__, self.num_batches, self.num_calls, len(self.pending))
+
+
+class BatchGenerator(Iterator):
+    """
+    A synchronous iterator over a single deferred call of a BatchFn
+    """
+    def __init__(self, batch, input_values, transform=lambda v: v):
+        self.batch = batch
+        self.input_values = input_values
+        self.transform = transform
+        self.call = None
+        self.terminated = False
+    def prefetch(self):
+        if self.terminated:
+            return False
+        if self.call is None:
+            self.call = self.batch.submit(self.input_values)
+        return True
+    def next(self):
+        if not self.prefetch():
+            raise StopIteration()
+        self.terminated = True
+        return self.transform(self.call.result())
+    __next__ = next
+
+
+def get_batch(procedure):
+    # Returns the BatchFn underlying a procedure or None
+    if isinstance(procedure, BatchFn):
+        return procedure
+    return getattr(procedure, 'batch', None)
+
+
+def from_batch_list_fn(batch_list_fn, max_batch_size=INF, transform=lambda v: v):
+    batch = BatchFn(batch_list_fn, max_batch_size=max_batch_size)
+    def gen_fn(*input_values):
+        return BoundedGenerator(BatchGenerator(batch, input_values, transform=transform), max_calls=1)
+    gen_fn.batch = batch
+    return gen_fn
+
+
+def from_batch_fn(batch_fn, max_batch_size=INF):
+    # batch_fn maps a list of input tuples to a list of output tuples (or None upon failure)
+    return from_batch_list_fn(batch_fn, max_batch_size=max_batch_size, transform=list_from_outputs)
+
+
+def from_batch_test(batch_test, max_batch_size=INF):
+    # batch_test maps a list of input tuples to a list of booleans
+    return from_batch_list_fn(batch_test, max_batch_size=max_batch_size,
+                              transform=lambda b: list_from_outputs(outputs_from_boolean(b)))
+
+##################################################
+
 def accelerate_list_gen_fn(list_gen_fn, num_elements=1, max_attempts=1, max_time=INF):
     """
     Accelerates a list_gen_fn by eagerly generating num_elements at a time if possible
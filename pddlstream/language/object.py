@@ -1,5 +1,7 @@
 from collections import namedtuple
-from itertools import count
+from threading import RLock, local
+from weakref import WeakValueDictionary
+
 from pddlstream.language.constants import get_parameter_name
 from pddlstream.utils import str_from_object, is_hashable
 
@@ -7,31 +9,56 @@ USE_HASH = True
 USE_OBJ_STR = True
 USE_OPT_STR = True
 #USE_STRING = False
+WEAK_OBJECTS = True # Evicts objects that are no longer referenced between solves
+
+# Objects are registered per outermost solve (see reset_objects, ObjectScope, and SolveScope)
+# Names are unique and stable within a scope because indices are never reused
+# Objects are retained while a solve is active, so a value is never re-created with a new name mid-solve
+
+solve_state = local() # The depth of the solves within each thread
+
+def new_registry():
+    return WeakValueDictionary() if WEAK_OBJECTS else {}
 
 class Object(object):
+    __slots__ = ['value', 'index', 'pddl', 'stream_instance', '__weakref__']
     _prefix = 'v' # o
-    _obj_from_id = {}
-    _obj_from_value = {}
-    _obj_from_name = {}
+    _obj_from_id = new_registry()
+    _obj_from_value = new_registry()
+    _obj_from_name = new_registry()
+    _named = [] # Named objects (e.g. constants) are often referenced only through their name
+    _retained = [] # Strong references to the objects registered since the last release_objects
+    _next_index = 0
+    _lock = RLock() # Objects can be created by concurrent sampling threads
     def __init__(self, value, stream_instance=None, name=None):
         # TODO: unique vs hash
         self.value = value
-        self.index = len(Object._obj_from_name)
+        with Object._lock:
+            self.index = Object._next_index
+            Object._next_index += 1
         if name is None:
             name = '{}{}'.format(self._prefix, self.index)
+        else:
+            Object._named.append(self)
         #if USE_STRING and isinstance(value, str):
         #    name = value
         self.pddl = name
         self.stream_instance = stream_instance # TODO: store first created stream instance
+        self._register()
+    def _register(self):
         Object._obj_from_id[id(self.value)] = self
         Object._obj_from_name[self.pddl] = self
-        if is_hashable(value):
+        if is_hashable(self.value):
             Object._obj_from_value[self.value] = self
+        if WEAK_OBJECTS:
+            Object._retained.append(self)
     @staticmethod
     def from_id(value):
-        if id(value) not in Object._obj_from_id:
-            return Object(value)
-        return Object._obj_from_id[id(value)]
+        with Object._lock:
+            obj = Object._obj_from_id.get(id(value))
+            if (obj is None) or (obj.value is not value): # ids are reused once a value is freed
+                return Object(value)
+            return obj
     @staticmethod
     def has_value(value):
         if USE_HASH and not is_hashable(value):
@@ -41,12 +68,23 @@ class Object(object):
     def from_value(value):
         if USE_HASH and not is_hashable(value):
             return Object.from_id(value)
-        if value not in Object._obj_from_value:
-            return Object(value)
-        return Object._obj_from_value[value]
+        with Object._lock:
+            obj = Object._obj_from_value.get(value)
+            if obj is None:
+                return Object(value)
+            return obj
     @staticmethod
     def from_name(name):
         return Object._obj_from_name[name]
+    @staticmethod
+    def reset():
+        with Object._lock:
+            Object._obj_from_id = new_registry()
+            Object._obj_from_value = new_registry()
+            Object._obj_from_name = new_registry()
+            Object._named = []
+            Object._retained = []
+            Object._next_index = 0
     def __lt__(self, other): # For heapq on python3
         return self.index < other.index
     def __repr__(self):
@@ -60,34 +98,151 @@ class Object(object):
 UniqueOptValue = namedtuple('UniqueOpt', ['instance', 'sequence_index', 'output_index'])
 
 class OptimisticObject(object):
+    __slots__ = ['value', 'param', 'index', 'pddl', 'repr_name', '__weakref__']
     _prefix = '#o' # $ % #
-    _obj_from_inputs = {}
-    _obj_from_name = {}
+    _obj_from_inputs = new_registry()
+    _obj_from_name = new_registry()
     _count_from_prefix = {}
+    _retained = []
+    _next_index = 0
     def __init__(self, value, param):
         # TODO: store first created instance
         self.value = value
         self.param = param
-        self.index = len(OptimisticObject._obj_from_inputs)
+        with Object._lock:
+            self.index = OptimisticObject._next_index
+            OptimisticObject._next_index += 1
         self.pddl = '{}{}'.format(self._prefix, self.index)
-        OptimisticObject._obj_from_inputs[(value, param)] = self
-        OptimisticObject._obj_from_name[self.pddl] = self
+        self._register()
         self.repr_name = self.pddl
         if USE_OPT_STR and isinstance(self.param, UniqueOptValue):
             parameter = self.param.instance.external.outputs[self.param.output_index]
             prefix = get_parameter_name(parameter)[:1]
-            var_index = next(self._count_from_prefix.setdefault(prefix, count()))
+            with Object._lock:
+                var_index = OptimisticObject._count_from_prefix.get(prefix, 0)
+                OptimisticObject._count_from_prefix[prefix] = var_index + 1
             self.repr_name = '#{}{}'.format(prefix, var_index) #self.index)
+    def _register(self):
+        OptimisticObject._obj_from_inputs[(self.value, self.param)] = self
+        OptimisticObject._obj_from_name[self.pddl] = self
+        if WEAK_OBJECTS:
+            OptimisticObject._retained.append(self)
     @staticmethod
     def from_opt(value, param):
         key = (value, param)
-        if key not in OptimisticObject._obj_from_inputs:
+        obj = OptimisticObject._obj_from_inputs.get(key)
+        if obj is None:
             return OptimisticObject(value, param)
-        return OptimisticObject._obj_from_inputs[key]
+        return obj
     @staticmethod
     def from_name(name):
         return OptimisticObject._obj_from_name[name]
+    @staticmethod
+    def reset():
+        OptimisticObject._obj_from_inputs = new_registry()
+        OptimisticObject._obj_from_name = new_registry()
+        OptimisticObject._count_from_prefix = {}
+        OptimisticObject._retained = []
+        OptimisticObject._next_index = 0
     def __lt__(self, other): # For heapq on python3
         return self.index < other.index
     def __repr__(self):
         return self.repr_name
+
+##################################################
+
+# Other per-solve tables that refer to objects register their class attributes here
+REGISTRY_ATTRIBUTES = {
+    Object: ['_obj_from_id', '_obj_from_value', '_obj_from_name', '_named', '_retained', '_next_index'],
+    OptimisticObject: ['_obj_from_inputs', '_obj_from_name', '_count_from_prefix', '_retained', '_next_index'],
+}
+
+def save_objects():
+    return {cls: [getattr(cls, attribute) for attribute in attributes]
+            for cls, attributes in REGISTRY_ATTRIBUTES.items()}
+
+def restore_objects(saved):
+    for cls, values in saved.items():
+        for attribute, value in zip(REGISTRY_ATTRIBUTES[cls], values):
+            setattr(cls, attribute, value)
+
+def reset_objects():
+    for cls in REGISTRY_ATTRIBUTES:
+        cls.reset()
+
+# Per-solve tables keyed on objects that are reset (rather than evicted) once every solve has finished
+RELEASED_TABLES = []
+
+def release_objects():
+    # Objects that are no longer referenced can then be evicted from the weak registries
+    with Object._lock:
+        Object._retained = []
+        OptimisticObject._retained = []
+        for cls in RELEASED_TABLES:
+            cls.reset()
+
+def get_object_state():
+    # A picklable copy of the registries, which hold weak references
+    with Object._lock:
+        return {
+            Object: (sorted(Object._obj_from_name.values()), Object._next_index, list(Object._named)),
+            OptimisticObject: (sorted(OptimisticObject._obj_from_name.values()), OptimisticObject._next_index,
+                               dict(OptimisticObject._count_from_prefix)),
+        }
+
+def set_object_state(state):
+    # Replaces the current objects with those from get_object_state (e.g. after unpickling)
+    reset_objects()
+    objects, Object._next_index, Object._named = state[Object]
+    for obj in objects:
+        obj._register()
+    opt_objects, OptimisticObject._next_index, opt_counts = state[OptimisticObject]
+    OptimisticObject._count_from_prefix = dict(opt_counts)
+    for obj in opt_objects:
+        obj._register()
+
+class ObjectScope(object):
+    """
+    Isolates the objects created within a block (e.g. a solve called from within a stream or a session of solves)
+    The enclosing objects are restored upon exit
+    """
+    depth = 0
+    def __enter__(self):
+        self.saved = save_objects()
+        reset_objects()
+        ObjectScope.depth += 1
+        return self
+    def __exit__(self, *args):
+        ObjectScope.depth -= 1
+        restore_objects(self.saved)
+
+def in_object_scope():
+    return 0 < ObjectScope.depth
+
+def get_solve_depth():
+    return getattr(solve_state, 'depth', 0)
+
+class SolveScope(object):
+    """
+    Marks a solve in progress so that a solve called from within another (e.g. from a stream) shares its objects
+    Solves running concurrently in other threads also share the objects, which are released once all have finished
+    """
+    active = 0 # The number of threads with a solve in progress
+    def __enter__(self):
+        depth = get_solve_depth()
+        if depth == 0:
+            with Object._lock:
+                SolveScope.active += 1
+        solve_state.depth = depth + 1
+        return self
+    def __exit__(self, *args):
+        solve_state.depth = get_solve_depth() - 1
+        if solve_state.depth == 0:
+            with Object._lock:
+                SolveScope.active -= 1
+                if (SolveScope.active == 0) and not in_object_scope():
+                    release_objects()
+
+def in_outermost_solve():
+    # Only the outermost solve outside of an ObjectScope, while no other thread is solving, owns the registries
+    return not in_object_scope() and (get_solve_depth() <= 1) and (SolveScope.active <= 1)
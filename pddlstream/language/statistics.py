@@ -2,19 +2,34 @@ from __future__ import print_function
 
 import os
 
-from collections import Counter
+from threading import Lock
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None # Falls back to the legacy pickle
+
 from pddlstream.utils import INF, read_pickle, ensure_dir, write_pickle, get_python_version
 
 
 DATA_DIR = 'statistics/py{:d}/'
+DATABASE_NAME = 'statistics.db'
+DATABASE_TIMEOUT = 60 # Seconds to wait for a concurrent solve to release the database
+
+# Each solve adds its own calls to the totals within a single transaction, so parallel solves don't clobber each other
+# The stored statistics have a fixed size per external, so loading is independent of the number of runs
+# Only the sufficient statistics of the estimates are stored (the inter-success gaps are never read)
 
 # TODO: write to a "local" folder containing temp, data2, data3, visualizations
 # TODO: ability to "burn in" streams by sampling artificially to get better estimates
 
+def get_data_dir():
+    return DATA_DIR.format(get_python_version())
+
 def get_data_path(stream_name):
-    data_dir = DATA_DIR.format(get_python_version())
+    # Legacy pickle written by previous versions
     file_name = '{}.pkl'.format(stream_name)
-    return os.path.join(data_dir, file_name)
+    return os.path.join(get_data_dir(), file_name)
 
 
 def load_data(stream_name):
@@ -23,12 +38,89 @@ def load_data(stream_name):
         return {}
     return read_pickle(filename)
 
+##################################################
+
+class StatisticsDatabase(object):
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = os.path.join(get_data_dir(), DATABASE_NAME)
+        ensure_dir(filename)
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, timeout=DATABASE_TIMEOUT, isolation_level=None)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS externals (pddl TEXT, name TEXT, '
+                                'calls INTEGER, overhead REAL, successes INTEGER, PRIMARY KEY (pddl, name))')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS planners (name TEXT PRIMARY KEY, '
+                                'runs INTEGER, wins INTEGER, runtime REAL)')
+    def _add(self, pddl_name, name, calls, overhead, successes):
+        # Assumes a transaction is open
+        self.connection.execute('INSERT OR IGNORE INTO externals VALUES (?, ?, 0, 0, 0)', (pddl_name, name))
+        self.connection.execute('UPDATE externals SET calls = calls + ?, overhead = overhead + ?, '
+                                'successes = successes + ? WHERE pddl = ? AND name = ?',
+                                (calls, overhead, successes, pddl_name, name))
+    def _migrate(self, pddl_name):
+        # Imports the legacy pickle the first time a domain is loaded
+        # Assumes a transaction is open
+        if self.connection.execute('SELECT 1 FROM externals WHERE pddl = ? LIMIT 1', (pddl_name,)).fetchone():
+            return
+        for name, statistics in load_data(pddl_name).items():
+            self._add(pddl_name, name, statistics['calls'], statistics['overhead'], statistics['successes'])
+    def load(self, pddl_name):
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            self._migrate(pddl_name)
+            rows = self.connection.execute('SELECT name, calls, overhead, successes FROM externals '
+                                           'WHERE pddl = ?', (pddl_name,)).fetchall()
+            self.connection.execute('COMMIT')
+        except Exception:
+            self.connection.execute('ROLLBACK')
+            raise
+        return {name: {'calls': calls, 'overhead': overhead, 'successes': successes}
+                for name, calls, overhead, successes in rows}
+    def update(self, pddl_name, updates):
+        # updates: a list of (name, calls, overhead, successes) that are added atomically
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            self._migrate(pddl_name)
+            for update in updates:
+                self._add(pddl_name, *update)
+            self.connection.execute('COMMIT')
+        except Exception:
+            self.connection.execute('ROLLBACK')
+            raise
+    def load_planners(self):
+        return {name: {'runs': runs, 'wins': wins, 'runtime': runtime} for name, runs, wins, runtime in
+                self.connection.execute('SELECT name, runs, wins, runtime FROM planners').fetchall()}
+    def update_planners(self, updates):
+        # updates: a list of (name, runs, wins, runtime) that are added atomically
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            for name, runs, wins, runtime in updates:
+                self.connection.execute('INSERT OR IGNORE INTO planners VALUES (?, 0, 0, 0)', (name,))
+                self.connection.execute('UPDATE planners SET runs = runs + ?, wins = wins + ?, '
+                                        'runtime = runtime + ? WHERE name = ?', (runs, wins, runtime, name))
+            self.connection.execute('COMMIT')
+        except Exception:
+            self.connection.execute('ROLLBACK')
+            raise
+    def close(self):
+        self.connection.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+##################################################
+
 def load_stream_statistics(externals):
     if not externals:
         return
     pddl_name = externals[0].pddl_name # TODO: ensure the same
     # TODO: fresh restart flag
-    data = load_data(pddl_name)
+    if sqlite3 is None:
+        data = load_data(pddl_name)
+    else:
+        with StatisticsDatabase() as database:
+            data = database.load(pddl_name)
     for external in externals:
         if external.name in data:
             statistics = data[external.name]
@@ -53,6 +145,22 @@ def dump_total_statistics(externals):
         external.dump_total()
         # , external.get_effort()) #, data[external.name])
 
+def get_gap_distribution(external):
+    distribution = []
+    for instance in external.instances.values():
+        if instance.results_history:
+            #attempts = len(instance.results_history)
+            #successes = sum(map(bool, instance.results_history))
+            #print(instance, successes, attempts)
+            # TODO: also first attempt, first success
+            last_success = -1
+            for i, results in enumerate(instance.results_history):
+                if results:
+                    distribution.append(i - last_success)
+                    #successful = (0 <= last_success)
+                    last_success = i
+    return distribution
+
 def write_stream_statistics(externals, verbose):
     # TODO: estimate conditional to affecting history on skeleton
     # TODO: estimate conditional to first & attempt and success
@@ -64,43 +172,38 @@ def write_stream_statistics(externals, verbose):
         #dump_local_statistics(externals)
         dump_total_statistics(externals)
     pddl_name = externals[0].pddl_name # TODO: ensure the same
-    previous_data = load_data(pddl_name)
-    data = {}
+    if sqlite3 is None:
+        write_legacy_statistics(pddl_name, externals, verbose)
+        return
+    updates = []
     for external in externals:
-        #total_calls = 0 # TODO: compute these values
-        previous_statistics = previous_data.get(external.name, {})
         # TODO: compute distribution of successes given feasible
         # TODO: can estimate probability of success given feasible
         # TODO: single tail hypothesis testing (probability that came from this distribution)
-
         if not hasattr(external, 'instances'):
             continue # TODO: SynthesizerStreams
-        distribution = []
-        for instance in external.instances.values():
-            if instance.results_history:
-                #attempts = len(instance.results_history)
-                #successes = sum(map(bool, instance.results_history))
-                #print(instance, successes, attempts)
-                # TODO: also first attempt, first success
-                last_success = -1
-                for i, results in enumerate(instance.results_history):
-                    if results:
-                        distribution.append(i - last_success)
-                        #successful = (0 <= last_success)
-                        last_success = i
-        combined_distribution = previous_statistics.get('distribution', []) + distribution
-        #print(external, distribution)
-        #print(external, Counter(combined_distribution))
         # TODO: count num failures as well
         # Alternatively, keep metrics on the lower bound and use somehow
         # Could assume that it is some other distribution beyond that point
+        # Only the calls from this solve are added because the totals include the loaded statistics
+        updates.append((external.name, external.online_calls, external.online_overhead, external.online_success))
+    with StatisticsDatabase() as database:
+        database.update(pddl_name, updates)
+        if verbose:
+            print('Wrote:', database.filename)
+
+def write_legacy_statistics(pddl_name, externals, verbose):
+    # Rewrites the whole pickle, so parallel solves can overwrite each other
+    data = load_data(pddl_name)
+    for external in externals:
+        if not hasattr(external, 'instances'):
+            continue # TODO: SynthesizerStreams
         data[external.name] = {
             'calls': external.total_calls,
             'overhead': external.total_overhead,
             'successes': external.total_successes,
-            'distribution': combined_distribution,
+            'distribution': data.get(external.name, {}).get('distribution', []) + get_gap_distribution(external),
         }
-
     filename = get_data_path(pddl_name)
     ensure_dir(filename)
     write_pickle(filename, data)
@@ -136,6 +239,7 @@ def geometric_cost(cost, p):
 # P(Success | History) = P(Success | Samples) * P(Samples | History)
 
 class Performance(object):
+    _lock = Lock() # Statistics can be updated by concurrent sampling threads
     def __init__(self, name, info):
         self.name = name.lower()
         self.info = info
@@ -147,12 +251,13 @@ class Performance(object):
         self.online_success = 0
 
     def update_statistics(self, overhead, success):
-        self.total_calls += 1
-        self.total_overhead += overhead
-        self.total_successes += success
-        self.online_calls += 1
-        self.online_overhead += overhead
-        self.online_success += success
+        with self._lock:
+            self.total_calls += 1
+            self.total_overhead += overhead
+            self.total_successes += success
+            self.online_calls += 1
+            self.online_overhead += overhead
+            self.online_success += success
 
     def _estimate_p_success(self, reg_p_success=1, reg_calls=1):
         # TODO: use prior from info instead?
@@ -1,14 +1,19 @@
 import time
-from collections import Counter, defaultdict, namedtuple, Sequence
+from collections import Counter, defaultdict, namedtuple
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
 from itertools import count
 
 from pddlstream.algorithms.downward import make_preconditions, make_parameters
 from pddlstream.language.constants import AND, get_prefix, get_args, is_parameter
+from pddlstream.language.cache import get_cache_key
 from pddlstream.language.conversion import list_from_conjunction, remap_objects, \
     substitute_expression, get_formula_operators, evaluation_from_fact, values_from_objects, obj_from_value_expression
 from pddlstream.language.external import ExternalInfo, Result, Instance, External, DEBUG, get_procedure_fn, \
     parse_lisp_list
-from pddlstream.language.generator import get_next, from_fn
+from pddlstream.language.generator import get_next, from_fn, from_async, prefetch_next, get_batch
 from pddlstream.language.object import Object, OptimisticObject, UniqueOptValue
 from pddlstream.utils import str_from_object, get_mapping, irange
 
@@ -93,9 +98,9 @@ class DebugValue(object): # TODO: could just do an object
 
 class StreamInfo(ExternalInfo):
     def __init__(self, opt_gen_fn=PartialInputs(unique=DEFAULT_UNIQUE), eager=False,
-                 p_success=None, overhead=None, negate=False, effort_fn=None, simultaneous=False):
+                 p_success=None, overhead=None, negate=False, effort_fn=None, simultaneous=False, cache=None):
         # TODO: could change frequency/priority for the incremental algorithm
-        super(StreamInfo, self).__init__(eager, p_success, overhead, effort_fn)
+        super(StreamInfo, self).__init__(eager, p_success, overhead, effort_fn, cache=cache)
         self.opt_gen_fn = opt_gen_fn
         self.negate = negate
         self.simultaneous = simultaneous
@@ -116,13 +121,15 @@ class StreamResult(Result):
         return self.certified
     def get_tuple(self):
         return self.external.name, self.instance.input_objects, self.output_objects
-    def remap_inputs(self, bindings):
+    def remap_instance(self, bindings):
         input_objects = remap_objects(self.instance.input_objects, bindings)
         fluent_facts = [(get_prefix(f),) + remap_objects(get_args(f), bindings)
                         for f in self.instance.fluent_facts]
         new_instance = self.external.get_instance(input_objects, fluent_facts=fluent_facts)
         new_instance.opt_index = self.instance.opt_index
-        return self.__class__(new_instance, self.output_objects, self.opt_index)
+        return new_instance
+    def remap_inputs(self, bindings):
+        return self.__class__(self.remap_instance(bindings), self.output_objects, self.opt_index)
     def is_successful(self):
         return True
     def __repr__(self):
@@ -139,6 +146,7 @@ class StreamInstance(Instance):
         self.axiom_predicate = None
         self.disabled_axiom = None
         self.num_optimistic = 1
+        self._cache_index = 0 # Number of outputs consumed from the cache
 
     def _check_output_values(self, new_values):
         if not isinstance(new_values, Sequence):
@@ -177,10 +185,65 @@ class StreamInstance(Instance):
             except TypeError as err:
                 print('Stream [{}] expects {} inputs'.format(self.external.name, len(input_values)))
                 raise err
+            self._generator = from_async(self._generator)
+
+    def __getstate__(self):
+        # Generators cannot be pickled, so a resumed instance restarts its generator
+        state = self.__dict__.copy()
+        state['_generator'] = None
+        return state
+
+    def get_cache_key(self):
+        if (self.external.info.cache is not None) and (self._cache_key is None):
+            self._cache_key = get_cache_key(self.external.name, self.get_input_values(),
+                                            fluent_values=self.get_fluent_values())
+        return self._cache_key
+
+    def _get_cached_outputs(self):
+        key = self.get_cache_key()
+        if key is None:
+            return None
+        return self.external.info.cache.get(key, (tuple(), False))
+
+    def _from_cache(self, cached):
+        # Whether the next output is determined by the cache rather than the generator
+        # Once outputs have been replayed, the instance is enumerated from the cache instead of creating a generator
+        # (which would have to be called again to skip the replayed outputs)
+        outputs, enumerated = cached
+        return (self._cache_index < len(outputs)) or enumerated or \
+               ((self._generator is None) and (0 < self._cache_index))
+
+    def prefetch(self):
+        if self.enumerated:
+            return False
+        cached = self._get_cached_outputs()
+        if (cached is not None) and self._from_cache(cached):
+            return False
+        self._create_generator()
+        return prefetch_next(self._generator)
+
+    def _next_output(self):
+        # Replays the outputs from previous calls with the same inputs before calling the generator
+        cached = self._get_cached_outputs()
+        if cached is None:
+            self._create_generator()
+            return get_next(self._generator, default=None)
+        outputs, enumerated = cached
+        if self._cache_index < len(outputs):
+            self._cache_index += 1
+            return outputs[self._cache_index - 1], enumerated and (len(outputs) <= self._cache_index)
+        if self._from_cache(cached):
+            return None, True
+        self._create_generator()
+        output, enumerated = get_next(self._generator, default=None)
+        if output is not None: # Each cached output corresponds to one call of the generator
+            outputs += (output,)
+            self._cache_index += 1
+        self.external.info.cache.set(self.get_cache_key(), (outputs, enumerated))
+        return output, enumerated
 
     def _next_outputs(self):
-        self._create_generator()
-        output, self.enumerated = get_next(self._generator, default=None)
+        output, self.enumerated = self._next_output()
         if output is None:
             return [], []
         if not self.external.is_wild:
@@ -333,10 +396,15 @@ class Stream(External):
     def is_negated(self):
         return self.info.negate
 
+    def get_batch(self):
+        return get_batch(self.gen_fn)
+
     def get_instance(self, input_objects, fluent_facts=frozenset()):
         key = (tuple(input_objects), frozenset(fluent_facts))
         if key not in self.instances:
-            self.instances[key] = self._Instance(self, input_objects, fluent_facts)
+            with External._instance_lock: # Instantiated by both the sampling and a pipelined search
+                if key not in self.instances:
+                    self.instances[key] = self._Instance(self, input_objects, fluent_facts)
         return self.instances[key]
 
     def __repr__(self):
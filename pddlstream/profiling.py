@@ -0,0 +1,133 @@
+from __future__ import print_function
+
+import csv
+import json
+import os
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from functools import wraps
+
+from pddlstream.utils import ensure_dir
+
+# Named spans recorded in an in-memory trace that is reset at the start of each solve
+# The trace is returned as solution.trace and can be exported as Chrome trace JSON (chrome://tracing) or CSV
+
+ENABLE_PROFILING = True
+
+SOLVER = 'solver'
+EXTERNAL = 'external'
+
+Span = namedtuple('Span', ['name', 'category', 'start', 'duration', 'thread', 'args'])
+
+class Trace(object):
+    def __init__(self):
+        self.start_time = time.time()
+        self.spans = []
+        self.lock = threading.Lock() # Spans can be recorded by concurrent sampling threads
+    def add(self, name, start_time, duration, category=SOLVER, args={}):
+        span = Span(name, category, start_time - self.start_time, duration,
+                    threading.current_thread().name, dict(args))
+        with self.lock:
+            self.spans.append(span)
+        return span
+    def __len__(self):
+        return len(self.spans)
+    def __iter__(self):
+        return iter(list(self.spans))
+    def summarize(self, category=None):
+        # Returns the number of spans and their total duration for each name
+        summary = OrderedDict()
+        for span in sorted(self, key=lambda s: s.start):
+            if (category is not None) and (span.category != category):
+                continue
+            num, total = summary.get(span.name, (0, 0.))
+            summary[span.name] = (num + 1, total + span.duration)
+        return summary
+    def dump(self, category=None):
+        for name, (num, total) in sorted(self.summarize(category).items(), key=lambda p: -p[1][1]):
+            print('{}: {} | {:.3f} total | {:.3f} average'.format(name, num, total, total / num))
+    def to_chrome(self):
+        threads = {}
+        events = []
+        for span in self:
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X', # Complete event
+                'ts': 1e6*span.start, # Microseconds
+                'dur': 1e6*span.duration,
+                'pid': os.getpid(),
+                'tid': threads.setdefault(span.thread, len(threads)),
+                'args': {key: str(value) for key, value in span.args.items()},
+            })
+        for thread, tid in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                           'tid': tid, 'args': {'name': thread}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+    def write_chrome(self, filename):
+        if os.path.dirname(filename):
+            ensure_dir(filename)
+        with open(filename, 'w') as f:
+            json.dump(self.to_chrome(), f)
+    def write_csv(self, filename):
+        if os.path.dirname(filename):
+            ensure_dir(filename)
+        with open(filename, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(Span._fields)
+            for span in sorted(self, key=lambda s: s.start):
+                writer.writerow(span[:-1] + (json.dumps({k: str(v) for k, v in span.args.items()}),))
+    def __getstate__(self):
+        return self.start_time, self.spans
+    def __setstate__(self, state):
+        self.start_time, self.spans = state
+        self.lock = threading.Lock()
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, len(self))
+
+##################################################
+
+current_trace = Trace()
+
+def get_trace():
+    return current_trace
+
+def reset_trace():
+    global current_trace
+    current_trace = Trace()
+    return current_trace
+
+def add_span(name, start_time, category=SOLVER, **kwargs):
+    # Records a span that started at start_time and ends now
+    if ENABLE_PROFILING:
+        current_trace.add(name, start_time, time.time() - start_time, category=category, args=kwargs)
+
+
+class profile(object):
+    """
+    Records the duration of a block as a span
+    with profile('translate'):
+        ...
+    """
+    def __init__(self, name, category=SOLVER, **kwargs):
+        self.name = name
+        self.category = category
+        self.args = kwargs
+        self.start_time = None
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+    def __exit__(self, *args):
+        add_span(self.name, self.start_time, category=self.category, **self.args)
+
+
+def profiled(name, category=SOLVER):
+    # Decorator that records each call of a function as a span
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profile(name, category=category):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,73 @@
+from pddlstream.language.cache import ResultCache
+from pddlstream.language.generator import from_gen_fn
+from pddlstream.language.object import Object, reset_objects
+from pddlstream.language.stream import Stream, StreamInfo
+
+
+def get_stream(cache, calls):
+    def gen_fn(x):
+        for i in range(3):
+            calls.append(i)
+            yield (x + i,)
+    return Stream('sample', from_gen_fn(gen_fn), ['?x'], [], ['?y'], [('Sample', '?x', '?y')],
+                  StreamInfo(cache=cache))
+
+
+def sample(stream, num):
+    instance = stream.get_instance([Object.from_value(10)])
+    outputs = []
+    for _ in range(num):
+        results, _ = instance.next_results()
+        outputs.extend(tuple(o.value for o in result.output_objects) for result in results)
+    return instance, outputs
+
+
+def test_replay_partial():
+    reset_objects()
+    cache = ResultCache()
+    calls = []
+    _, outputs = sample(get_stream(cache, calls), 2)
+    assert outputs == [(10,), (11,)]
+    num_calls = len(calls)
+
+    # The second run replays the cached outputs and is then enumerated rather than replaying the generator
+    reset_objects()
+    instance, outputs = sample(get_stream(cache, calls), 4)
+    assert outputs == [(10,), (11,)]
+    assert instance.enumerated
+    assert len(calls) == num_calls
+    [(cached_outputs, enumerated)] = [outputs for _, outputs in cache.entries.values()]
+    assert [list(o) for o in cached_outputs] == [[(10,)], [(11,)]]
+    assert not enumerated
+
+
+def test_replay_enumerated():
+    reset_objects()
+    cache = ResultCache()
+    calls = []
+    sample(get_stream(cache, calls), 4)
+    num_calls = len(calls)
+    reset_objects()
+    instance, outputs = sample(get_stream(cache, calls), 4)
+    assert outputs == [(10,), (11,), (12,)]
+    assert instance.enumerated
+    assert len(calls) == num_calls # Entirely replayed
+
+
+def test_expired_entries():
+    cache = ResultCache(max_age=-1)
+    cache.set('key', 1)
+    assert 'key' not in cache
+    assert cache.get('key') is None
+
+
+def test_save_merges(tmpdir):
+    filename = str(tmpdir.join('cache.pkl'))
+    cache1 = ResultCache(filename=filename)
+    cache2 = ResultCache(filename=filename)
+    cache1.set('key1', 1)
+    cache1.save()
+    cache2.set('key2', 2)
+    cache2.save()
+    assert set(ResultCache(filename=filename).entries) == {'key1', 'key2'}
+    assert tmpdir.listdir() == [tmpdir.join('cache.pkl')] # No temporary files remain
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from pddlstream.algorithms.algorithm import SolutionStore
+from pddlstream.algorithms.checkpoint import save_checkpoint, load_checkpoint
+from pddlstream.algorithms.skeleton import SkeletonQueue
+from pddlstream.language.generator import from_gen_fn
+from pddlstream.language.object import reset_objects
+from pddlstream.language.stream import Stream, StreamInfo
+from pddlstream.utils import INF
+
+
+class Domain(object):
+    def __init__(self):
+        self.axioms = []
+
+
+def get_stream():
+    return Stream('sample', from_gen_fn(lambda: iter([(1,)])), [], [], ['?y'], [('Sample', '?y')], StreamInfo())
+
+
+@pytest.mark.parametrize('flushed', [False, True])
+def test_checkpoint_statistics(tmpdir, flushed):
+    reset_objects()
+    path = os.path.join(str(tmpdir), 'checkpoint.pkl')
+    store = SolutionStore(INF, INF, verbose=False)
+    queue = SkeletonQueue(store, evaluations={}, goal_expression=None, domain=None)
+    stream = get_stream()
+    stream.update_statistics(overhead=1., success=True)
+    assert save_checkpoint(path, store, queue, set(), [stream], [], flushed=flushed)
+
+    new_stream = get_stream()
+    load_checkpoint(path, store, [new_stream], Domain())
+    assert (new_stream.total_calls, new_stream.total_successes) == (1, 1)
+    # Online statistics that were already written are not written again by the resumed solve
+    assert new_stream.online_calls == (0 if flushed else 1)
+    assert new_stream.online_success == (0 if flushed else 1)
@@ -0,0 +1,34 @@
+import gc
+
+from pddlstream.algorithms.algorithm import solve_scope
+from pddlstream.language.conversion import FactTable, evaluation_from_fact, fact_from_evaluation
+from pddlstream.language.object import Object, reset_objects
+
+
+def test_interned_facts():
+    reset_objects()
+    x, y = Object.from_value('x'), Object.from_value('y')
+    evaluation = evaluation_from_fact(('On', x, y))
+    assert evaluation_from_fact(('On', x, y)) is evaluation
+    assert fact_from_evaluation(evaluation) is fact_from_evaluation(evaluation_from_fact(('On', x, y)))
+    evaluation_from_fact(('On', y, x))
+    # Facts have compact ids in the order they were interned
+    assert FactTable.size() == 2
+    assert FactTable.from_id(0).evaluation is evaluation
+    # (= (f) 1) and (= (f) True) are different facts
+    assert type(evaluation_from_fact(('=', ('f',), 1)).value) is int
+    assert evaluation_from_fact(('=', ('f',), True)).value is True
+
+
+def test_released_facts():
+    reset_objects()
+    value = ('value',)
+    @solve_scope
+    def solve():
+        evaluation_from_fact(('Holding', Object.from_value(value)))
+        return FactTable.size()
+    assert solve() == 1
+    # The table no longer keeps the objects of a finished solve from being evicted
+    assert FactTable.size() == 0
+    gc.collect()
+    assert not Object.has_value(value)
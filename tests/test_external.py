@@ -0,0 +1,54 @@
+from threading import Thread
+
+from pddlstream.language.external import FrozenInstances
+from pddlstream.language.generator import from_gen_fn
+from pddlstream.language.object import Object, reset_objects
+from pddlstream.language.stream import Stream, StreamInfo
+
+
+def get_stream():
+    return Stream('sample', from_gen_fn(lambda x: iter([(x,)])), ['?x'], [], ['?y'], [('Sample', '?x', '?y')],
+                  StreamInfo())
+
+
+def test_frozen_instances():
+    reset_objects()
+    instance = get_stream().get_instance([Object.from_value(1)])
+    with FrozenInstances():
+        assert not instance.disabled
+        # Another thread (e.g. sampling) updates the instance
+        thread = Thread(target=lambda: setattr(instance, 'disabled', True))
+        thread.start()
+        thread.join()
+        assert not instance.disabled
+    assert instance.disabled
+
+
+def test_frozen_opt_index():
+    reset_objects()
+    instance = get_stream().get_instance([Object.from_value(1)])
+    instance.opt_index = 2
+    with FrozenInstances():
+        assert instance.opt_index == 2
+        thread = Thread(target=lambda: setattr(instance, 'opt_index', 0))
+        thread.start()
+        thread.join()
+        assert instance.opt_index == 2
+        # The search's refinement is written through to the instance
+        instance.opt_index -= 1
+        assert instance.opt_index == 1
+    assert instance.opt_index == 1
+
+
+def test_shared_instances():
+    reset_objects()
+    stream = get_stream()
+    inputs = [Object.from_value(1)]
+    instances = []
+    threads = [Thread(target=lambda: instances.append(stream.get_instance(inputs))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(instance is instances[0] for instance in instances)
+    assert len(stream.instances) == 1
@@ -0,0 +1,45 @@
+import threading
+
+import pytest
+
+from pddlstream.language.generator import BatchFn
+
+
+def test_batch_error():
+    def batch_fn(inputs):
+        raise RuntimeError('batch failed')
+    batch = BatchFn(batch_fn)
+    calls = [batch.submit((x,)) for x in range(3)]
+    # Every call in the failed batch raises the error rather than an unrelated one
+    for call in calls:
+        with pytest.raises(RuntimeError, match='batch failed'):
+            call.result()
+    assert not batch.pending
+    batch.batch_fn = lambda inputs: [x for x, in inputs]
+    assert batch(4) == 4
+
+
+def test_batch_wrong_length():
+    batch = BatchFn(lambda inputs: [])
+    call = batch.submit((1,))
+    with pytest.raises(ValueError):
+        call.result()
+
+
+def test_batch_concurrent_submit():
+    started, release = threading.Event(), threading.Event()
+    def batch_fn(inputs):
+        started.set()
+        release.wait()
+        return [x for x, in inputs]
+    batch = BatchFn(batch_fn)
+    call = batch.submit((1,))
+    thread = threading.Thread(target=call.result)
+    thread.start()
+    started.wait()
+    # Calls can be submitted while batch_fn is running
+    other = batch.submit((2,))
+    release.set()
+    thread.join()
+    assert (call.result(), other.result()) == (1, 2)
+    assert batch.num_batches == 2
@@ -0,0 +1,24 @@
+from pddlstream.algorithms.incremental import process_stream_queue
+from pddlstream.algorithms.instantiation import Instantiator
+from pddlstream.language.conversion import evaluation_from_fact
+from pddlstream.language.evaluations import EvaluationStore
+from pddlstream.language.generator import from_batch_fn
+from pddlstream.language.object import Object, reset_objects
+from pddlstream.language.stream import Stream, StreamInfo
+
+NUM_INSTANCES = 5
+
+
+def test_prefetch_batch():
+    reset_objects()
+    gen_fn = from_batch_fn(lambda inputs: [(x + 1,) for x, in inputs])
+    stream = Stream('increment', gen_fn, ['?x'], [('Num', '?x')], ['?y'], [('Next', '?x', '?y')], StreamInfo())
+    evaluations = EvaluationStore((evaluation_from_fact(('Num', Object.from_value(x))), None)
+                                  for x in range(NUM_INSTANCES))
+    instantiator = Instantiator(evaluations, [stream])
+    assert len(instantiator.stream_queue) == NUM_INSTANCES
+    while instantiator.stream_queue:
+        process_stream_queue(instantiator, evaluations, verbose=False)
+    # Every queued instance is evaluated by the first call
+    assert (gen_fn.batch.num_batches, gen_fn.batch.num_calls) == (1, NUM_INSTANCES)
+    assert not instantiator.batched_from_external
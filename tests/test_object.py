@@ -0,0 +1,49 @@
+import gc
+from threading import Thread
+
+from pddlstream.algorithms.algorithm import solve_scope
+from pddlstream.language.object import Object, ObjectScope, reset_objects, in_outermost_solve
+
+
+@solve_scope
+def solve(depth):
+    # Returns whether each solve (from the outermost to the innermost) would reset the objects
+    outermost = in_outermost_solve()
+    if depth == 0:
+        return [outermost]
+    return [outermost] + solve(depth - 1)
+
+
+def test_nested_solve():
+    assert solve(2) == [True, False, False]
+    assert solve(0) == [True]
+    with ObjectScope():
+        assert solve(0) == [False]
+
+
+def test_concurrent_solve():
+    outcomes = []
+    @solve_scope
+    def outer_solve():
+        # A solve in another thread (e.g. a service) neither resets nor releases this solve's objects
+        thread = Thread(target=lambda: outcomes.extend(solve(0)))
+        thread.start()
+        thread.join()
+        outcomes.append(in_outermost_solve())
+    outer_solve()
+    assert outcomes == [False, True]
+    assert solve(0) == [True]
+
+
+def test_retained_objects():
+    reset_objects()
+    value = ('value',)
+    @solve_scope
+    def sample():
+        index = Object.from_value(value).index
+        gc.collect()
+        # The name of a value is stable throughout a solve even when its object isn't referenced
+        return index == Object.from_value(value).index
+    assert sample()
+    gc.collect()
+    assert not Object.has_value(value)
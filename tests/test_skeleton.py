@@ -0,0 +1,113 @@
+import gc
+import pickle
+import threading
+import weakref
+from itertools import count
+
+from pddlstream.algorithms.skeleton import SkeletonQueue, hash_bindings
+
+names = count()
+
+
+class Value(object):
+    # Named like Object and OptimisticObject
+    def __init__(self):
+        self.pddl = 'v{}'.format(next(names))
+
+
+class Result(object):
+    def __init__(self, *output_objects):
+        self.output_objects = output_objects
+    def get_tuple(self):
+        return 'stream', (), self.output_objects
+
+
+class Store(object):
+    verbose = False
+
+
+class Instance(object):
+    def __init__(self, merged, started=None, wait=None, finished=None):
+        self.merged = merged
+        self.started = started
+        self.wait = wait
+        self.finished = finished
+        self.accelerate = None
+    def get_domain(self):
+        return []
+    def prefetch(self):
+        return False
+    def next_results(self, accelerate=1, verbose=False):
+        self.accelerate = accelerate
+        if self.started is not None:
+            self.started.set()
+        if self.wait is not None:
+            assert self.wait.wait(1)
+        return [], []
+    def disable(self, evaluations, domain):
+        self.merged.append(self)
+        if self.finished is not None:
+            self.finished.set()
+
+
+def get_queue(**kwargs):
+    return SkeletonQueue(store=Store(), evaluations={}, goal_expression=None, domain=None, **kwargs)
+
+
+def test_duplicate_skeletons():
+    queue = get_queue()
+    results = (Result(Value()), Result(Value()))
+    a, b, x, y = Value(), Value(), Value(), Value()
+    root = queue.add_skeleton(results, [0, 0], {}, 0, 0)
+    child = queue.add_skeleton(results[1:], [0], {a: x}, 0, 0, parent=root)
+    assert child is not None
+    assert queue.add_skeleton(results[1:], [0], {a: x}, 0, 0, parent=root) is None
+    assert queue.add_skeleton(results[1:], [0], {a: y}, 0, 0, parent=root) is not None
+    grandchild = queue.add_skeleton([], [], {b: y}, 0, 0, parent=child)
+    assert grandchild.get_bindings() == {a: x, b: y}
+    # The same bindings introduced along a different path
+    assert queue.add_skeleton([], [], {a: x, b: y}, 0, 0, parent=root) is None
+    assert queue.add_skeleton([], [], {a: x, b: y}, 1, 0, parent=root) is not None
+
+
+def test_released_skeletons():
+    queue = get_queue()
+    result = Result(Value())
+    root = queue.add_skeleton((result,), [0], {}, 0, 0)
+    queue.add_skeleton([], [], {Value(): Value()}, 0, 0, parent=root)
+    # The stream plans are referenced only by the queued skeletons
+    reference = weakref.ref(result)
+    del queue.queue[:], root, result
+    gc.collect()
+    assert reference() is None
+    assert len(queue.added) == 2
+
+
+def test_pickled_skeletons():
+    queue = get_queue()
+    a, x = Value(), Value()
+    root = queue.add_skeleton((Result(Value()),), [0], {}, 0, 0)
+    child = queue.add_skeleton([], [], {a: x}, 0, 0, parent=root)
+    # Keys are preserved by pickling, unlike the hashes of the objects
+    new_child = pickle.loads(pickle.dumps(child))
+    assert new_child.bindings_hash == hash_bindings(new_child.merge_bindings())
+    assert new_child.get_key() == child.get_key()
+    new_queue = get_queue()
+    new_queue.added = pickle.loads(pickle.dumps(queue.added))
+    assert not new_queue.mark_added(new_child)
+    assert not new_queue.mark_added(new_child.parent)
+
+
+def test_sample_instances():
+    # The results of each instance are merged as soon as it finishes
+    merged = []
+    started, finished = threading.Event(), threading.Event()
+    slow = Instance(merged, started=started, wait=finished)
+    fast = Instance(merged, wait=started, finished=finished)
+    queue = get_queue(sampling_workers=2)
+    try:
+        assert not queue.sample_instances([slow, fast], accelerate=2)
+    finally:
+        queue.close()
+    assert merged == [fast, slow]
+    assert slow.accelerate == fast.accelerate == 2
@@ -0,0 +1,15 @@
+import pytest
+
+from examples.benchmark.startup import DEFAULT_MODULES, STARTUP_BUDGET, time_import, get_baseline, \
+    get_imported_translator, median
+
+REPETITIONS = 5
+
+
+@pytest.mark.parametrize('module', DEFAULT_MODULES)
+def test_startup(module):
+    # The translator is imported lazily, so short-lived CLI and worker processes start quickly
+    assert not get_imported_translator(module)
+    baseline = median([get_baseline() for _ in range(REPETITIONS)])
+    runtime = median([time_import(module) for _ in range(REPETITIONS)]) - baseline
+    assert runtime <= STARTUP_BUDGET, '{} took {:.3f} > {:.3f} seconds'.format(module, runtime, STARTUP_BUDGET)
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from pddlstream.algorithms.downward import TRANSLATE_PATH, parse_domain, get_problem, task_from_domain_problem, \
+    instantiate_task
+from pddlstream.algorithms.translator import instantiate_domain_problem, get_translator, reset_translators
+from pddlstream.language.conversion import evaluation_from_fact
+from pddlstream.language.object import Object, reset_objects
+
+pytestmark = pytest.mark.skipif(not os.path.exists(TRANSLATE_PATH), reason='FastDownward is not built')
+
+DOMAIN_PDDL = """
+(define (domain motion)
+  (:requirements :strips)
+  (:predicates (Motion ?q1 ?q2) (AtConf ?q))
+  (:action move
+    :parameters (?q1 ?q2)
+    :precondition (and (Motion ?q1 ?q2) (AtConf ?q1))
+    :effect (and (AtConf ?q2) (not (AtConf ?q1)))))
+"""
+
+
+def get_motion_problem(domain, num_confs):
+    confs = [Object.from_value('q{}'.format(i)) for i in range(num_confs)]
+    facts = [('AtConf', confs[0])] + [('Motion', q1, q2) for q1, q2 in zip(confs, confs[1:])]
+    evaluations = list(map(evaluation_from_fact, facts))
+    return get_problem(evaluations, ('AtConf', confs[-1]), domain, unit_costs=True)
+
+
+def get_summary(instantiated):
+    return sorted(action.name for action in instantiated.actions), set(instantiated.atoms)
+
+
+def test_incremental_translation():
+    reset_objects()
+    reset_translators()
+    for num_confs in [3, 5]:
+        # A freshly parsed domain has the same contents, so the translator and its model are reused
+        domain = parse_domain(DOMAIN_PDDL)
+        problem = get_motion_problem(domain, num_confs)
+        expected = get_summary(instantiate_task(task_from_domain_problem(parse_domain(DOMAIN_PDDL), problem)))
+        assert get_summary(instantiate_domain_problem(domain, problem)) == expected
+    translator = get_translator(domain, problem)
+    assert (translator.num_calls, translator.num_rebuilds) == (2, 1)
+
+
+def test_optimistic_translation():
+    reset_objects()
+    reset_translators()
+    domain = parse_domain(DOMAIN_PDDL)
+    base_problem = get_motion_problem(domain, 3)
+    problem = get_motion_problem(domain, 5)
+    expected = get_summary(instantiate_task(task_from_domain_problem(parse_domain(DOMAIN_PDDL), problem)))
+    # The facts outside of base_init extend a copy of the model, which remains valid for later calls
+    assert get_summary(instantiate_domain_problem(domain, problem, base_init=base_problem.init)) == expected
+    # The model would otherwise also reach the optimistic confs
+    assert get_summary(instantiate_domain_problem(domain, base_problem, base_init=base_problem.init)) == \
+           get_summary(instantiate_task(task_from_domain_problem(parse_domain(DOMAIN_PDDL), base_problem)))
+    assert get_translator(domain, problem).num_rebuilds == 1